@@ -0,0 +1,101 @@
+"""
+Measures how long it takes to import each application's entrypoint, using
+`python -X importtime`, and compares it to the baseline in import_time.json.
+
+Run from the repository root:
+
+    python benchmarks/import_time.py            # compare against the baseline
+    python benchmarks/import_time.py --update   # record a new baseline
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASELINE = Path(__file__).parent / "import_time.json"
+MODULES = [
+    "vaccine.worker",
+    "vaccine.vaccine_reg_whatsapp",
+    "vaccine.vaccine_cert",
+    "vaccine.healthcheck_ussd",
+    "vaccine.real411",
+    "mqr.baseline_ussd",
+    "yal.main",
+]
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Measures the import time of each application's entrypoint"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="How many times to import each module"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Fail if any module is this fraction slower than the baseline",
+    )
+    parser.add_argument(
+        "--update", action="store_true", help="Record the results as the new baseline"
+    )
+    parser.add_argument(
+        "--top", type=int, default=0, help="Show the slowest imports for each module"
+    )
+    return parser.parse_args()
+
+
+def import_time(module: str) -> list[tuple[int, int, str]]:
+    """
+    Imports the module in a new interpreter. Returns (self, cumulative, name) in
+    microseconds for each module imported.
+    """
+    result = subprocess.run(  # noqa: S603 - Only runs our own module list
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        times.append((int(self_us), int(cumulative_us), name.strip()))
+    return times
+
+
+def main():
+    args = get_arguments()
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    results = {}
+    regressions = []
+    for module in MODULES:
+        runs = [import_time(module) for _ in range(args.runs)]
+        # The last line is the module itself
+        milliseconds = statistics.median(run[-1][1] for run in runs) / 1000
+        results[module] = round(milliseconds, 1)
+
+        line = f"{module:<32} {milliseconds:8.1f}ms"
+        if module in baseline:
+            change = milliseconds / baseline[module] - 1
+            line += f" {change:+8.1%}"
+            if change > args.threshold:
+                regressions.append(module)
+        print(line)
+        for self_us, _, name in sorted(runs[-1], reverse=True)[: args.top]:
+            print(f"    {name:<60} {self_us / 1000:8.1f}ms")
+
+    if args.update:
+        BASELINE.write_text(json.dumps(results, indent=2) + "\n")
+    elif regressions:
+        print(f"Slower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
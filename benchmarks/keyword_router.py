@@ -0,0 +1,107 @@
+"""
+Measures how long it takes to route the keyword of an inbound message for yal, using
+the compiled keyword router, compared to checking each keyword set in turn and fuzzy
+matching against the whole emergency keyword list with utils.check_keyword.
+
+Run from the repository root:
+
+    python benchmarks/keyword_router.py
+"""
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import yal.main
+from yal import utils
+
+# Inbound messages, roughly in the proportions that we receive them
+INBOUND = [
+    *["1", "2", "3", "4", "5", "0"] * 10,
+    *["Hi", "hello", "Menu", "yes", "no", "Yes, cool with me", "skip"] * 4,
+    *["Ask a question", "Talk to a counsellor", "STOP", "continue"] * 2,
+    "How do I know if I'm pregnant?",
+    "can I get HIV from kissing",
+    "where is the nearest clinic to me",
+    "my boyfriend wants to have sex but I'm not ready, what should I do?",
+    "Is it normal to have a discharge before your period starts every month?",
+    "im so depresed",
+    "I want to kil myself",
+    "sucide",
+    "he hit me",
+    "😀",
+    "",
+]
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Measures the time taken to route inbound keywords for yal"
+    )
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=100_000,
+        help="How many inbound messages to route",
+    )
+    return parser.parse_args()
+
+
+def route_each_set(keyword: str, metadata: dict):
+    """
+    Checks each keyword set in turn, the way the application did before the router
+    """
+    emergency = utils.get_keywords("emergency")
+    if (
+        keyword in yal.main.GREETING_KEYWORDS
+        or keyword in yal.main.UPDATE_SETTINGS
+        or keyword in yal.main.ALL_TRACKING_KEYWORDS
+    ):
+        return yal.main.Application.START_STATE
+    if keyword in emergency:
+        return yal.main.PleaseCallMeApplication.START_STATE
+    if utils.check_keyword(keyword, emergency):
+        return yal.main.PleaseCallMeApplication.CONFIRM_REDIRECT
+    for keywords, state in (
+        (yal.main.HELP_KEYWORDS, yal.main.PleaseCallMeApplication.START_STATE),
+        (yal.main.OPTOUT_KEYWORDS, yal.main.OptOutApplication.START_STATE),
+        (yal.main.FEEDBACK_KEYWORDS, yal.main.FeedbackApplication.START_STATE),
+        (yal.main.AAQ_KEYWORDS, yal.main.AaqApplication.START_STATE),
+    ):
+        if keyword in keywords:
+            return state
+    if keyword in yal.main.ONBOARDING_REMINDER_KEYWORDS and metadata.get(
+        "onboarding_reminder_sent"
+    ):
+        return yal.main.OnboardingApplication.REMINDER_STATE
+    return None
+
+
+def route(keyword: str, metadata: dict):
+    result = yal.main.get_keyword_router().route(keyword, typed=True, metadata=metadata)
+    return None if result is None else result.state
+
+
+def main():
+    args = get_arguments()
+    rng = random.Random(0)  # noqa: S311 - Only used for sampling
+    keywords = [utils.clean_inbound(rng.choice(INBOUND)) for _ in range(args.messages)]
+    # Compile the router and load the keywords before timing
+    route("", {})
+    route_each_set("", {})
+
+    for name, func in (("each set", route_each_set), ("router", route)):
+        seconds = timeit.timeit(
+            "for keyword in keywords: func(keyword, {})",
+            globals={"keywords": keywords, "func": func},
+            number=1,
+        )
+        print(f"{name:<10} {seconds / args.messages * 1_000_000:8.2f}µs per message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""
+Measures how many messages per second each application can process, and the latency
+of each message, by running scripted conversations for many users concurrently through
+the worker's processing core, and compares it to the baseline in throughput.json.
+
+RabbitMQ is replaced by a FakeWorker that collects the outbound messages, redis by an
+in-memory store (or the local redis with --redis), and the upstream APIs by a single
+Sanic mock server, which can add latency and errors to its responses.
+
+Run from the repository root:
+
+    python benchmarks/throughput.py                    # compare against the baseline
+    python benchmarks/throughput.py --update           # record a new baseline
+    python benchmarks/throughput.py --flow yal --latency 0.05 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import gzip
+import importlib
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import redis.asyncio as aioredis
+from sanic import Sanic, response
+
+from vaccine import config
+from vaccine.models import Message
+from vaccine.testing import FakeWorker, run_sanic
+from vaccine.user_store import UserStore
+
+BASELINE = Path(__file__).parent / "throughput.json"
+
+NEW = Message.SESSION_EVENT.NEW
+
+
+@dataclass
+class Flow:
+    """
+    A scripted conversation with an application. Each item in the script is the
+    content of an inbound message, with NEW starting a new session.
+    """
+
+    application: str
+    transport_type: Message.TRANSPORT_TYPE
+    script: list
+    # Config modules, and the settings to change in them. {url} is replaced by the URL
+    # of the upstream mock.
+    settings: dict[str, dict[str, str]] = field(default_factory=dict)
+
+
+FLOWS = {
+    "yal": Flow(
+        application="yal.main.Application",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+        script=[
+            "hi",
+            "1",
+            "1",
+            "skip",
+            "20",
+            *["1"] * 14,
+            "0",
+            "2",
+            "hi",
+            "menu",
+            "3",
+            "0",
+        ],
+        settings={
+            "yal.config": {"RAPIDPRO_URL": "{url}", "CONTENTREPO_API_URL": "{url}"},
+        },
+    ),
+    "vaccine_reg_whatsapp": Flow(
+        application="vaccine.vaccine_reg_whatsapp.Application",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+        script=[
+            NEW,
+            *["1", "1", "2", "1", "5001010001082", "Jane", "Smith", "1"],
+            *["9", "Table View", "1", "1", "SKIP", "1", "1", "1", "1", "1", "1"],
+        ],
+        settings={
+            "vaccine.vacreg_config": {
+                "EVDS_URL": "{url}",
+                "EVDS_USERNAME": "benchmark",
+                "EVDS_PASSWORD": "benchmark",
+                "VACREG_EVENTSTORE_URL": "{url}",
+            },
+        },
+    ),
+    "healthcheck_ussd": Flow(
+        application="vaccine.healthcheck_ussd.Application",
+        transport_type=Message.TRANSPORT_TYPE.USSD,
+        script=[NEW, *["1"] * 11],
+        settings={
+            "vaccine.healthcheck_config": {
+                "EVENTSTORE_API_URL": "{url}",
+                "RAPIDPRO_URL": "{url}",
+            },
+        },
+    ),
+    "mqr": Flow(
+        application="mqr.baseline_ussd.Application",
+        transport_type=Message.TRANSPORT_TYPE.USSD,
+        script=[NEW, *["1"] * 18],
+        settings={
+            "mqr.config": {"EVENTSTORE_API_URL": "{url}", "RAPIDPRO_URL": "{url}"},
+        },
+    ),
+}
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Measures the message throughput and latency of each application"
+    )
+    parser.add_argument(
+        "--flow",
+        action="append",
+        choices=FLOWS.keys(),
+        help="Only run these flows. Can be specified more than once.",
+    )
+    parser.add_argument(
+        "--users", type=int, default=200, help="How many conversations to run"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.CONCURRENCY,
+        help="How many conversations to run at the same time",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Seconds that the upstream mock waits before each response",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="Fraction of upstream requests that return a server error",
+    )
+    parser.add_argument(
+        "--redis", action="store_true", help="Store users in the local redis"
+    )
+    parser.add_argument(
+        "--allocations",
+        action="store_true",
+        help="Trace memory allocations, which makes processing slower",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Fail if any flow's throughput is this fraction lower than the baseline",
+    )
+    parser.add_argument(
+        "--update", action="store_true", help="Record the results as the new baseline"
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Run a single conversation for each flow, printing each state and reply",
+    )
+    return parser.parse_args()
+
+
+class MemoryRedis:
+    """
+    Stands in for redis in the user store
+    """
+
+    def __init__(self):
+        self.data: dict[str, str] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        return self.data.get(key)
+
+    async def setex(self, key: str, ttl: int, value: str):
+        self.data[key] = value
+
+
+def create_upstream_mock(latency: float, error_rate: float) -> Sanic:
+    """
+    A single mock for all of the upstream APIs that the flows use
+    """
+    Sanic.test_mode = True
+    app = Sanic("benchmark_upstream_mock")
+
+    @app.middleware("request")
+    async def inject_latency_and_errors(request):
+        if latency:
+            await asyncio.sleep(latency)
+        if error_rate and random.random() < error_rate:  # noqa: S311
+            return response.json({}, status=500)
+
+    # RapidPro
+    @app.route("/api/v2/contacts.json", methods=["GET"])
+    def get_contact(request):
+        fields = {
+            "mqr_consent": "Accepted",
+            "mqr_arm": "RCM_SMS",
+            "midline_survey_completed": "True",
+        }
+        return response.json({"results": [{"fields": fields}], "next": None})
+
+    @app.route("/api/v2/contacts.json", methods=["POST"])
+    def update_contact(request):
+        return response.json({})
+
+    @app.route("/api/v2/flow_starts.json", methods=["POST"])
+    def start_flow(request):
+        return response.json({})
+
+    @app.route("/api/v2/globals.json", methods=["GET"])
+    def get_globals(request):
+        return response.json({"results": [], "next": None})
+
+    @app.route("/api/v2/groups.json", methods=["GET"])
+    def get_groups(request):
+        return response.json({"results": [], "next": None})
+
+    # ContentRepo
+    @app.route("/api/v2/pages", methods=["GET"])
+    def get_pages(request):
+        if request.args.get("tag") == "mainmenu":
+            return response.json(
+                {"count": 1, "results": [{"id": 111, "title": "Main Menu 1 💊"}]}
+            )
+        return response.json({"count": 0, "results": []})
+
+    @app.route("/suggestedcontent", methods=["GET"])
+    def get_suggested_content(request):
+        return response.json({"count": 0, "results": []})
+
+    # EventStore
+    @app.route("/api/v2/healthcheckuserprofile/<msisdn>/", methods=["GET"])
+    def get_userprofile(request, msisdn):
+        return response.json({}, status=404)
+
+    @app.route("/api/v2/covid19triagestart/", methods=["POST"])
+    def triage_start(request):
+        return response.json({})
+
+    @app.route("/api/v3/covid19triage/", methods=["POST"])
+    def triage(request):
+        return response.json({})
+
+    @app.route("/api/v1/mqrbaselinesurvey/", methods=["POST"])
+    def baseline_survey(request):
+        return response.json({})
+
+    @app.route("/api/v1/mqrbaselinesurvey/<msisdn:int>/", methods=["GET"])
+    def get_baseline_survey(request, msisdn):
+        return response.json({"detail": "Not found."}, status=404)
+
+    @app.route("/v2/vaccineregistration/", methods=["POST"])
+    def vaccine_registration(request):
+        return response.json({})
+
+    # EVDS
+    @app.route("/api/private/evds-sa/person/8/record", methods=["POST"])
+    def evds_record(request):
+        return response.json({})
+
+    @app.route("/api/private/evds-sa/person/8/lookup/medscheme/1", methods=["GET"])
+    def get_medschemes(request):
+        with gzip.open("vaccine/data/medscheme.json.gz") as f:
+            return response.raw(f.read(), content_type="application/json")
+
+    @app.route("/api/private/evds-sa/person/8/lookup/location/1", methods=["GET"])
+    def get_suburbs(request):
+        with gzip.open("vaccine/data/suburbs.json.gz") as f:
+            return response.raw(f.read(), content_type="application/json")
+
+    return app
+
+
+class BenchmarkWorker(FakeWorker):
+    def __init__(self, application: str, user_store: UserStore):
+        super().__init__()
+        modname, clsname = application.rsplit(".", maxsplit=1)
+        self.ApplicationClass = getattr(importlib.import_module(modname), clsname)
+        self.user_store = user_store
+        self.answer_worker = None
+
+    async def handle(self, msg: Message):
+        """
+        The same steps that the worker takes for each inbound message, without the
+        locking and AMQP
+        """
+        user = await self.load_user(msg)
+        app, messages = await self.run_application(user, msg)
+        await self.publish_responses(app, messages)
+        await self.save_user(msg, user)
+        return user
+
+
+def make_message(flow: Flow, addr: str, content) -> Message:
+    return Message(
+        to_addr="27820001002",
+        from_addr=addr,
+        transport_name="benchmark",
+        transport_type=flow.transport_type,
+        content=None if content is NEW else content,
+        session_event=NEW if content is NEW else Message.SESSION_EVENT.RESUME,
+    )
+
+
+async def run_conversation(
+    worker: BenchmarkWorker, flow: Flow, addr: str, latencies: list[float]
+):
+    for content in flow.script:
+        start = time.perf_counter()
+        await worker.handle(make_message(flow, addr, content))
+        latencies.append(time.perf_counter() - start)
+
+
+async def trace_conversation(worker: BenchmarkWorker, flow: Flow):
+    for content in flow.script:
+        worker.outbound_messages = []
+        user = await worker.handle(make_message(flow, "27820001001", content))
+        print(f"> {content!r} -> {user.state.name}")
+        for msg in worker.outbound_messages:
+            print("  " + (msg.content or "").replace("\n", "\n  "))
+
+
+async def run_flow(name: str, args) -> dict:
+    flow = FLOWS[name]
+    redis = None
+    if args.redis:
+        redis = aioredis.from_url(
+            config.REDIS_URL, encoding="utf-8", decode_responses=True
+        )
+        store = UserStore(redis)
+    else:
+        store = UserStore(MemoryRedis())  # type: ignore
+    worker = BenchmarkWorker(flow.application, store)
+
+    if args.trace:
+        await trace_conversation(worker, flow)
+        return {}
+
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(i: int):
+        async with semaphore:
+            await run_conversation(worker, flow, f"2782{i:07}", latencies)
+
+    if args.allocations:
+        tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(run(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - start
+    result = {
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(statistics.quantiles(latencies, n=100)[98] * 1000, 2),
+    }
+    if args.allocations:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_kib"] = round(peak / 1024)
+
+    if redis is not None:
+        for key in await redis.keys("user.2782*"):
+            await redis.delete(key)
+        await redis.close()
+    return result
+
+
+async def run(args) -> dict:
+    results = {}
+    app = create_upstream_mock(args.latency, args.error_rate)
+    async with run_sanic(app) as server:
+        url = f"http://{server.host}:{server.port}"
+        for name in args.flow or FLOWS:
+            for module, settings in FLOWS[name].settings.items():
+                module = importlib.import_module(module)
+                for setting, value in settings.items():
+                    setattr(module, setting, value.format(url=url))
+            results[name] = await run_flow(name, args)
+    return results
+
+
+def main():
+    args = get_arguments()
+    if not args.trace:
+        # The applications log every error, which would drown out the results
+        logging.disable(logging.CRITICAL)
+    warnings.simplefilter("ignore", DeprecationWarning)
+    results = asyncio.run(run(args))
+    if args.trace:
+        return
+
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    regressions = []
+    for name, result in results.items():
+        line = (
+            f"{name:<24} {result['throughput']:8.1f} msg/s "
+            f"p50 {result['p50_ms']:7.2f}ms p99 {result['p99_ms']:7.2f}ms"
+        )
+        if "peak_kib" in result:
+            line += f" peak {result['peak_kib']}KiB"
+        if name in baseline:
+            change = result["throughput"] / baseline[name]["throughput"] - 1
+            line += f" {change:+8.1%}"
+            if change < -args.threshold:
+                regressions.append(name)
+        print(line)
+
+    if args.update:
+        baseline.update(
+            {
+                name: {k: v for k, v in result.items() if k != "peak_kib"}
+                for name, result in results.items()
+            }
+        )
+        BASELINE.write_text(json.dumps(baseline, indent=2) + "\n")
+    elif regressions:
+        print(f"Slower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures how long it takes to set up the translation for each inbound message, using
+the preloaded catalogues, compared to looking the catalogue up with gettext.translation
+for every message.
+
+Run from the repository root:
+
+    python benchmarks/translations.py
+"""
+
+import argparse
+import gettext
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from vaccine import base_application
+
+# Users' languages, roughly in the proportions that we see them
+LANGUAGES = [None, "eng", "eng", "eng", "zul", "xho", "afr", "sot"]
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Measures the time taken to set up translations for each message"
+    )
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=100_000,
+        help="How many inbound messages to set up translations for",
+    )
+    return parser.parse_args()
+
+
+def find_translation(language):
+    """
+    Looks the catalogue up for every message, the way the application did before the
+    catalogues were preloaded
+    """
+    return gettext.translation(
+        "messages",
+        localedir=base_application.LOCALE_DIR,
+        languages=[language or ""],
+        fallback=True,
+    )
+
+
+def main():
+    args = get_arguments()
+    languages = [LANGUAGES[i % len(LANGUAGES)] for i in range(args.messages)]
+    # Load the catalogues before timing
+    base_application.get_translations()
+
+    for name, func in (
+        ("gettext", find_translation),
+        ("preloaded", base_application.get_translation),
+    ):
+        seconds = timeit.timeit(
+            "for language in languages: func(language).gettext",
+            globals={"languages": languages, "func": func},
+            number=1,
+        )
+        print(f"{name:<10} {seconds / args.messages * 1_000_000:8.2f}µs per message")
+
+
+if __name__ == "__main__":
+    main()
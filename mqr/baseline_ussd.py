@@ -5,19 +5,16 @@ import aiohttp
 
 from mqr import config
 from mqr.midline_ussd import Application as MidlineApplication
-from vaccine.states import Choice, ChoiceState, EndState
+from vaccine import clients, outbox, resilience
+from vaccine.states import Choice, ChoiceState, EndState, static_state
 from vaccine.utils import HTTP_EXCEPTIONS, normalise_phonenumber
 
 logger = logging.getLogger(__name__)
 
 
 def get_eventstore():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "eventstore",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Token {config.EVENTSTORE_API_TOKEN}",
@@ -27,8 +24,12 @@ def get_eventstore():
     )
 
 
+outbox.register_target("mqr_baseline_ussd.eventstore", get_eventstore)
+
+
 def get_rapidpro():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "rapidpro",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Token {config.RAPIDPRO_TOKEN}",
@@ -48,35 +49,35 @@ class Application(MidlineApplication):
         sms_mqr_contact = False
 
         async with get_rapidpro() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        urljoin(config.RAPIDPRO_URL, "/api/v2/contacts.json"),
-                        params={"urn": urn},
-                    )
-                    response.raise_for_status()
-                    response_body = await response.json()
-
-                    if len(response_body["results"]) > 0:
-                        contact = response_body["results"][0]
-
-                        if (
-                            contact["fields"]["mqr_consent"] == "Accepted"
-                            and contact["fields"]["mqr_arm"] == "RCM_SMS"
-                        ):
-                            sms_mqr_contact = True
-
-                            if contact["fields"]["midline_survey_completed"] == "False":
-                                return await self.go_to_state(
-                                    MidlineApplication.START_STATE
-                                )
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("rapidpro"):
+                    with attempt:
+                        response = await session.get(
+                            urljoin(config.RAPIDPRO_URL, "/api/v2/contacts.json"),
+                            params={"urn": urn},
+                        )
+                        response.raise_for_status()
+                        response_body = await response.json()
+
+                        if len(response_body["results"]) > 0:
+                            contact = response_body["results"][0]
+
+                            if (
+                                contact["fields"]["mqr_consent"] == "Accepted"
+                                and contact["fields"]["mqr_arm"] == "RCM_SMS"
+                            ):
+                                sms_mqr_contact = True
+
+                                if (
+                                    contact["fields"]["midline_survey_completed"]
+                                    == "False"
+                                ):
+                                    return await self.go_to_state(
+                                        MidlineApplication.START_STATE
+                                    )
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         if sms_mqr_contact:
             return await self.go_to_state("state_check_existing_result")
         return await self.go_to_state("state_contact_not_found")
@@ -86,29 +87,26 @@ class Application(MidlineApplication):
         exists = False
 
         async with get_eventstore() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        urljoin(
-                            config.EVENTSTORE_API_URL,
-                            f"/api/v1/mqrbaselinesurvey/{msisdn}/",
-                        ),
-                    )
-                    if response.status == 404:
-                        break
-                    response.raise_for_status()
-                    exists = True
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("eventstore"):
+                    with attempt:
+                        response = await session.get(
+                            urljoin(
+                                config.EVENTSTORE_API_URL,
+                                f"/api/v1/mqrbaselinesurvey/{msisdn}/",
+                            ),
+                        )
+                        if response.status != 404:
+                            response.raise_for_status()
+                            exists = True
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         if exists:
             return await self.go_to_state("state_already_completed")
         return await self.go_to_state("state_breastfeed")
 
+    @static_state
     async def state_breastfeed(self):
         question = self._("1/13\n\nDo you plan to breastfeed your baby after birth?")
         error = self._(
@@ -130,6 +128,7 @@ class Application(MidlineApplication):
             next="state_breastfeed_period_question",
         )
 
+    @static_state
     async def state_breastfeed_period_question(self):
         question = self._(
             "2/13 \n"
@@ -153,6 +152,7 @@ class Application(MidlineApplication):
             next="state_breastfeed_period",
         )
 
+    @static_state
     async def state_breastfeed_period(self):
         question = self._("Breast feeding period")
         error = self._("Please use numbers from list.")
@@ -174,6 +174,7 @@ class Application(MidlineApplication):
             next="state_vaccine_importance_question",
         )
 
+    @static_state
     async def state_vaccine_importance_question(self):
         question = self._(
             "3/13 \n"
@@ -201,6 +202,7 @@ class Application(MidlineApplication):
             next="state_vaccine_importance",
         )
 
+    @static_state
     async def state_vaccine_importance(self):
         question = self._("")
         error = self._(
@@ -228,6 +230,7 @@ class Application(MidlineApplication):
             next="state_vaccine_benefits_question",
         )
 
+    @static_state
     async def state_vaccine_benefits_question(self):
         question = self._(
             "4/13 \n"
@@ -255,6 +258,7 @@ class Application(MidlineApplication):
             next="state_vaccine_benefits",
         )
 
+    @static_state
     async def state_vaccine_benefits(self):
         question = self._("")
         error = self._(
@@ -280,6 +284,7 @@ class Application(MidlineApplication):
             next="state_clinic_visit_frequency_question",
         )
 
+    @static_state
     async def state_clinic_visit_frequency_question(self):
         question = self._(
             "5/13 \n"
@@ -303,6 +308,7 @@ class Application(MidlineApplication):
             next="state_clinic_visit_frequency",
         )
 
+    @static_state
     async def state_clinic_visit_frequency(self):
         question = self._("")
         error = self._(
@@ -329,6 +335,7 @@ class Application(MidlineApplication):
             next="state_vegetables",
         )
 
+    @static_state
     async def state_vegetables(self):
         question = self._(
             "6/13 \n"
@@ -354,6 +361,7 @@ class Application(MidlineApplication):
             next="state_fruit",
         )
 
+    @static_state
     async def state_fruit(self):
         question = self._(
             "7/13 \n\nSince becoming pregnant, do you eat fruit at least once a day?"
@@ -377,6 +385,7 @@ class Application(MidlineApplication):
             next="state_dairy",
         )
 
+    @static_state
     async def state_dairy(self):
         question = self._(
             "8/13 \n"
@@ -404,6 +413,7 @@ class Application(MidlineApplication):
             next="state_liver_frequency",
         )
 
+    @static_state
     async def state_liver_frequency(self):
         question = self._("9/13 \n\nHow often do you eat liver?")
         error = self._("Please use numbers from list.\n\nHow often do you eat liver?")
@@ -424,6 +434,7 @@ class Application(MidlineApplication):
             next="state_danger_sign1",
         )
 
+    @static_state
     async def state_danger_sign1(self):
         question = self._(
             "10/13 \n"
@@ -450,6 +461,7 @@ class Application(MidlineApplication):
             next="state_danger_sign2",
         )
 
+    @static_state
     async def state_danger_sign2(self):
         question = self._(
             "11/13 \n"
@@ -476,6 +488,7 @@ class Application(MidlineApplication):
             next="state_marital_status",
         )
 
+    @static_state
     async def state_marital_status(self):
         question = self._("12/13 \n\nWhat is your marital status?")
         error = self._("Please use numbers from list.\n\nWhat is your marital status?")
@@ -496,6 +509,7 @@ class Application(MidlineApplication):
             next="state_education_level_question",
         )
 
+    @static_state
     async def state_education_level_question(self):
         question = self._(
             "13/13 \n\nWhich answer best describes your highest level of education?"
@@ -515,6 +529,7 @@ class Application(MidlineApplication):
             next="state_education_level",
         )
 
+    @static_state
     async def state_education_level(self):
         question = self._("")
         error = self._(
@@ -540,45 +555,34 @@ class Application(MidlineApplication):
         )
 
     async def state_submit_data(self):
-        async with get_eventstore() as session:
-            for i in range(3):
-                try:
-                    answers = self.user.answers
-                    data = {
-                        "msisdn": self.inbound.from_addr,
-                        "breastfeed": answers.get("state_breastfeed"),
-                        "breastfeed_period": answers.get("state_breastfeed_period"),
-                        "vaccine_importance": answers.get("state_vaccine_importance"),
-                        "vaccine_benefits": answers.get("state_vaccine_benefits"),
-                        "clinic_visit_frequency": answers.get(
-                            "state_clinic_visit_frequency"
-                        ),
-                        "vegetables": answers.get("state_vegetables"),
-                        "fruit": answers.get("state_fruit"),
-                        "dairy": answers.get("state_dairy"),
-                        "liver_frequency": answers.get("state_liver_frequency"),
-                        "danger_sign1": answers.get("state_danger_sign1"),
-                        "danger_sign2": answers.get("state_danger_sign2"),
-                        "marital_status": answers.get("state_marital_status"),
-                        "education_level": answers.get("state_education_level"),
-                    }
-                    logger.info(">>>> state_submit_data /api/v1/mqrbaselinesurvey/")
-                    logger.info(config.EVENTSTORE_API_URL)
-                    logger.info(data)
-                    response = await session.post(
-                        urljoin(
-                            config.EVENTSTORE_API_URL, "/api/v1/mqrbaselinesurvey/"
-                        ),
-                        json=data,
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+        answers = self.user.answers
+        data = {
+            "msisdn": self.inbound.from_addr,
+            "breastfeed": answers.get("state_breastfeed"),
+            "breastfeed_period": answers.get("state_breastfeed_period"),
+            "vaccine_importance": answers.get("state_vaccine_importance"),
+            "vaccine_benefits": answers.get("state_vaccine_benefits"),
+            "clinic_visit_frequency": answers.get("state_clinic_visit_frequency"),
+            "vegetables": answers.get("state_vegetables"),
+            "fruit": answers.get("state_fruit"),
+            "dairy": answers.get("state_dairy"),
+            "liver_frequency": answers.get("state_liver_frequency"),
+            "danger_sign1": answers.get("state_danger_sign1"),
+            "danger_sign2": answers.get("state_danger_sign2"),
+            "marital_status": answers.get("state_marital_status"),
+            "education_level": answers.get("state_education_level"),
+        }
+        logger.info(">>>> state_submit_data /api/v1/mqrbaselinesurvey/")
+        logger.info(config.EVENTSTORE_API_URL)
+        logger.info(data)
+        error = await self.submit(
+            "mqr_baseline_ussd.eventstore",
+            urljoin(config.EVENTSTORE_API_URL, "/api/v1/mqrbaselinesurvey/"),
+            data,
+            wait=True,
+        )
+        if error:
+            return await self.go_to_state("state_error")
         return await self.go_to_state("state_update_rapidpro_contact")
 
     async def state_update_rapidpro_contact(self):
@@ -586,24 +590,21 @@ class Application(MidlineApplication):
         urn = f"whatsapp:{msisdn.removeprefix('+')}"
 
         async with get_rapidpro() as session:
-            for i in range(3):
-                try:
-                    data = {
-                        "flow": config.RAPIDPRO_BASELINE_SURVEY_COMPLETE_FLOW,
-                        "urns": [urn],
-                    }
-                    response = await session.post(
-                        urljoin(config.RAPIDPRO_URL, "/api/v2/flow_starts.json"),
-                        json=data,
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("rapidpro"):
+                    with attempt:
+                        data = {
+                            "flow": config.RAPIDPRO_BASELINE_SURVEY_COMPLETE_FLOW,
+                            "urns": [urn],
+                        }
+                        response = await session.post(
+                            urljoin(config.RAPIDPRO_URL, "/api/v2/flow_starts.json"),
+                            json=data,
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         return await self.go_to_state("state_end")
 
     async def state_end(self):
@@ -4,6 +4,7 @@ from urllib.parse import urljoin
 import aiohttp
 
 from mqr import config
+from vaccine import clients, resilience
 from vaccine.base_application import BaseApplication
 from vaccine.models import Message
 from vaccine.states import Choice, ChoiceState, EndState
@@ -13,7 +14,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_rapidpro():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "rapidpro",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Token {config.RAPIDPRO_TOKEN}",
@@ -33,24 +35,23 @@ class Application(BaseApplication):
             urn = f"whatsapp:{msisdn.removeprefix('+')}"
 
             async with get_rapidpro() as session:
-                for i in range(3):
-                    try:
-                        data = {
-                            "flow": config.RAPIDPRO_MIDLINE_SURVEY_TIMEOUT_FLOW,
-                            "urns": [urn],
-                        }
-                        response = await session.post(
-                            urljoin(config.RAPIDPRO_URL, "/api/v2/flow_starts.json"),
-                            json=data,
-                        )
-                        response.raise_for_status()
-                        break
-                    except HTTP_EXCEPTIONS as e:
-                        if i == 2:
-                            logger.exception(e)
-                            return []
-                        else:
-                            continue
+                try:
+                    async for attempt in resilience.retrying("rapidpro"):
+                        with attempt:
+                            data = {
+                                "flow": config.RAPIDPRO_MIDLINE_SURVEY_TIMEOUT_FLOW,
+                                "urns": [urn],
+                            }
+                            response = await session.post(
+                                urljoin(
+                                    config.RAPIDPRO_URL, "/api/v2/flow_starts.json"
+                                ),
+                                json=data,
+                            )
+                            response.raise_for_status()
+                except HTTP_EXCEPTIONS as e:
+                    logger.exception(e)
+                    return []
             return []
 
         return await super().process_message(message)
@@ -518,24 +519,21 @@ class Application(BaseApplication):
         urn = f"whatsapp:{msisdn.removeprefix('+')}"
 
         async with get_rapidpro() as session:
-            for i in range(3):
-                try:
-                    data = {
-                        "flow": config.RAPIDPRO_MIDLINE_SURVEY_COMPLETE_FLOW,
-                        "urns": [urn],
-                    }
-                    response = await session.post(
-                        urljoin(config.RAPIDPRO_URL, "/api/v2/flow_starts.json"),
-                        json=data,
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("rapidpro"):
+                    with attempt:
+                        data = {
+                            "flow": config.RAPIDPRO_MIDLINE_SURVEY_COMPLETE_FLOW,
+                            "urns": [urn],
+                        }
+                        response = await session.post(
+                            urljoin(config.RAPIDPRO_URL, "/api/v2/flow_starts.json"),
+                            json=data,
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         return await self.go_to_state("state_end")
 
     async def state_end(self):
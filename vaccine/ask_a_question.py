@@ -8,6 +8,7 @@ import aiohttp
 import sentry_sdk
 
 from vaccine import ask_a_question_config as config
+from vaccine import clients, resilience
 from vaccine.base_application import BaseApplication
 from vaccine.models import Message
 from vaccine.states import Choice, ChoiceState, EndState, FreeText, WhatsAppButtonState
@@ -18,12 +19,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_model():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "model",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Content-Type": "application/json",
@@ -124,23 +121,22 @@ class Application(BaseApplication):
             },
         }
         async with model as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        url=urljoin(config.MODEL_API_URL, "/inbound/check"), json=data
-                    )
-                    response_data = await response.json()
-                    sentry_sdk.set_context(
-                        "model", {"request_data": data, "response_data": response_data}
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("model"):
+                    with attempt:
+                        response = await session.post(
+                            url=urljoin(config.MODEL_API_URL, "/inbound/check"),
+                            json=data,
+                        )
+                        response_data = await response.json()
+                        sentry_sdk.set_context(
+                            "model",
+                            {"request_data": data, "response_data": response_data},
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         if response_data.get("top_responses"):
             self.save_answer("model_response", json.dumps(response_data))
             return await self.go_to_state("state_display_response_choices")
@@ -187,24 +183,22 @@ class Application(BaseApplication):
             },
         }
         async with model as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        url=urljoin(config.MODEL_API_URL, "/inbound/feedback"),
-                        json=data,
-                    )
-                    response_data = await response.text()
-                    sentry_sdk.set_context(
-                        "model", {"request_data": data, "response_data": response_data}
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("model"):
+                    with attempt:
+                        response = await session.post(
+                            url=urljoin(config.MODEL_API_URL, "/inbound/feedback"),
+                            json=data,
+                        )
+                        response_data = await response.text()
+                        sentry_sdk.set_context(
+                            "model",
+                            {"request_data": data, "response_data": response_data},
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         return await self.go_to_state("state_display_selected_choice")
 
     async def state_display_selected_choice(self):
@@ -238,24 +232,22 @@ class Application(BaseApplication):
             },
         }
         async with model as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        url=urljoin(config.MODEL_API_URL, "/inbound/feedback"),
-                        json=data,
-                    )
-                    response_data = await response.text()
-                    sentry_sdk.set_context(
-                        "model", {"request_data": data, "response_data": response_data}
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("model"):
+                    with attempt:
+                        response = await session.post(
+                            url=urljoin(config.MODEL_API_URL, "/inbound/feedback"),
+                            json=data,
+                        )
+                        response_data = await response.text()
+                        sentry_sdk.set_context(
+                            "model",
+                            {"request_data": data, "response_data": response_data},
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         return await self.go_to_state("state_end")
 
     async def state_end(self):
@@ -1,24 +1,137 @@
+import asyncio
 import gettext
+import inspect
 import logging
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from pathlib import Path
+from types import CodeType, MappingProxyType, MethodType
 from typing import Any, Optional
 
-from prometheus_client import Counter
+from prometheus_client import Counter, Histogram
 
+from vaccine import config
+from vaccine.blob_store import is_reference
 from vaccine.models import Answer, Message, User
-from vaccine.states import EndState
+from vaccine.outbox import Submission, deliver_with_retries
+from vaccine.states import ChoiceState, EndState, FreeText
 from vaccine.utils import random_id
 from vaccine.worker import Worker
 
 STATE_CHANGE = Counter(
     "state_change", "Whenever a user's state gets changed", ("from_state", "to_state")
 )
+STATE_LATENCY = Histogram(
+    "state_handler_latency_seconds",
+    "Time spent in each state's handler, including any states that it goes to",
+    ("state",),
+)
 
 logger = logging.getLogger(__name__)
 
+LOCALE_DIR = "locales"
+
+_translations: Optional[Mapping[str, gettext.NullTranslations]] = None
+
+
+def load_translations(
+    localedir: str = LOCALE_DIR,
+) -> Mapping[str, gettext.NullTranslations]:
+    """
+    Loads every compiled message catalogue in localedir, by language
+    """
+    translations = {}
+    for path in sorted(Path(localedir).glob("*/LC_MESSAGES/messages.mo")):
+        language = path.parent.parent.name
+        translations[language] = gettext.translation(
+            "messages", localedir=localedir, languages=[language]
+        )
+    return MappingProxyType(translations)
+
+
+def get_translations() -> Mapping[str, gettext.NullTranslations]:
+    """
+    Returns the message catalogues, loading them the first time they're needed. They're
+    shared by every application, so shouldn't be modified.
+    """
+    global _translations
+    if _translations is None:
+        _translations = load_translations()
+    return _translations
+
+
+@lru_cache(maxsize=64)
+def _find_translation(language: str) -> gettext.NullTranslations:
+    # Languages without a catalogue of their own, eg. eng, or a variant like zul_ZA
+    return gettext.translation(
+        "messages", localedir=LOCALE_DIR, languages=[language], fallback=True
+    )
+
+
+def get_translation(language: Optional[str]) -> gettext.NullTranslations:
+    translation = get_translations().get(language or "")
+    if translation is None:
+        translation = _find_translation(language or "")
+    return translation
+
+
+def _referenced_names(code: CodeType) -> set[str]:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _referenced_names(const)
+    return names
+
+
+@dataclass(frozen=True)
+class StateInfo:
+    """
+    A state of an application, and what we know about it without running it
+    """
+
+    name: str
+    handler: Callable[..., Awaitable[Any]]
+    # The class that defines the state, usually one of the application's mixins
+    owner: type
+
+    @cached_property
+    def accepts_input(self) -> bool:
+        """
+        Whether the handler builds a state that waits for the user's input. States
+        that only go to another state take on that state's behaviour, so are False.
+        """
+        handler = inspect.unwrap(self.handler)
+        for name in _referenced_names(handler.__code__):
+            value = handler.__globals__.get(name)
+            if isinstance(value, type) and issubclass(value, (ChoiceState, FreeText)):
+                return True
+        return False
+
+
+def get_states(cls: type) -> Mapping[str, StateInfo]:
+    """
+    Finds all of the states of the application class, including those of its mixins
+    """
+    states = {}
+    for klass in reversed(cls.__mro__):
+        for name, value in vars(klass).items():
+            if name.startswith("state_") and inspect.isfunction(value):
+                states[name] = StateInfo(name, value, klass)
+    return MappingProxyType(states)
+
 
 class BaseApplication:
     START_STATE = "state_start"
     ERROR_STATE = "state_error"
+    # All of the states of the application, by name. This is built once for each
+    # application class, so that we don't need to search the class for them.
+    STATES: Mapping[str, StateInfo] = MappingProxyType({})
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.STATES = get_states(cls)
 
     # TODO: transition all tests over to new test helper to make worker manditory
     def __init__(self, user: User, worker: Optional[Worker] = None):
@@ -27,23 +140,105 @@ class BaseApplication:
         self.answer_events: list[Answer] = []
         self.messages: list[Message] = []
         self.inbound: Optional[Message] = None
+        self.submissions = 0
         self.set_language(self.user.lang)
 
+    @classmethod
+    async def worker_setup(cls, worker: Worker):
+        """
+        Called once when the worker starts, to set up anything shared between messages
+        """
+
+    @classmethod
+    async def worker_teardown(cls, worker: Worker):
+        """
+        Called once when the worker stops, to clean up anything set up in worker_setup
+        """
+
+    @classmethod
+    def warm_up(cls):
+        """
+        Loads anything that's otherwise only loaded on first use, eg. reference data,
+        so that the first messages after startup aren't slow. If WARM_UP is enabled,
+        the worker calls this before it starts consuming messages.
+        """
+        get_translations()
+
+    @classmethod
+    async def purge_cache(cls, worker: Worker):
+        """
+        Called to remove any cached content, eg. when new content is published
+        """
+
     def set_language(self, language):
         self.user.lang = language
-        self.translation = gettext.translation(
-            "messages",
-            localedir="locales",
-            languages=[self.user.lang or ""],
-            fallback=True,
-        )
+        self.translation = get_translation(language)
         self._ = self.translation.gettext
 
+    async def delay(self, seconds: float):
+        """
+        Delays the next message that we publish, so that the user receives the previous
+        message first. This doesn't hold up processing when running in the worker.
+        """
+        if self.worker is not None:
+            await self.worker.delay(seconds)
+        else:
+            await asyncio.sleep(seconds)
+
+    async def submit(
+        self,
+        target: str,
+        url: str,
+        data: dict,
+        context: Optional[dict] = None,
+        wait: bool = False,
+        timeout: float = config.OUTBOX_WAIT_TIMEOUT,
+    ) -> bool:
+        """
+        Submits data to an upstream through the outbox, so that we don't have to wait
+        for the upstream while processing the message. Returns True if the submission
+        failed.
+
+        target: The name of the upstream's target in vaccine.outbox
+        url: The URL to POST the data to
+        data: The JSON data to submit
+        context: Passed to the session's trace configs for the request
+        wait: Whether to wait for the result, eg. to show an error if it failed
+        timeout: How long to wait for the result before treating it as failed
+        """
+        submission = Submission(target, url, data, context=context)
+        if self.inbound is not None:
+            # Processing the message again, eg. when it's redelivered, or retried
+            # because the user changed, makes the same submissions, so give them the
+            # same ids, so that the outbox only delivers them once
+            self.submissions += 1
+            submission.id = ".".join(
+                (
+                    self.inbound.message_id,
+                    self.state_name,
+                    target,
+                    str(self.submissions),
+                )
+            )
+        if self.worker is None:
+            return await deliver_with_retries(submission)
+        return await self.worker.submit(submission, timeout if wait else None)
+
     async def get_current_state(self, **kw):
         if not self.state_name:
             self.state_name = self.START_STATE
-        state_func = getattr(self, self.state_name)
-        return await state_func(**kw)
+        state_name = self.state_name
+        state = self.STATES.get(state_name)
+        if state is None:
+            # A few states don't follow the state_ naming convention
+            state_func = getattr(self, state_name)
+        else:
+            state_func = MethodType(state.handler, self)
+        start = time.monotonic()
+        try:
+            return await state_func(**kw)
+        finally:
+            STATE_LATENCY.labels(state_name).observe(time.monotonic() - start)
 
     async def go_to_state(self, name, **kw):
         """
@@ -108,6 +303,29 @@ class BaseApplication:
         """
         self.user.metadata[name] = value
 
+    async def save_shared_metadata(self, name: str, value: Any):
+        """
+        Saves large metadata, or metadata that is the same for many users, in the
+        worker's blob store, with only a reference to it saved on the user. It should
+        be read using get_metadata.
+        """
+        if self.worker is None or self.worker.blob_store is None:
+            self.save_metadata(name, value)
+        else:
+            self.save_metadata(name, await self.worker.blob_store.put(value))
+
+    async def get_metadata(self, name: str, default: Any = None) -> Any:
+        """
+        Returns the metadata, fetching it from the blob store if it was saved there.
+        Values from the blob store are shared, so shouldn't be modified.
+        """
+        value = self.user.metadata.get(name, default)
+        if is_reference(value):
+            if self.worker is None or self.worker.blob_store is None:
+                return default
+            return await self.worker.blob_store.get(value, default)
+        return value
+
     def delete_metadata(self, name: str):
         """
         Deletes metadata on the user
@@ -125,3 +343,6 @@ class BaseApplication:
         return EndState(
             self, text=self._("Something went wrong. Please try again later.")
         )
+
+
+BaseApplication.STATES = get_states(BaseApplication)
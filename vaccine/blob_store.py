@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any
+
+import redis.asyncio as aioredis
+from prometheus_client import Counter, Histogram
+
+from vaccine import config
+
+BLOB_CACHE = Counter(
+    "blob_store_cache",
+    "Whenever a blob is read, and whether it was in the local cache",
+    ("result",),
+)
+BLOB_SIZE = Histogram(
+    "blob_store_blob_size",
+    "The size of each value stored in the blob store, in bytes",
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576),
+)
+
+logger = logging.getLogger(__name__)
+
+# The key that marks a value in the user's metadata as a reference to a blob
+REFERENCE_KEY = "$blob"
+
+
+def is_reference(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and REFERENCE_KEY in value
+
+
+class BlobStore:
+    """
+    Stores large values once under `blob.{sha256}` of their contents, so that users
+    only need to store a reference to them. Values that are the same for many users,
+    like the servicefinder categories, are only stored once, and aren't parsed and
+    serialised again with the user's data on every message.
+
+    Because a blob's contents never change, blobs that have been read are cached in
+    memory, and are shared between everyone that reads them, so they shouldn't be
+    modified.
+
+    The TTL of a blob is refreshed whenever it's stored or read, at most once every
+    half TTL, so the blob TTL should be at least double the user TTL.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        ttl: int = config.BLOB_TTL,
+        min_size: int = config.BLOB_MIN_SIZE,
+        cache_size: int = config.BLOB_CACHE_SIZE,
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.min_size = min_size
+        self.cache_size = cache_size
+        # digest: (value, when the TTL was last refreshed)
+        self.cache: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+
+    def key(self, digest: str) -> str:
+        return f"blob.{digest}"
+
+    async def put(self, value: Any) -> Any:
+        """
+        Stores the value, and returns a reference to store in its place. Values
+        smaller than min_size are returned as is.
+        """
+        data = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+        if len(data) < self.min_size:
+            return value
+        digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        if not self.needs_refresh(digest):
+            return {REFERENCE_KEY: digest}
+        # Only write the data if it isn't already stored
+        if not await self.redis.expire(self.key(digest), self.ttl):
+            BLOB_SIZE.observe(len(data.encode("utf-8")))
+            await self.redis.set(self.key(digest), data, ex=self.ttl)
+        self.add_to_cache(digest, value)
+        return {REFERENCE_KEY: digest}
+
+    async def get(self, reference: dict, default: Any = None) -> Any:
+        """
+        Returns the value that the reference refers to, or default if it has expired
+        """
+        digest = reference[REFERENCE_KEY]
+        if digest in self.cache:
+            BLOB_CACHE.labels("hit").inc()
+            value, _ = self.cache[digest]
+            self.cache.move_to_end(digest)
+            if self.needs_refresh(digest):
+                await self.redis.expire(self.key(digest), self.ttl)
+                self.cache[digest] = (value, time.monotonic())
+            return value
+
+        BLOB_CACHE.labels("miss").inc()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self.key(digest))
+            pipe.expire(self.key(digest), self.ttl)
+            data, _ = await pipe.execute()
+        if data is None:
+            logger.warning(f"Blob {digest} not found")
+            return default
+        value = json.loads(data)
+        self.add_to_cache(digest, value)
+        return value
+
+    def needs_refresh(self, digest: str) -> bool:
+        if digest not in self.cache:
+            return True
+        _, refreshed = self.cache[digest]
+        return time.monotonic() - refreshed > self.ttl / 2
+
+    def add_to_cache(self, digest: str, value: Any):
+        self.cache[digest] = (value, time.monotonic())
+        self.cache.move_to_end(digest)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
@@ -2,8 +2,7 @@ from datetime import datetime
 from os import environ
 from urllib.parse import urljoin
 
-import aiohttp
-
+from vaccine import clients
 from vaccine.base_application import BaseApplication
 from vaccine.states import EndState
 
@@ -21,8 +20,8 @@ def format_int(n: int) -> str:
 
 
 async def get_cases_api_data() -> dict:
-    async with aiohttp.ClientSession(
-        headers={"User-Agent": "contactndoh-cases"}
+    async with clients.get_session(
+        "healthcheck", headers={"User-Agent": "contactndoh-cases"}
     ) as session:
         response = await session.get(
             urljoin(HEALTHCHECK_API_URL, "/v2/covidcases/contactndoh/"),
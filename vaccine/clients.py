@@ -0,0 +1,106 @@
+import logging
+from typing import Optional
+
+import aiohttp
+
+from vaccine import config, deadline, tracing
+
+logger = logging.getLogger(__name__)
+
+
+def parse_limits(value: Optional[str]) -> dict[str, int]:
+    """
+    Parses a limits string in the form "upstream=limit,upstream=limit" into a dict
+    """
+    limits = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        try:
+            upstream, limit = item.split("=", maxsplit=1)
+            limits[upstream.strip()] = int(limit)
+        except ValueError:
+            logger.warning(f"Invalid limit {item!r}, ignoring")
+    return limits
+
+
+class ClientRegistry:
+    """
+    Keeps one keep-alive connection pool per upstream, so that outbound API calls reuse
+    connections instead of doing a new TCP and TLS handshake for every request.
+
+    Sessions handed out by the registry share the upstream's connector, but don't own
+    it, so closing the session leaves the pooled connections open for the next call.
+    """
+
+    def __init__(
+        self,
+        limit: int = config.HTTP_POOL_LIMIT,
+        limits: Optional[dict[str, int]] = None,
+        keepalive_timeout: float = config.HTTP_KEEPALIVE_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limits = limits if limits is not None else {}
+        self.keepalive_timeout = keepalive_timeout
+        self.connectors: dict[str, aiohttp.TCPConnector] = {}
+        # Upstream health, see vaccine.resilience
+        self.breakers: dict = {}
+        self.retry_budgets: dict = {}
+
+    def get_connector(self, upstream: str) -> aiohttp.TCPConnector:
+        connector = self.connectors.get(upstream)
+        if connector is None or connector.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limits.get(upstream, self.limit),
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self.connectors[upstream] = connector
+        return connector
+
+    def session(self, upstream: str, **kwargs) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            connector=self.get_connector(upstream), connector_owner=False, **kwargs
+        )
+
+    async def close(self):
+        connectors, self.connectors = self.connectors, {}
+        for connector in connectors.values():
+            await connector.close()
+
+
+_registry: Optional[ClientRegistry] = None
+
+
+def get_registry() -> Optional[ClientRegistry]:
+    return _registry
+
+
+def set_registry(registry: Optional[ClientRegistry]):
+    """
+    Sets the registry that get_session uses. The worker sets this up on startup, and
+    removes it on shutdown.
+    """
+    global _registry
+    _registry = registry
+
+
+def get_session(upstream: str, **kwargs) -> aiohttp.ClientSession:
+    """
+    Returns a client session for the upstream. If there's a registry set up, the
+    session uses that upstream's shared connection pool, otherwise it gets its own
+    connector, which is closed with the session.
+
+    Requests are recorded in the upstream's metrics, see vaccine.tracing. If there's
+    a deadline for the current message, the session's timeout is capped to it, and
+    requests aren't started once it's passed.
+    """
+    kwargs["trace_configs"] = [
+        *kwargs.get("trace_configs", []),
+        tracing.get_trace_config(upstream),
+    ]
+    if deadline.remaining() is not None:
+        kwargs["timeout"] = deadline.cap_timeout(kwargs.get("timeout"))
+        kwargs["trace_configs"].append(deadline.get_trace_config())
+    if _registry is None:
+        return aiohttp.ClientSession(**kwargs)
+    return _registry.session(upstream, **kwargs)
@@ -0,0 +1,65 @@
+import json
+from typing import Optional
+
+from vaccine.models import USER_DECODE_EXCEPTIONS, User
+
+
+class JSONCodec:
+    """
+    The vumi compatible JSON format. Users stored before codecs were introduced are in
+    this format, so it has no header.
+    """
+
+    name = "json"
+    header = ""
+
+    def dumps(self, data: dict) -> str:
+        return json.dumps(data)
+
+    def loads(self, data: str) -> dict:
+        return json.loads(data)
+
+
+class CompactJSONCodec(JSONCodec):
+    """
+    JSON without any whitespace or escaping of non-ascii characters, like emoji, which
+    makes large user data a lot smaller.
+
+    The header includes a schema version, to allow changing the format in the future.
+    """
+
+    name = "compact"
+    header = "v1:"
+
+    def dumps(self, data: dict) -> str:
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+CODECS = {codec.name: codec for codec in (JSONCodec(), CompactJSONCodec())}
+
+
+def get_codec(name: str) -> JSONCodec:
+    try:
+        return CODECS[name]
+    except KeyError as e:
+        raise ValueError(f"Unknown codec {name}") from e
+
+
+def encode_user(user: User, codec: JSONCodec) -> str:
+    return codec.header + codec.dumps(user.to_dict())
+
+
+def decode_user(address: str, data: Optional[str]) -> User:
+    """
+    Decodes user data in any codec's format, so that changing codecs doesn't lose any
+    existing user data. If the data is invalid or None, returns a new user.
+    """
+    if data is None:
+        return User(address)
+    try:
+        for codec in CODECS.values():
+            if codec.header and data.startswith(codec.header):
+                return User.from_dict(codec.loads(data[len(codec.header) :]))
+        return User.from_json(data)
+    except USER_DECODE_EXCEPTIONS:
+        return User(address)
@@ -16,3 +16,37 @@ APPLICATION_CLASS = environ.get(
     "APPLICATION_CLASS", "vaccine.vaccine_eligibility.Application"
 )
 USER_LOCK_TIMEOUT = int(environ.get("USER_LOCK_TIMEOUT", "10"))
+HTTP_POOL_LIMIT = int(environ.get("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMITS = environ.get("HTTP_POOL_LIMITS", "")
+HTTP_KEEPALIVE_TIMEOUT = float(environ.get("HTTP_KEEPALIVE_TIMEOUT", "30"))
+WORKER_LANES = int(environ.get("WORKER_LANES", CONCURRENCY))
+USER_LOCK = environ.get("USER_LOCK", "true").lower() == "true"
+USER_STORE = environ.get("USER_STORE", "locked")
+USER_SAVE_RETRIES = int(environ.get("USER_SAVE_RETRIES", "3"))
+USER_CODEC = environ.get("USER_CODEC", "json")
+STICKY_ROUTING = environ.get("STICKY_ROUTING", "false").lower() == "true"
+USER_CACHE_SIZE = int(environ.get("USER_CACHE_SIZE", "1000"))
+WORKER_HEARTBEAT_INTERVAL = float(environ.get("WORKER_HEARTBEAT_INTERVAL", "5"))
+WORKER_HEARTBEAT_TIMEOUT = float(environ.get("WORKER_HEARTBEAT_TIMEOUT", "15"))
+BLOB_STORE = environ.get("BLOB_STORE", "false").lower() == "true"
+BLOB_TTL = int(environ.get("BLOB_TTL", TTL * 2))
+BLOB_MIN_SIZE = int(environ.get("BLOB_MIN_SIZE", "1024"))
+BLOB_CACHE_SIZE = int(environ.get("BLOB_CACHE_SIZE", "128"))
+PURGE_CACHE_TOKEN = environ.get("PURGE_CACHE_TOKEN")
+OUTBOX_CONSUMERS = int(environ.get("OUTBOX_CONSUMERS", "0"))
+OUTBOX_MAX_ATTEMPTS = int(environ.get("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_BACKOFF = float(environ.get("OUTBOX_BACKOFF", "1"))
+OUTBOX_RESULT_TTL = int(environ.get("OUTBOX_RESULT_TTL", "3600"))
+OUTBOX_WAIT_TIMEOUT = float(environ.get("OUTBOX_WAIT_TIMEOUT", "5"))
+MESSAGE_BUDGET = float(environ.get("MESSAGE_BUDGET", "0"))
+MESSAGE_BUDGETS = environ.get("MESSAGE_BUDGETS", "")
+HTTP_RETRY_BACKOFF = float(environ.get("HTTP_RETRY_BACKOFF", "0.1"))
+HTTP_RETRY_BUDGET_RATIO = float(environ.get("HTTP_RETRY_BUDGET_RATIO", "0.2"))
+HTTP_RETRY_BUDGET_CAPACITY = float(environ.get("HTTP_RETRY_BUDGET_CAPACITY", "10"))
+CIRCUIT_BREAKER_THRESHOLD = int(environ.get("CIRCUIT_BREAKER_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(
+    environ.get("CIRCUIT_BREAKER_RESET_TIMEOUT", "30")
+)
+WORKER_PROCESSES = int(environ.get("WORKER_PROCESSES", "2"))
+WORKER_SHUTDOWN_TIMEOUT = float(environ.get("WORKER_SHUTDOWN_TIMEOUT", "30"))
+WARM_UP = environ.get("WARM_UP", "false").lower() == "true"
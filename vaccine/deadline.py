@@ -0,0 +1,87 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import aiohttp
+from prometheus_client import Counter
+
+DEADLINE_OVERRUNS = Counter(
+    "deadline_overruns",
+    "Whenever processing a message took longer than its deadline",
+    ("state",),
+)
+
+# When processing the current message needs to be done by, in time.monotonic() time
+DEADLINE: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """
+    There's no time left to make a request before the message's deadline. This is a
+    TimeoutError, so that it's handled the same way as a request that timed out.
+    """
+
+
+@contextmanager
+def deadline(at: Optional[float]):
+    """
+    Sets the deadline for everything done inside this context. None means there is no
+    deadline.
+    """
+    token = DEADLINE.set(at)
+    try:
+        yield
+    finally:
+        DEADLINE.reset(token)
+
+
+def clear():
+    """
+    Removes the deadline for the current context. Background tasks run in a copy of
+    the context that they were started from, so they need to clear the deadline of
+    the message that started them.
+    """
+    DEADLINE.set(None)
+
+
+def remaining() -> Optional[float]:
+    """
+    Returns the number of seconds left until the deadline, or None if there isn't one
+    """
+    at = DEADLINE.get()
+    if at is None:
+        return None
+    return at - time.monotonic()
+
+
+def cap_timeout(timeout: Optional[aiohttp.ClientTimeout]) -> aiohttp.ClientTimeout:
+    """
+    Caps the total timeout to the time left until the deadline
+    """
+    timeout = timeout or aiohttp.ClientTimeout()
+    left = remaining()
+    if left is None:
+        return timeout
+    total = left if timeout.total is None else min(timeout.total, left)
+    return aiohttp.ClientTimeout(
+        total=max(total, 0.001),
+        connect=timeout.connect,
+        sock_read=timeout.sock_read,
+        sock_connect=timeout.sock_connect,
+    )
+
+
+async def on_request_start(session, trace_config_ctx, params):
+    # Retries check the deadline too, so that we don't start requests, or retries,
+    # that can't finish in time
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {params.method} {params.url}")
+
+
+def get_trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    return trace_config
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import zlib
+from collections.abc import Awaitable
+from typing import Any, Callable
+
+from prometheus_client import Gauge
+
+LANE_QUEUE_DEPTH = Gauge(
+    "worker_lane_queue_depth",
+    "Number of messages waiting to be processed in a worker lane",
+    ("lane",),
+    multiprocess_mode="livesum",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LaneDispatcher:
+    """
+    Routes items onto a fixed number of lanes by hashing their key. Each lane processes
+    its items one at a time, so items with the same key are processed in the order
+    that they were dispatched, while items with different keys can be processed
+    concurrently on different lanes.
+    """
+
+    def __init__(self, lanes: int, handler: Callable[[Any], Awaitable]):
+        self.handler = handler
+        self.queues: list[asyncio.Queue] = [asyncio.Queue() for _ in range(lanes)]
+        self.tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self._run(lane)) for lane in range(len(self.queues))
+        ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def get_lane(self, key: str) -> int:
+        # crc32 rather than hash(), so that a key always maps to the same lane
+        return zlib.crc32(key.encode("utf-8")) % len(self.queues)
+
+    def dispatch(self, key: str, item: Any) -> asyncio.Future:
+        """
+        Returns a future that's done once the item has been processed
+        """
+        lane = self.get_lane(key)
+        queue = self.queues[lane]
+        done = asyncio.get_running_loop().create_future()
+        queue.put_nowait((item, done))
+        LANE_QUEUE_DEPTH.labels(lane).set(queue.qsize())
+        return done
+
+    async def join(self):
+        """
+        Waits for all the currently dispatched items to be processed
+        """
+        for queue in self.queues:
+            await queue.join()
+
+    async def _run(self, lane: int):
+        queue = self.queues[lane]
+        while True:
+            item, done = await queue.get()
+            LANE_QUEUE_DEPTH.labels(lane).set(queue.qsize())
+            try:
+                await self.handler(item)
+            except Exception:
+                logger.exception(f"Error processing item in lane {lane}")
+            finally:
+                queue.task_done()
+                if not done.done():
+                    done.set_result(None)
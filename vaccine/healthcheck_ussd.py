@@ -5,6 +5,7 @@ from urllib.parse import urljoin
 import aiohttp
 
 import vaccine.healthcheck_config as config
+from vaccine import clients, outbox, resilience
 from vaccine.base_application import BaseApplication
 from vaccine.states import (
     Choice,
@@ -13,6 +14,7 @@ from vaccine.states import (
     ErrorMessage,
     FreeText,
     MenuState,
+    static_state,
 )
 from vaccine.utils import (
     DECODE_MESSAGE_EXCEPTIONS,
@@ -24,12 +26,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_eventstore():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "eventstore",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Token {config.EVENTSTORE_API_TOKEN}",
@@ -39,15 +37,20 @@ def get_eventstore():
     )
 
 
+outbox.register_target("healthcheck_ussd.eventstore", get_eventstore)
+
+
 def get_google_api():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "google",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={"Content-Type": "application/json", "User-Agent": "healthcheck-ussd"},
     )
 
 
 def get_rapidpro():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "rapidpro",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Token {config.RAPIDPRO_TOKEN}",
@@ -117,26 +120,25 @@ class Application(BaseApplication):
         msisdn = normalise_phonenumber(self.inbound.from_addr)
         self.save_answer("google_session_token", secrets.token_bytes(20).hex())
         async with get_eventstore() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        urljoin(
-                            config.EVENTSTORE_API_URL,
-                            f"/api/v2/healthcheckuserprofile/{msisdn}/",
+            try:
+                async for attempt in resilience.retrying("eventstore"):
+                    with attempt:
+                        response = await session.get(
+                            urljoin(
+                                config.EVENTSTORE_API_URL,
+                                f"/api/v2/healthcheckuserprofile/{msisdn}/",
+                            )
                         )
-                    )
-                    if response.status == 404:
-                        self.save_answer("returning_user", "no")
-                        return await self.go_to_state("state_save_healthcheck_start")
-                    response.raise_for_status()
-                    data = await response.json()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+                        if response.status == 404:
+                            self.save_answer("returning_user", "no")
+                            return await self.go_to_state(
+                                "state_save_healthcheck_start"
+                            )
+                        response.raise_for_status()
+                        data = await response.json()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
 
         self.save_answer("returning_user", "yes")
         self.save_answer("state_province", data["province"])
@@ -158,25 +160,22 @@ class Application(BaseApplication):
 
     async def state_save_healthcheck_start(self):
         async with get_eventstore() as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        urljoin(
-                            config.EVENTSTORE_API_URL, "/api/v2/covid19triagestart/"
-                        ),
-                        json={
-                            "msisdn": self.inbound.from_addr,
-                            "source": f"USSD {self.inbound.to_addr}",
-                        },
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("eventstore"):
+                    with attempt:
+                        response = await session.post(
+                            urljoin(
+                                config.EVENTSTORE_API_URL, "/api/v2/covid19triagestart/"
+                            ),
+                            json={
+                                "msisdn": self.inbound.from_addr,
+                                "source": f"USSD {self.inbound.to_addr}",
+                            },
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         return await self.go_to_state("state_welcome")
 
     async def state_welcome(self):
@@ -236,24 +235,23 @@ class Application(BaseApplication):
             and config.RAPIDPRO_PRIVACY_POLICY_SMS_FLOW
         ):
             async with get_rapidpro() as session:
-                for i in range(3):
-                    try:
-                        data = {
-                            "flow": config.RAPIDPRO_PRIVACY_POLICY_SMS_FLOW,
-                            "urns": [f"tel:{self.inbound.from_addr}"],
-                        }
-                        response = await session.post(
-                            urljoin(config.RAPIDPRO_URL, "/api/v2/flow_starts.json"),
-                            json=data,
-                        )
-                        response.raise_for_status()
-                        break
-                    except HTTP_EXCEPTIONS as e:
-                        if i == 2:
-                            logger.exception(e)
-                            return await self.go_to_state("state_error")
-                        else:
-                            continue
+                try:
+                    async for attempt in resilience.retrying("rapidpro"):
+                        with attempt:
+                            data = {
+                                "flow": config.RAPIDPRO_PRIVACY_POLICY_SMS_FLOW,
+                                "urns": [f"tel:{self.inbound.from_addr}"],
+                            }
+                            response = await session.post(
+                                urljoin(
+                                    config.RAPIDPRO_URL, "/api/v2/flow_starts.json"
+                                ),
+                                json=data,
+                            )
+                            response.raise_for_status()
+                except HTTP_EXCEPTIONS as e:
+                    logger.exception(e)
+                    return await self.go_to_state("state_error")
 
         return await self.go_to_state("state_privacy_policy")
 
@@ -285,6 +283,7 @@ class Application(BaseApplication):
         )
         return EndState(self, text=text, next=self.START_STATE)
 
+    @static_state
     async def state_more_info_pg1(self):
         return MenuState(
             self,
@@ -301,6 +300,7 @@ class Application(BaseApplication):
             choices=[Choice("state_more_info_pg2", self._("Next"))],
         )
 
+    @static_state
     async def state_more_info_pg2(self):
         return MenuState(
             self,
@@ -385,40 +385,38 @@ class Application(BaseApplication):
 
     async def state_google_places_lookup(self):
         async with get_google_api() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        urljoin(
-                            config.GOOGLE_PLACES_URL,
-                            "/maps/api/place/autocomplete/json",
-                        ),
-                        params={
-                            "input": self.user.answers.get("state_city"),
-                            "key": config.GOOGLE_PLACES_KEY,
-                            "sessiontoken": self.user.answers.get(
-                                "google_session_token"
+            try:
+                async for attempt in resilience.retrying("google"):
+                    with attempt:
+                        response = await session.get(
+                            urljoin(
+                                config.GOOGLE_PLACES_URL,
+                                "/maps/api/place/autocomplete/json",
                             ),
-                            "language": "en",
-                            "components": "country:za",
-                        },
-                    )
-                    response.raise_for_status()
-                    data = await response.json()
+                            params={
+                                "input": self.user.answers.get("state_city"),
+                                "key": config.GOOGLE_PLACES_KEY,
+                                "sessiontoken": self.user.answers.get(
+                                    "google_session_token"
+                                ),
+                                "language": "en",
+                                "components": "country:za",
+                            },
+                        )
+                        response.raise_for_status()
+                        data = await response.json()
 
-                    if data["status"] != "OK":
-                        return await self.go_to_state("state_city")
+                        if data["status"] != "OK":
+                            return await self.go_to_state("state_city")
 
-                    first_result = data["predictions"][0]
-                    self.save_answer("place_id", first_result["place_id"])
-                    self.save_answer("state_city", first_result["description"])
+                        first_result = data["predictions"][0]
+                        self.save_answer("place_id", first_result["place_id"])
+                        self.save_answer("state_city", first_result["description"])
 
-                    return await self.go_to_state("state_confirm_city")
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+                        return await self.go_to_state("state_confirm_city")
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
 
     async def state_confirm_city(self):
         address = self.user.answers.get("state_city")[: 160 - 79]
@@ -444,42 +442,40 @@ class Application(BaseApplication):
 
     async def state_place_details_lookup(self):
         async with get_google_api() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        urljoin(
-                            config.GOOGLE_PLACES_URL, "/maps/api/place/details/json"
-                        ),
-                        params={
-                            "key": config.GOOGLE_PLACES_KEY,
-                            "place_id": self.user.answers.get("place_id"),
-                            "sessiontoken": self.user.answers.get(
-                                "google_session_token"
+            try:
+                async for attempt in resilience.retrying("google"):
+                    with attempt:
+                        response = await session.get(
+                            urljoin(
+                                config.GOOGLE_PLACES_URL, "/maps/api/place/details/json"
                             ),
-                            "language": "en",
-                            "fields": "geometry",
-                        },
-                    )
-                    response.raise_for_status()
-                    data = await response.json()
+                            params={
+                                "key": config.GOOGLE_PLACES_KEY,
+                                "place_id": self.user.answers.get("place_id"),
+                                "sessiontoken": self.user.answers.get(
+                                    "google_session_token"
+                                ),
+                                "language": "en",
+                                "fields": "geometry",
+                            },
+                        )
+                        response.raise_for_status()
+                        data = await response.json()
 
-                    if data["status"] != "OK":
-                        return await self.go_to_state("state_city")
+                        if data["status"] != "OK":
+                            return await self.go_to_state("state_city")
 
-                    location = data["result"]["geometry"]["location"]
+                        location = data["result"]["geometry"]["location"]
 
-                    self.save_answer(
-                        "city_location",
-                        self.format_location(location["lat"], location["lng"]),
-                    )
+                        self.save_answer(
+                            "city_location",
+                            self.format_location(location["lat"], location["lng"]),
+                        )
 
-                    return await self.go_to_state("state_fever")
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+                        return await self.go_to_state("state_fever")
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
 
     async def state_age_years(self):
         if self.user.answers.get("state_age") and self.user.answers.get(
@@ -512,6 +508,7 @@ class Application(BaseApplication):
             self, question=question, check=validate_age, next="state_province"
         )
 
+    @static_state
     async def state_fever(self):
         return ChoiceState(
             self,
@@ -532,6 +529,7 @@ class Application(BaseApplication):
             next="state_cough",
         )
 
+    @static_state
     async def state_cough(self):
         question = self._("Do you have a cough that recently started?\n\nReply")
         error = self._(
@@ -548,6 +546,7 @@ class Application(BaseApplication):
             next="state_sore_throat",
         )
 
+    @static_state
     async def state_sore_throat(self):
         return ChoiceState(
             self,
@@ -564,6 +563,7 @@ class Application(BaseApplication):
             next="state_breathing",
         )
 
+    @static_state
     async def state_breathing(self):
         question = self._(
             "Do you have breathlessness or a difficulty breathing, that you've "
@@ -584,6 +584,7 @@ class Application(BaseApplication):
             next=next_state,
         )
 
+    @static_state
     async def state_taste_and_smell(self):
         return ChoiceState(
             self,
@@ -632,6 +633,7 @@ class Application(BaseApplication):
             next="state_age_years",
         )
 
+    @static_state
     async def state_exposure(self):
         return ChoiceState(
             self,
@@ -655,6 +657,7 @@ class Application(BaseApplication):
             next="state_tracing",
         )
 
+    @static_state
     async def state_tracing(self):
         question = self._(
             "Please confirm that the information you shared is correct & that the "
@@ -686,49 +689,40 @@ class Application(BaseApplication):
         if self.user.answers.get("state_tracing") == "restart":
             return await self.go_to_state("state_start")
 
-        async with get_eventstore() as session:
-            for i in range(3):
-                try:
-                    data = {
-                        "msisdn": self.inbound.from_addr,
-                        "source": f"USSD {self.inbound.to_addr}",
-                        "province": self.user.answers.get("state_province"),
-                        "city": self.user.answers.get("state_city"),
-                        "city_location": self.user.answers.get("city_location"),
-                        "age": self.user.answers.get("state_age"),
-                        "fever": self.user.answers.get("state_fever"),
-                        "cough": self.user.answers.get("state_cough"),
-                        "sore_throat": self.user.answers.get("state_sore_throat"),
-                        "difficulty_breathing": self.user.answers.get(
-                            "state_breathing"
-                        ),
-                        "smell": self.user.answers.get("state_taste_and_smell"),
-                        "preexisting_condition": self.user.answers.get(
-                            "state_preexisting_conditions", ""
-                        ),
-                        "exposure": self.user.answers.get("state_exposure"),
-                        "tracing": self.user.answers.get("state_tracing"),
-                        "risk": self.calculate_risk(),
-                        "data": {
-                            "age_years": self.user.answers.get("state_age_years"),
-                            "privacy_policy_accepted": "yes",
-                        },
-                    }
-                    logger.info(">>>> state_submit_data /api/v3/covid19triage/")
-                    logger.info(config.EVENTSTORE_API_URL)
-                    logger.info(data)
-                    response = await session.post(
-                        urljoin(config.EVENTSTORE_API_URL, "/api/v3/covid19triage/"),
-                        json=data,
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+        data = {
+            "msisdn": self.inbound.from_addr,
+            "source": f"USSD {self.inbound.to_addr}",
+            "province": self.user.answers.get("state_province"),
+            "city": self.user.answers.get("state_city"),
+            "city_location": self.user.answers.get("city_location"),
+            "age": self.user.answers.get("state_age"),
+            "fever": self.user.answers.get("state_fever"),
+            "cough": self.user.answers.get("state_cough"),
+            "sore_throat": self.user.answers.get("state_sore_throat"),
+            "difficulty_breathing": self.user.answers.get("state_breathing"),
+            "smell": self.user.answers.get("state_taste_and_smell"),
+            "preexisting_condition": self.user.answers.get(
+                "state_preexisting_conditions", ""
+            ),
+            "exposure": self.user.answers.get("state_exposure"),
+            "tracing": self.user.answers.get("state_tracing"),
+            "risk": self.calculate_risk(),
+            "data": {
+                "age_years": self.user.answers.get("state_age_years"),
+                "privacy_policy_accepted": "yes",
+            },
+        }
+        logger.info(">>>> state_submit_data /api/v3/covid19triage/")
+        logger.info(config.EVENTSTORE_API_URL)
+        logger.info(data)
+        error = await self.submit(
+            "healthcheck_ussd.eventstore",
+            urljoin(config.EVENTSTORE_API_URL, "/api/v3/covid19triage/"),
+            data,
+            wait=True,
+        )
+        if error:
+            return await self.go_to_state("state_error")
         return await self.go_to_state("state_display_risk")
 
     async def state_display_risk(self):
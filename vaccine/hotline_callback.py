@@ -7,6 +7,7 @@ import aiohttp
 import holidays
 import sentry_sdk
 
+from vaccine import clients, resilience
 from vaccine import hotline_callback_config as config
 from vaccine.base_application import BaseApplication
 from vaccine.models import Message
@@ -35,12 +36,8 @@ class WhatsAppExitButtonState(WhatsAppButtonState):
 
 
 def get_callback_api():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "callback",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Content-Type": "application/json",
@@ -51,12 +48,8 @@ def get_callback_api():
 
 
 def get_turn_api():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "turn",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Content-Type": "application/json",
@@ -215,19 +208,18 @@ class Application(BaseApplication):
         )
 
         async with turn_api as session:
-            for i in range(3):
-                try:
-                    response = await session.get(url=url)
-                    response_data = await response.json()
-                    sentry_sdk.set_context("turn_api", {"response_data": response_data})
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("turn"):
+                    with attempt:
+                        response = await session.get(url=url)
+                        response_data = await response.json()
+                        sentry_sdk.set_context(
+                            "turn_api", {"response_data": response_data}
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
 
         def format_message(message: dict) -> str:
             timestamp = datetime.fromtimestamp(
@@ -274,22 +266,19 @@ class Application(BaseApplication):
         }
 
         async with callback_api as session:
-            for i in range(3):
-                try:
-                    response = await session.post(url=url, json=data)
-                    response_text = await response.text()
-                    sentry_sdk.set_context(
-                        "callback_api",
-                        {"request_data": data, "response_text": response_text},
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("callback"):
+                    with attempt:
+                        response = await session.post(url=url, json=data)
+                        response_text = await response.text()
+                        sentry_sdk.set_context(
+                            "callback_api",
+                            {"request_data": data, "response_text": response_text},
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
         return await self.go_to_state("state_success")
 
     async def state_success(self):
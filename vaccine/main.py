@@ -10,6 +10,7 @@ from sentry_sdk.integrations.sanic import SanicIntegration
 
 from vaccine import config
 from vaccine.metrics import setup_metrics_middleware
+from vaccine.utils import check_token
 from vaccine.worker import Worker
 
 sentry_sdk.init(
@@ -60,6 +61,17 @@ async def health(request: Request) -> HTTPResponse:
     return json(result, status=200 if result["status"] == "ok" else 500)
 
 
+@app.route("/purge-cache", methods=["POST"])
+async def purge_cache(request: Request) -> HTTPResponse:
+    if not config.PURGE_CACHE_TOKEN:
+        return json({"status": "disabled"}, status=403)
+    if not check_token(request.headers.get("Authorization"), config.PURGE_CACHE_TOKEN):
+        return json({"status": "unauthorized"}, status=401)
+    worker: Worker = app.ctx.worker  # type: ignore
+    await worker.ApplicationClass.purge_cache(worker)
+    return json({"status": "ok"})
+
+
 @app.route("/metrics")
 async def metrics(request: Request) -> HTTPResponse:
     return raw(generate_latest(), content_type=CONTENT_TYPE_LATEST)
@@ -1,3 +1,4 @@
+import os
 import time
 
 from prometheus_client import Counter, Histogram
@@ -14,6 +15,14 @@ RQS_LATENCY = Histogram(
 )
 
 
+def multiprocess_enabled() -> bool:
+    """
+    Whether metrics are written to PROMETHEUS_MULTIPROC_DIR, to be aggregated across
+    worker processes. Metrics that use functions aren't supported in this mode.
+    """
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
 def setup_metrics_middleware(app: Sanic) -> None:
     @app.middleware("request")
     async def before_request(request):
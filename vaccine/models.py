@@ -1,5 +1,6 @@
 import json
-from dataclasses import asdict, dataclass, field
+from contextlib import suppress
+from dataclasses import dataclass, field, fields
 from datetime import date, datetime, time, timezone
 from enum import Enum
 from json import JSONDecodeError
@@ -15,6 +16,18 @@ def format_timestamp(timestamp: datetime) -> str:
     return timestamp.strftime(VUMI_DATE_FORMAT)
 
 
+def parse_timestamp(value: str) -> datetime:
+    try:
+        # Much faster than strptime, and handles both of the vumi formats
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        date_format = VUMI_DATE_FORMAT
+        if "." not in value[-10:]:
+            date_format = _VUMI_DATE_FORMAT_NO_MICROSECONDS
+        timestamp = datetime.strptime(value, date_format)
+    return timestamp.replace(tzinfo=timezone.utc)
+
+
 def date_time_decoder(json_object: dict) -> dict:
     for key, value in json_object.items():
         try:
@@ -29,6 +42,24 @@ def date_time_decoder(json_object: dict) -> dict:
     return json_object
 
 
+def decode_timestamp_field(data: dict, key: str = "timestamp") -> dict:
+    """
+    Parses the timestamp in `key`, if there is one. Only this field is parsed, instead
+    of trying to parse every field like date_time_decoder does.
+    """
+    with suppress(KeyError, ValueError, TypeError):
+        data[key] = parse_timestamp(data[key])
+    return data
+
+
+def shallow_asdict(obj) -> dict:
+    """
+    Like dataclasses.asdict, but doesn't recurse into or copy the field values. When
+    serialising, we don't need the copy, and it's expensive for large user data.
+    """
+    return {f.name: getattr(obj, f.name) for f in fields(obj)}
+
+
 @dataclass
 class Message:
     class SESSION_EVENT(Enum):
@@ -63,12 +94,8 @@ class Message:
     to_addr_type: Optional[ADDRESS_TYPE] = None
     from_addr_type: Optional[ADDRESS_TYPE] = None
 
-    def to_json(self) -> str:
-        """
-        Converts the message to JSON representation for serialisation over the message
-        broker
-        """
-        data = asdict(self)
+    def to_dict(self) -> dict:
+        data = shallow_asdict(self)
         data["timestamp"] = format_timestamp(data["timestamp"])
         data["transport_type"] = data["transport_type"].value
         data["session_event"] = data["session_event"].value
@@ -76,7 +103,14 @@ class Message:
             data["to_addr_type"] = data["to_addr_type"].value
         if data.get("from_addr_type"):
             data["from_addr_type"] = data["from_addr_type"].value
-        return json.dumps(data)
+        return data
+
+    def to_json(self) -> str:
+        """
+        Converts the message to JSON representation for serialisation over the message
+        broker
+        """
+        return json.dumps(self.to_dict())
 
     @classmethod
     def from_json(cls, json_string: str):
@@ -84,8 +118,11 @@ class Message:
         Takes a serialised message from the message broker, and converts into a message
         object
         """
-        data = json.loads(json_string)
-        data = date_time_decoder(data)
+        return cls.from_dict(json.loads(json_string))
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        data = decode_timestamp_field(data)
         data["transport_type"] = cls.TRANSPORT_TYPE(data["transport_type"])
         data["session_event"] = cls.SESSION_EVENT(data["session_event"])
         if data.get("to_addr_type"):
@@ -164,17 +201,20 @@ class Event:
         elif self.event_type == self.EVENT_TYPE.DELIVERY_REPORT:
             assert self.delivery_status is not None
 
+    def to_dict(self) -> dict:
+        data = shallow_asdict(self)
+        data["timestamp"] = format_timestamp(data["timestamp"])
+        data["event_type"] = data["event_type"].value
+        if data.get("delivery_status"):
+            data["delivery_status"] = data["delivery_status"].value
+        return data
+
     def to_json(self) -> str:
         """
         Converts the event to JSON representation for serialisation over the message
         broker
         """
-        data = asdict(self)
-        data["timestamp"] = format_timestamp(data["timestamp"])
-        data["event_type"] = data["event_type"].value
-        if data.get("delivery_status"):
-            data["delivery_status"] = data["delivery_status"].value
-        return json.dumps(data)
+        return json.dumps(self.to_dict())
 
     @classmethod
     def from_json(cls, json_string: str):
@@ -182,14 +222,26 @@ class Event:
         Takes a serialised event from the message broker, and converts into an event
         object
         """
-        data = json.loads(json_string)
-        data = date_time_decoder(data)
+        return cls.from_dict(json.loads(json_string))
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        data = decode_timestamp_field(data)
         data["event_type"] = cls.EVENT_TYPE(data["event_type"])
         if data.get("delivery_status"):
             data["delivery_status"] = cls.DELIVERY_STATUS(data["delivery_status"])
         return cls(**data)
 
 
+USER_DECODE_EXCEPTIONS = (
+    UnicodeDecodeError,
+    JSONDecodeError,
+    TypeError,
+    KeyError,
+    ValueError,
+)
+
+
 @dataclass
 class StateData:
     name: Optional[str] = None
@@ -204,16 +256,25 @@ class User:
     state: StateData = field(default_factory=StateData)
     metadata: dict = field(default_factory=dict)
     session_id: Optional[Union[str, int]] = None
+    version: int = 0
+
+    def to_dict(self) -> dict:
+        data = shallow_asdict(self)
+        data["state"] = shallow_asdict(self.state)
+        return data
 
     def to_json(self) -> str:
         """
         Converts the user data to JSON representation for storing in the store
         """
-        return json.dumps(asdict(self))
+        return json.dumps(self.to_dict())
 
     @classmethod
     def from_json(cls, json_string: str):
-        data = json.loads(json_string)
+        return cls.from_dict(json.loads(json_string))
+
+    @classmethod
+    def from_dict(cls, data: dict):
         data["state"] = StateData(**data["state"])
         return cls(**data)
 
@@ -225,7 +286,7 @@ class User:
         """
         try:
             return cls.from_json(json_string)
-        except (UnicodeDecodeError, JSONDecodeError, TypeError, KeyError, ValueError):
+        except USER_DECODE_EXCEPTIONS:
             return cls(address)
 
 
@@ -239,11 +300,8 @@ class Answer:
     row_id: Union[str, int] = field(default_factory=random_id)
     response_metadata: dict = field(default_factory=dict)
 
-    def to_json(self) -> str:
-        """
-        Converts the user data to JSON representation for storing in the store
-        """
-        data = asdict(self)
+    def to_dict(self) -> dict:
+        data = shallow_asdict(self)
         data["timestamp"] = self.timestamp.isoformat()
         if isinstance(self.response, datetime):
             data["response"] = {"_datetime": self.response.isoformat()}
@@ -251,12 +309,20 @@ class Answer:
             data["response"] = {"_date": self.response.isoformat()}
         elif isinstance(self.response, time):
             data["response"] = {"_time": self.response.isoformat()}
+        return data
 
-        return json.dumps(data)
+    def to_json(self) -> str:
+        """
+        Converts the user data to JSON representation for storing in the store
+        """
+        return json.dumps(self.to_dict())
 
     @classmethod
     def from_json(cls, json_string: str):
-        data = json.loads(json_string)
+        return cls.from_dict(json.loads(json_string))
+
+    @classmethod
+    def from_dict(cls, data: dict):
         if isinstance(data["response"], dict):
             if "_datetime" in data["response"]:
                 data["response"] = datetime.fromisoformat(data["response"]["_datetime"])
@@ -0,0 +1,209 @@
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+import aiohttp
+import redis.asyncio as aioredis
+from aio_pika import Connection, ExchangeType, IncomingMessage
+from aio_pika import Message as AMQPMessage
+from aio_pika.message import DeliveryMode
+from prometheus_client import Counter
+
+from vaccine import config, resilience
+from vaccine.utils import DECODE_MESSAGE_EXCEPTIONS, HTTP_EXCEPTIONS, random_id
+
+OUTBOX_DELIVERIES = Counter(
+    "outbox_deliveries",
+    "Whenever an outbox submission is processed",
+    ("target", "result"),
+)
+
+logger = logging.getLogger(__name__)
+
+# Functions that return a session for each upstream that submissions can be sent to.
+# Submissions only contain the target name, so that credentials aren't put on the
+# queue.
+TARGETS: dict[str, Callable[[], aiohttp.ClientSession]] = {}
+
+
+def register_target(name: str, get_session: Callable[[], aiohttp.ClientSession]):
+    TARGETS[name] = get_session
+
+
+@dataclass
+class Submission:
+    """
+    A request to POST data to an upstream. The id is used to make sure that each
+    submission is only delivered once, even if it's redelivered to us, or submitted
+    again with the same id, eg. when the inbound message is processed again.
+    """
+
+    target: str
+    url: str
+    data: dict
+    context: Optional[dict] = None
+    id: str = field(default_factory=random_id)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> "Submission":
+        return cls(**json.loads(data))
+
+
+async def deliver(session: aiohttp.ClientSession, submission: Submission):
+    kwargs = {}
+    if submission.context is not None:
+        kwargs["trace_request_ctx"] = submission.context
+    response = await session.post(submission.url, json=submission.data, **kwargs)
+    response.raise_for_status()
+    response.close()
+
+
+async def deliver_with_retries(submission: Submission, attempts: int = 3) -> bool:
+    """
+    Delivers the submission immediately. Returns True if it couldn't be delivered.
+    """
+    async with TARGETS[submission.target]() as session:
+        try:
+            async for attempt in resilience.retrying(submission.target, attempts):
+                with attempt:
+                    await deliver(session, submission)
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True
+    return False
+
+
+def result_key(submission_id: str) -> str:
+    return f"outbox.result.{submission_id}"
+
+
+async def wait_for_result(
+    redis: aioredis.Redis, submission_id: str, timeout: float
+) -> Optional[bool]:
+    """
+    Waits for the submission to be processed. Returns True if it couldn't be
+    delivered, or None if it wasn't processed within the timeout.
+    """
+    if timeout <= 0:
+        # A timeout of 0 would wait forever
+        return None
+    result = await redis.blpop([result_key(submission_id)], timeout=timeout)
+    if result is None:
+        return None
+    _, error = result
+    return error == "error"
+
+
+class OutboxWorker:
+    """
+    Consumes submissions from the outbox queue and delivers them, retrying with
+    exponential backoff. Submissions that can't be delivered are moved to the dead
+    letter queue.
+    """
+
+    def __init__(
+        self,
+        connection: Connection,
+        redis: aioredis.Redis,
+        consumers: int = config.OUTBOX_CONSUMERS,
+        max_attempts: int = config.OUTBOX_MAX_ATTEMPTS,
+        backoff: float = config.OUTBOX_BACKOFF,
+    ):
+        self.connection = connection
+        self.redis = redis
+        self.consumers = consumers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    async def setup(self):
+        self.channel = await self.connection.channel()
+        await self.channel.set_qos(prefetch_count=self.consumers)
+        self.exchange = await self.channel.declare_exchange(
+            "vumi", type=ExchangeType.DIRECT, durable=True, auto_delete=False
+        )
+        self.dead_letter_queue = await self.declare_queue(
+            f"{config.TRANSPORT_NAME}.outbox.dead"
+        )
+        self.queue = await self.declare_queue(f"{config.TRANSPORT_NAME}.outbox")
+        await self.queue.consume(self.process_submission)
+
+    async def declare_queue(self, routing_key: str):
+        queue = await self.channel.declare_queue(
+            routing_key, durable=True, auto_delete=False
+        )
+        await queue.bind(self.exchange, routing_key)
+        return queue
+
+    async def teardown(self):
+        await self.channel.close()
+
+    def done_key(self, submission_id: str) -> str:
+        return f"outbox.done.{submission_id}"
+
+    async def process_submission(self, amqp_msg: IncomingMessage):
+        try:
+            submission = Submission.from_json(amqp_msg.body.decode("utf-8"))
+        except DECODE_MESSAGE_EXCEPTIONS:
+            logger.exception(f"Invalid submission body {amqp_msg.body!r}")
+            amqp_msg.reject(requeue=False)
+            return
+
+        async with amqp_msg.process(requeue=True):
+            if await self.redis.exists(self.done_key(submission.id)):
+                OUTBOX_DELIVERIES.labels(submission.target, "duplicate").inc()
+                # Whoever submitted it again might be waiting for the result
+                await self.set_result(submission, False)
+                return
+            if submission.target in TARGETS:
+                error = await self.deliver(submission)
+            else:
+                # Retrying won't help, since nothing can deliver it
+                logger.error(f"Unknown outbox target {submission.target}")
+                error = True
+            if error:
+                OUTBOX_DELIVERIES.labels(submission.target, "dead").inc()
+                await self.exchange.publish(
+                    AMQPMessage(
+                        amqp_msg.body,
+                        delivery_mode=DeliveryMode.PERSISTENT,
+                        content_type="application/json",
+                        content_encoding="UTF-8",
+                    ),
+                    routing_key=f"{config.TRANSPORT_NAME}.outbox.dead",
+                )
+            else:
+                OUTBOX_DELIVERIES.labels(submission.target, "success").inc()
+                await self.redis.setex(
+                    self.done_key(submission.id), config.OUTBOX_RESULT_TTL, "1"
+                )
+            await self.set_result(submission, error)
+
+    async def deliver(self, submission: Submission) -> bool:
+        retrying = resilience.retrying(
+            submission.target, attempts=self.max_attempts, backoff=self.backoff
+        )
+        async with TARGETS[submission.target]() as session:
+            try:
+                async for attempt in retrying:
+                    with attempt:
+                        await deliver(session, submission)
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return True
+            finally:
+                if retrying.attempt > 1:
+                    OUTBOX_DELIVERIES.labels(submission.target, "retry").inc(
+                        retrying.attempt - 1
+                    )
+        return False
+
+    async def set_result(self, submission: Submission, error: bool):
+        key = result_key(submission.id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, "error" if error else "ok")
+            pipe.expire(key, config.OUTBOX_RESULT_TTL)
+            await pipe.execute()
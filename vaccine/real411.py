@@ -1,13 +1,14 @@
 import json
 import re
 from asyncio import gather
+from importlib import resources
 from typing import Optional
 from urllib.parse import urljoin
 
 import aiohttp
-import pkg_resources
 from aiohttp_client_cache import CacheBackend, CachedSession
 
+from vaccine import clients
 from vaccine import real411_config as config
 from vaccine.base_application import BaseApplication
 from vaccine.models import Message
@@ -120,7 +121,8 @@ async def finalise_real411_form(form_reference: str) -> None:
 
 
 def get_whatsapp_api() -> aiohttp.ClientSession:
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "whatsapp",
         headers={
             "User-Agent": "contactndoh-real411",
             "Authorization": f"Bearer {config.WHATSAPP_TOKEN}",
@@ -138,11 +140,12 @@ async def get_whatsapp_media(media_id: str) -> bytes:
 
 
 def get_healthcheck_api() -> aiohttp.ClientSession:
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "healthcheck",
         headers={
             "User-Agent": "contactndoh-real411",
             "Authorization": f"Token {config.HEALTHCHECK_TOKEN}",
-        }
+        },
     )
 
 
@@ -516,16 +519,17 @@ class Application(BaseApplication):
             file_names=files,
         )
         await store_complaint_id(self.form_reference, self.user.addr)
-        async with aiohttp.ClientSession(
+        async with clients.get_session(
+            "real411_media",
             headers={"User-Agent": "contactndoh-real411"},
         ) as session:
             for file, file_url in zip(files, file_urls):
                 if file["name"] == "placeholder":
-                    filename = pkg_resources.resource_filename(
-                        "vaccine", "data/real411_placeholder.png"
+                    file_data = (
+                        resources.files("vaccine")
+                        .joinpath("data/real411_placeholder.png")
+                        .read_bytes()
                     )
-                    with open(filename, "rb") as f:
-                        file_data = f.read()
                 else:
                     file_data = await get_whatsapp_media(file["name"])
                 result = await session.put(
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import random
+import time
+from types import TracebackType
+from typing import Optional
+
+import aiohttp
+from prometheus_client import Counter, Gauge
+
+from vaccine import clients, config, deadline
+from vaccine.utils import HTTP_EXCEPTIONS
+
+CIRCUIT_BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "The state of the upstream's circuit breaker. 0 is closed, 1 is half open, "
+    "2 is open",
+    ("upstream",),
+    multiprocess_mode="livemax",
+)
+CIRCUIT_BREAKER_REJECTIONS = Counter(
+    "circuit_breaker_rejections",
+    "Whenever a request isn't made because the upstream's circuit breaker is open",
+    ("upstream",),
+)
+UPSTREAM_RETRIES = Counter(
+    "upstream_retries",
+    "Whenever a failed upstream request is retried, or isn't because the retry "
+    "budget is used up",
+    ("upstream", "result"),
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    """
+    The upstream's circuit breaker is open, so the request wasn't made. This is a
+    ClientError, so that it's handled the same way as a failed request.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops making requests to an upstream after too many consecutive failures. After
+    the reset timeout, a single trial request is let through, and if it succeeds,
+    requests are allowed again.
+    """
+
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+    def __init__(
+        self,
+        upstream: str,
+        threshold: int = config.CIRCUIT_BREAKER_THRESHOLD,
+        reset_timeout: float = config.CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ):
+        self.upstream = upstream
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_progress = False
+        self.set_state(self.CLOSED)
+
+    def set_state(self, state: int):
+        self.state = state
+        CIRCUIT_BREAKER_STATE.labels(self.upstream).set(state)
+
+    def allow(self) -> bool:
+        """
+        Returns whether a request can be made to the upstream
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self.trial_in_progress:
+                return False
+            self.trial_in_progress = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.trial_in_progress = False
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit breaker for {self.upstream} closed")
+            self.set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_progress = False
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.failures >= self.threshold
+        ):
+            logger.warning(f"Circuit breaker for {self.upstream} opened")
+            self.opened_at = time.monotonic()
+            self.set_state(self.OPEN)
+
+    def release(self):
+        """
+        For requests that ended without telling us anything about the upstream's
+        health, so that the next request can be the trial request instead
+        """
+        self.trial_in_progress = False
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of the requests made to an upstream, so that when it's
+    struggling, retries don't multiply the load on it. Each request adds `ratio` to the
+    budget, up to `capacity`, and each retry uses up 1.
+    """
+
+    def __init__(
+        self,
+        ratio: float = config.HTTP_RETRY_BUDGET_RATIO,
+        capacity: float = config.HTTP_RETRY_BUDGET_CAPACITY,
+    ):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def get_breaker(upstream: str) -> Optional[CircuitBreaker]:
+    """
+    Returns the circuit breaker for the upstream. Breakers are kept on the client
+    registry, so without a registry, there isn't one.
+    """
+    registry = clients.get_registry()
+    if registry is None or config.CIRCUIT_BREAKER_THRESHOLD <= 0:
+        return None
+    breaker = registry.breakers.get(upstream)
+    if breaker is None:
+        breaker = registry.breakers[upstream] = CircuitBreaker(upstream)
+    return breaker
+
+
+def get_retry_budget(upstream: str) -> Optional[RetryBudget]:
+    registry = clients.get_registry()
+    if registry is None:
+        return None
+    budget = registry.retry_budgets.get(upstream)
+    if budget is None:
+        budget = registry.retry_budgets[upstream] = RetryBudget()
+    return budget
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Whether the error means that the upstream is unhealthy. Client errors, other than
+    rate limiting, mean that the upstream is up and responding.
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return True
+
+
+class Attempt:
+    def __init__(self, retrying: "Retrying"):
+        self.retrying = retrying
+
+    def __enter__(self) -> "Attempt":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> bool:
+        breaker = self.retrying.breaker
+        if exc is None:
+            if breaker is not None:
+                breaker.record_success()
+            self.retrying.done = True
+            return False
+        if not isinstance(exc, HTTP_EXCEPTIONS):
+            if breaker is not None:
+                breaker.release()
+            return False
+        if breaker is not None:
+            if is_upstream_failure(exc):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        self.retrying.error = exc
+        return True
+
+
+class Retrying:
+    """
+    Makes attempts at a request to an upstream, retrying failures with exponential
+    backoff and jitter. Use it like:
+
+        try:
+            async for attempt in retrying("rapidpro"):
+                with attempt:
+                    response = await session.get(...)
+                    response.raise_for_status()
+        except HTTP_EXCEPTIONS as e:
+            ...
+
+    HTTP errors inside the attempt are retried, and once there are no attempts left,
+    the last error is raised from the loop. Requests aren't retried if the upstream's
+    retry budget is used up, or if the backoff would go past the message's deadline. If
+    the upstream's circuit breaker is open, CircuitOpenError is raised without making
+    the request.
+    """
+
+    def __init__(
+        self,
+        upstream: str,
+        attempts: int = 3,
+        backoff: float = config.HTTP_RETRY_BACKOFF,
+    ):
+        self.upstream = upstream
+        self.attempts = attempts
+        self.backoff = backoff
+        self.breaker = get_breaker(upstream)
+        self.budget = get_retry_budget(upstream)
+        self.attempt = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+    def __aiter__(self) -> "Retrying":
+        return self
+
+    async def __anext__(self) -> Attempt:
+        if self.done:
+            raise StopAsyncIteration
+        if self.error is not None:
+            await self.before_retry(self.error)
+            self.error = None
+        elif self.budget is not None:
+            self.budget.deposit()
+
+        if self.breaker is not None and not self.breaker.allow():
+            CIRCUIT_BREAKER_REJECTIONS.labels(self.upstream).inc()
+            raise CircuitOpenError(f"Circuit breaker for {self.upstream} is open")
+        self.attempt += 1
+        return Attempt(self)
+
+    async def before_retry(self, error: BaseException):
+        """
+        Waits before the next attempt, or raises the error if it shouldn't be retried
+        """
+        if self.attempt >= self.attempts:
+            raise error
+        delay = self.backoff * 2 ** (self.attempt - 1)
+        delay = random.uniform(delay / 2, delay)  # noqa: S311
+        left = deadline.remaining()
+        if left is not None and left <= delay:
+            raise error
+        if self.budget is not None and not self.budget.withdraw():
+            UPSTREAM_RETRIES.labels(self.upstream, "budget_exhausted").inc()
+            raise error
+        UPSTREAM_RETRIES.labels(self.upstream, "retry").inc()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def retrying(
+    upstream: str, attempts: int = 3, backoff: float = config.HTTP_RETRY_BACKOFF
+) -> Retrying:
+    return Retrying(upstream, attempts=attempts, backoff=backoff)
@@ -0,0 +1,217 @@
+import asyncio
+import bisect
+import logging
+import time
+import zlib
+from collections.abc import Awaitable
+from typing import Callable, Optional
+
+import redis.asyncio as aioredis
+from aio_pika import Channel, Exchange, IncomingMessage
+from aio_pika import Message as AMQPMessage
+from prometheus_client import Counter
+
+from vaccine import config
+from vaccine.models import Message
+from vaccine.utils import DECODE_MESSAGE_EXCEPTIONS
+
+ROUTED_MESSAGES = Counter(
+    "worker_routed_messages",
+    "Whenever an inbound message is routed, and whether it was routed to this worker "
+    "or another one",
+    ("destination",),
+)
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto members. Each member is placed at a number of
+    points on the ring, and a key belongs to the member at the next point after the
+    key's hash, so when a member joins or leaves, only the keys next to its points
+    move.
+    """
+
+    def __init__(self, members: list[str], replicas: int = 100):
+        self.members = sorted(members)
+        points = sorted(
+            (zlib.crc32(f"{member}.{i}".encode()), member)
+            for member in self.members
+            for i in range(replicas)
+        )
+        self.hashes = [h for h, _ in points]
+        self.owners = [member for _, member in points]
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.owners:
+            return None
+        i = bisect.bisect(self.hashes, zlib.crc32(key.encode("utf-8")))
+        return self.owners[i % len(self.owners)]
+
+
+class StickyRouter:
+    """
+    Routes inbound messages to the worker that owns the user, using a consistent hash
+    of the user's address, so that each user's messages are processed by the same
+    worker, which can keep the user in memory.
+
+    Every worker consumes from the shared inbound queue, and either processes the
+    message itself, or forwards it to the owner's queue, `{TRANSPORT_NAME}.inbound.{id}`.
+    Workers send heartbeats to a redis sorted set, which is used to build the hash
+    ring. When a worker stops sending heartbeats, the others stop routing to it, and
+    one of them drains its queue, routing the messages to their new owners.
+
+    The channel must be opened with `on_return_raises=True`, so that messages
+    forwarded to a queue that doesn't exist are requeued.
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        redis: aioredis.Redis,
+        channel: Channel,
+        exchange: Exchange,
+        handler: Callable[
+            [IncomingMessage, Message], Awaitable[Optional[asyncio.Future]]
+        ],
+        on_rebalance: Callable[[HashRing], None],
+        interval: float = config.WORKER_HEARTBEAT_INTERVAL,
+        timeout: float = config.WORKER_HEARTBEAT_TIMEOUT,
+    ):
+        self.worker_id = worker_id
+        self.redis = redis
+        self.channel = channel
+        self.exchange = exchange
+        self.handler = handler
+        self.on_rebalance = on_rebalance
+        self.interval = interval
+        self.timeout = timeout
+        self.ring = HashRing([])
+        self.drains: dict[str, asyncio.Task] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def members_key(self) -> str:
+        return f"workers.{config.TRANSPORT_NAME}"
+
+    def queue_name(self, worker_id: str) -> str:
+        return f"{config.TRANSPORT_NAME}.inbound.{worker_id}"
+
+    async def start(self):
+        await self.heartbeat()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Leaves the ring, so that the other workers take over our users, and drain
+        anything left in our queue
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        for task in self.drains.values():
+            task.cancel()
+        await asyncio.gather(*self.drains.values(), return_exceptions=True)
+        await self.redis.zadd(self.members_key, {self.worker_id: 0})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.heartbeat()
+            except Exception:
+                logger.exception("Error sending worker heartbeat")
+
+    async def heartbeat(self):
+        """
+        Records that we're alive, and updates the ring with the workers that are
+        """
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.members_key, {self.worker_id: now + self.timeout})
+            pipe.zrange(self.members_key, 0, -1, withscores=True)
+            _, members = await pipe.execute()
+
+        alive = sorted(member for member, expires in members if expires > now)
+        if alive != self.ring.members:
+            logger.info(f"Rebalancing workers: {', '.join(alive)}")
+            self.ring = HashRing(alive)
+            self.on_rebalance(self.ring)
+
+        for member, expires in members:
+            if expires <= now and member not in self.drains:
+                self.drains[member] = asyncio.create_task(self.drain(member))
+
+    async def route(self, amqp_msg: IncomingMessage) -> Optional[asyncio.Future]:
+        """
+        Processes the message if we own the user, otherwise forwards it to the owner.
+        If the handler only processes it later, eg. on a lane, then returns a future
+        that's done once it's processed.
+        """
+        try:
+            msg = Message.from_json(amqp_msg.body.decode("utf-8"))
+        except DECODE_MESSAGE_EXCEPTIONS:
+            logger.exception(f"Invalid message body {amqp_msg.body!r}")
+            amqp_msg.reject(requeue=False)
+            return None
+
+        owner = self.ring.get(msg.from_addr)
+        if owner is None or owner == self.worker_id:
+            ROUTED_MESSAGES.labels("local").inc()
+            return await self.handler(amqp_msg, msg)
+
+        ROUTED_MESSAGES.labels("remote").inc()
+        async with amqp_msg.process(requeue=True):
+            # The channel must raise for returned messages, so that if the owner's queue
+            # has already been removed, publishing fails, and the message is requeued to
+            # be routed again, instead of being acked and lost
+            await self.exchange.publish(
+                AMQPMessage(
+                    amqp_msg.body,
+                    delivery_mode=amqp_msg.delivery_mode,
+                    content_type=amqp_msg.content_type,
+                    content_encoding=amqp_msg.content_encoding,
+                    headers=amqp_msg.headers,
+                ),
+                routing_key=self.queue_name(owner),
+            )
+        return None
+
+    async def drain(self, worker_id: str):
+        """
+        Routes the messages left in a worker's queue after it left, and removes its
+        queue. Only one worker drains each queue.
+        """
+        try:
+            if not await self.redis.set(
+                f"{self.members_key}.drain.{worker_id}",
+                self.worker_id,
+                nx=True,
+                ex=int(self.timeout * 4),
+            ):
+                return
+            name = self.queue_name(worker_id)
+            queue = await self.channel.declare_queue(
+                name, durable=True, auto_delete=False
+            )
+            drained = 0
+            processing = []
+            while True:
+                amqp_msg = await queue.get(fail=False)
+                if amqp_msg is None:
+                    break
+                done = await self.route(amqp_msg)
+                if done is not None:
+                    processing.append(done)
+                drained += 1
+            # The messages that we process ourselves are only acked once they're
+            # processed, and deleting the queue would lose any that aren't acked yet
+            await asyncio.gather(*processing)
+            await queue.delete(if_unused=False, if_empty=True)
+            await self.redis.zrem(self.members_key, worker_id)
+            logger.info(f"Drained {drained} messages from worker {worker_id}")
+        except Exception:
+            logger.exception(f"Error draining worker {worker_id}")
+        finally:
+            self.drains.pop(worker_id, None)
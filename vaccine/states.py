@@ -1,6 +1,9 @@
-from collections.abc import Awaitable, Sequence
+from collections.abc import Awaitable, Mapping, Sequence
+from copy import copy
 from dataclasses import dataclass, field
+from functools import cached_property, lru_cache, wraps
 from inspect import iscoroutinefunction, isfunction
+from types import MappingProxyType, MethodType
 from typing import (
     TYPE_CHECKING,
     Any,
@@ -54,7 +57,46 @@ class Choice:
     additional_keywords: list[str] = field(default_factory=list)
 
 
+def normalise_choice_text(text: Optional[str]) -> str:
+    text = (text or "").strip().lower()
+    if emoji.is_emoji(text):
+        return text[0]
+    return text
+
+
+@lru_cache(maxsize=1024)
+def get_choice_index(
+    choices: tuple[tuple[str, tuple[str, ...]], ...],
+    accept_labels: bool,
+    label_length: Optional[int],
+) -> Mapping[str, int]:
+    """
+    Returns the position of the choice that each normalised reply selects, given the
+    label and additional keywords of each choice. Where more than one choice matches
+    a reply, the first one is selected.
+
+    Most choice states have the same choices for every message, so the index is cached
+    and shared between them.
+
+    label_length: If set, labels longer than this can also be selected by their
+                  truncated label
+    """
+    index: dict[str, int] = {}
+    for i, (label, keywords) in enumerate(choices):
+        index.setdefault(str(i + 1), i)
+        if accept_labels:
+            index.setdefault(normalise_choice_text(label), i)
+        for keyword in keywords:
+            index.setdefault(normalise_choice_text(keyword), i)
+        if label_length is not None and len(label) > label_length:
+            index.setdefault(normalise_choice_text(label[:label_length]), i)
+    return MappingProxyType(index)
+
+
 class ChoiceState:
+    # If set, labels longer than this can also be selected by their truncated label
+    label_length: Optional[int] = None
+
     def __init__(
         self,
         app: "BaseApplication",
@@ -86,10 +128,15 @@ class ChoiceState:
         self.override_answer_name = override_answer_name
 
     def _normalise_text(self, text: Optional[str]) -> str:
-        text = (text or "").strip().lower()
-        if emoji.is_emoji(text):
-            return text[0]
-        return text
+        return normalise_choice_text(text)
+
+    @property
+    def _choice_index(self) -> Mapping[str, int]:
+        return get_choice_index(
+            tuple((c.label, tuple(c.additional_keywords)) for c in self.choices),
+            self.accept_labels,
+            self.label_length,
+        )
 
     def _get_choice(self, content: Optional[str]) -> Optional[Choice]:
         content = self._normalise_text(content)
@@ -99,17 +146,10 @@ class ChoiceState:
                 if content == button.value:
                     return button
 
-        for i, choice in enumerate(self.choices):
-            if content == str(i + 1):
-                return choice
-            if self.accept_labels and content == self._normalise_text(choice.label):
-                return choice
-            for keyword in choice.additional_keywords:
-                if content == self._normalise_text(keyword):
-                    return choice
-        return None
+        i = self._choice_index.get(content)
+        return None if i is None else self.choices[i]
 
-    @property
+    @cached_property
     def _display_choices(self) -> str:
         return get_display_choices(self.choices)
 
@@ -277,11 +317,7 @@ class BaseWhatsAppChoiceState(ChoiceState):
     Takes into account that buttons and list options will be truncated at 20 characters
     """
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        for choice in self.choices:
-            if len(choice.label) > 20:
-                choice.additional_keywords.append(choice.label[:20])
+    label_length = 20
 
 
 class WhatsAppButtonState(BaseWhatsAppChoiceState):
@@ -346,7 +382,7 @@ class SectionedChoiceState(ChoiceState):
         self.sections = sections
         self.separator = separator
 
-    @property
+    @cached_property
     def _display_choices(self) -> str:
         lines = []
 
@@ -401,3 +437,52 @@ class CustomChoiceState(BaseWhatsAppChoiceState):
 
     async def display_error(self, message):
         return self.app.send_message(self.error, helper_metadata=self._helper_metadata)
+
+
+def static_state(handler):
+    """
+    Marks a state handler whose state only depends on the user's language, so that the
+    state, and its rendered choices, are only built once for each language, and copied
+    for every message after that.
+
+    The handler mustn't have any side effects, or use anything about the user or the
+    message other than the language, because it doesn't run for most messages. Methods
+    of the application, eg. a next function, are bound to each message's application.
+    Anything that differs between users, like yal's persona fields, should be left as
+    placeholders that are replaced when the message is sent.
+
+    Like functools.lru_cache, the cached states can be removed with
+    `Application.state_name.cache_clear()`.
+    """
+    # (application class, language): (state, names of the application's methods)
+    states: dict[tuple[type, Optional[str]], tuple[Any, dict[str, Callable]]] = {}
+
+    @wraps(handler)
+    async def wrapper(self, **kw):
+        # States that are passed arguments aren't static
+        if kw:
+            return await handler(self, **kw)
+        key = (type(self), self.user.lang)
+        if key not in states:
+            state = await handler(self)
+            methods = {
+                name: value.__func__
+                for name, value in vars(state).items()
+                if isinstance(value, MethodType) and value.__self__ is self
+            }
+            # Render the choices once, so that every copy shares them
+            getattr(state, "_display_choices", None)
+            # Don't keep this message's application alive
+            state.app = None
+            for name in methods:
+                setattr(state, name, None)
+            states[key] = (state, methods)
+        state, methods = states[key]
+        state = copy(state)
+        state.app = self
+        for name, func in methods.items():
+            setattr(state, name, MethodType(func, self))
+        return state
+
+    wrapper.cache_clear = states.clear  # type: ignore
+    return wrapper
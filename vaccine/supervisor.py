@@ -0,0 +1,198 @@
+"""
+Runs WORKER_PROCESSES worker processes, which all consume from the same queues, behind
+a single HTTP server for health checks and metrics.
+
+Run it with `sanic vaccine.supervisor.app`, instead of `vaccine.main.app`. The
+PROMETHEUS_MULTIPROC_DIR environment variable needs to be set, so that the metrics from
+all the processes can be aggregated.
+
+Requests to `/purge-cache` are passed on to each worker process with SIGUSR1, and the
+workers purge their caches in the background.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.process import BaseProcess
+from pathlib import Path
+from typing import Callable
+
+import sentry_sdk
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
+from prometheus_client.exposition import generate_latest
+from sanic import Sanic
+from sanic.request import Request
+from sanic.response import HTTPResponse, json, raw
+
+from vaccine import config
+from vaccine.metrics import setup_metrics_middleware
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker():
+    """
+    The entrypoint for each worker process
+    """
+    sentry_sdk.init(traces_sample_rate=config.SENTRY_TRACES_SAMPLE_RATE)
+    # SIGUSR1 would kill the worker if a purge was requested while it was starting up
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    asyncio.run(serve_worker())
+
+
+async def serve_worker():
+    # Imported here, so that the supervisor doesn't need to import the application
+    from vaccine.worker import Worker
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    worker = Worker()
+    await worker.setup()
+
+    purges: set[asyncio.Task] = set()
+
+    async def purge_cache():
+        try:
+            await worker.ApplicationClass.purge_cache(worker)
+        except Exception:
+            logger.exception(f"Worker {os.getpid()} failed to purge cache")
+
+    def start_purge():
+        task = asyncio.create_task(purge_cache())
+        purges.add(task)
+        task.add_done_callback(purges.discard)
+
+    loop.add_signal_handler(signal.SIGUSR1, start_purge)
+    logger.info(f"Worker {os.getpid()} running")
+    try:
+        await stop.wait()
+    finally:
+        logger.info(f"Worker {os.getpid()} shutting down")
+        await worker.teardown()
+
+
+class Supervisor:
+    """
+    Starts the worker processes, and stops them gracefully. Workers are sent SIGTERM,
+    so that they can finish processing their current messages, and any that are still
+    running after the shutdown timeout are killed.
+    """
+
+    def __init__(
+        self,
+        processes: int = config.WORKER_PROCESSES,
+        shutdown_timeout: float = config.WORKER_SHUTDOWN_TIMEOUT,
+        target: Callable[[], None] = run_worker,
+    ):
+        self.processes = processes
+        self.shutdown_timeout = shutdown_timeout
+        self.target = target
+        self.workers: list[BaseProcess] = []
+
+    def start(self):
+        # Remove any metrics left over from previous runs
+        for path in metrics_dir().glob("*.db"):
+            path.unlink()
+        context = multiprocessing.get_context("spawn")
+        for i in range(self.processes):
+            process = context.Process(target=self.target, name=f"worker-{i}")
+            process.start()
+            self.workers.append(process)
+
+    def alive(self) -> int:
+        return sum(1 for process in self.workers if process.is_alive())
+
+    def purge_cache(self) -> int:
+        """
+        Tells each running worker to purge its caches, by sending it SIGUSR1. Returns
+        how many workers were told.
+        """
+        purged = 0
+        for process in self.workers:
+            if process.is_alive() and process.pid is not None:
+                os.kill(process.pid, signal.SIGUSR1)
+                purged += 1
+        return purged
+
+    async def stop(self):
+        for process in self.workers:
+            if process.is_alive():
+                process.terminate()
+        stop_by = time.monotonic() + self.shutdown_timeout
+        for process in self.workers:
+            timeout = max(stop_by - time.monotonic(), 0)
+            await asyncio.get_running_loop().run_in_executor(
+                None, process.join, timeout
+            )
+            if process.is_alive():
+                logger.warning(f"Worker {process.pid} didn't stop in time, killing")
+                process.kill()
+                process.join()
+            multiprocess.mark_process_dead(process.pid)
+        self.workers = []
+
+
+def metrics_dir() -> Path:
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        raise RuntimeError(
+            "PROMETHEUS_MULTIPROC_DIR must be set to run multiple workers"
+        )
+    return Path(path)
+
+
+app = Sanic("vaccine_supervisor")
+app.update_config(config)
+setup_metrics_middleware(app)
+
+
+@app.before_server_start
+async def start_workers(app, loop):
+    app.ctx.supervisor = Supervisor()
+    app.ctx.supervisor.start()
+
+
+@app.after_server_stop
+async def stop_workers(app, loop):
+    await app.ctx.supervisor.stop()
+
+
+@app.route("/")
+async def health(request: Request) -> HTTPResponse:
+    supervisor: Supervisor = app.ctx.supervisor  # type: ignore
+    alive = supervisor.alive()
+    status = "ok" if alive == supervisor.processes else "down"
+    return json(
+        {
+            "status": status,
+            "workers": {"alive": alive, "total": supervisor.processes},
+        },
+        status=200 if status == "ok" else 500,
+    )
+
+
+@app.route("/purge-cache", methods=["POST"])
+async def purge_cache(request: Request) -> HTTPResponse:
+    # Imported here, so that the worker processes, which import this module, start up
+    # faster
+    from vaccine.utils import check_token
+
+    if not config.PURGE_CACHE_TOKEN:
+        return json({"status": "disabled"}, status=403)
+    if not check_token(request.headers.get("Authorization"), config.PURGE_CACHE_TOKEN):
+        return json({"status": "unauthorized"}, status=401)
+    supervisor: Supervisor = app.ctx.supervisor  # type: ignore
+    return json({"status": "ok", "workers": supervisor.purge_cache()})
+
+
+@app.route("/metrics")
+async def metrics(request: Request) -> HTTPResponse:
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=metrics_dir())
+    return raw(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
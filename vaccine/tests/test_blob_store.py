@@ -0,0 +1,85 @@
+import pytest
+import redis.asyncio as aioredis
+
+from vaccine import config
+from vaccine.base_application import BaseApplication
+from vaccine.blob_store import BlobStore, is_reference
+from vaccine.models import User
+from vaccine.testing import FakeWorker
+
+CATEGORIES = {"root": {str(i): f"Category {i}" for i in range(100)}}
+
+
+@pytest.fixture
+async def redis():
+    redis = aioredis.from_url(config.REDIS_URL, encoding="utf-8", decode_responses=True)
+    yield redis
+    for key in await redis.keys("blob.*"):
+        await redis.delete(key)
+    await redis.close()
+
+
+@pytest.mark.asyncio
+async def test_put_and_get(redis: aioredis.Redis):
+    """
+    Large values should be stored once, under a hash of their contents
+    """
+    store = BlobStore(redis, ttl=100, min_size=100)
+    reference = await store.put(CATEGORIES)
+    assert is_reference(reference)
+    assert await store.put(dict(CATEGORIES)) == reference
+    assert len(await redis.keys("blob.*")) == 1
+    assert await redis.ttl(store.key(reference["$blob"])) > 0
+
+    assert await BlobStore(redis).get(reference) == CATEGORIES
+
+
+@pytest.mark.asyncio
+async def test_put_small(redis: aioredis.Redis):
+    """
+    Small values should be returned as is, instead of being stored
+    """
+    store = BlobStore(redis, min_size=100)
+    assert await store.put({"a": 1}) == {"a": 1}
+    assert await redis.keys("blob.*") == []
+
+
+@pytest.mark.asyncio
+async def test_get_expired(redis: aioredis.Redis):
+    """
+    If the blob has expired, the default should be returned
+    """
+    store = BlobStore(redis, min_size=100)
+    reference = await store.put(CATEGORIES)
+    await redis.delete(store.key(reference["$blob"]))
+    assert await BlobStore(redis).get(reference, "default") == "default"
+
+
+@pytest.mark.asyncio
+async def test_cache_size(redis: aioredis.Redis):
+    """
+    The least recently used blobs should be removed from the cache
+    """
+    store = BlobStore(redis, min_size=0, cache_size=2)
+    references = [await store.put(i) for i in range(3)]
+    assert list(store.cache) == [r["$blob"] for r in references[1:]]
+    assert await store.get(references[0]) == 0
+
+
+@pytest.mark.asyncio
+async def test_shared_metadata(redis: aioredis.Redis):
+    """
+    Shared metadata should be stored in the worker's blob store, if it has one
+    """
+    worker = FakeWorker()
+    worker.blob_store = BlobStore(redis, min_size=100)
+    app = BaseApplication(User("27820001001"), worker)
+    await app.save_shared_metadata("categories", CATEGORIES)
+    assert is_reference(app.user.metadata["categories"])
+    assert await app.get_metadata("categories") == CATEGORIES
+    assert await app.get_metadata("missing", "default") == "default"
+
+    app = BaseApplication(User("27820001001"), FakeWorker())
+    await app.save_shared_metadata("categories", CATEGORIES)
+    assert app.user.metadata["categories"] == CATEGORIES
+    assert await app.get_metadata("categories") == CATEGORIES
@@ -0,0 +1,68 @@
+import pytest
+
+from vaccine import clients
+from vaccine.clients import ClientRegistry, get_session, parse_limits
+
+
+def test_parse_limits():
+    """
+    Should parse the upstream limits, ignoring invalid entries
+    """
+    assert parse_limits("rapidpro=20, contentrepo=50") == {
+        "rapidpro": 20,
+        "contentrepo": 50,
+    }
+    assert parse_limits("rapidpro=invalid,,turn") == {}
+    assert parse_limits(None) == {}
+
+
+@pytest.mark.asyncio
+async def test_registry_connector_per_upstream():
+    """
+    Each upstream should get its own connector, which is reused for that upstream
+    """
+    registry = ClientRegistry(limit=10, limits={"rapidpro": 5})
+    rapidpro = registry.get_connector("rapidpro")
+    assert registry.get_connector("rapidpro") is rapidpro
+    assert rapidpro.limit == 5
+
+    contentrepo = registry.get_connector("contentrepo")
+    assert contentrepo is not rapidpro
+    assert contentrepo.limit == 10
+
+    await registry.close()
+    assert rapidpro.closed
+    assert contentrepo.closed
+    assert registry.connectors == {}
+
+
+@pytest.mark.asyncio
+async def test_registry_session_does_not_close_connector():
+    """
+    Closing a session from the registry should keep the shared connector open
+    """
+    registry = ClientRegistry()
+    async with registry.session("rapidpro") as session:
+        assert session.connector is registry.get_connector("rapidpro")
+    assert not registry.get_connector("rapidpro").closed
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_get_session():
+    """
+    Should use the registry's connector if there is one, otherwise the session should
+    own its connector
+    """
+    async with get_session("rapidpro") as session:
+        connector = session.connector
+    assert connector.closed
+
+    registry = ClientRegistry()
+    clients.set_registry(registry)
+    try:
+        async with get_session("rapidpro") as session:
+            assert session.connector is registry.get_connector("rapidpro")
+    finally:
+        clients.set_registry(None)
+        await registry.close()
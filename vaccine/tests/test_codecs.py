@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from vaccine.codecs import (
+    CompactJSONCodec,
+    JSONCodec,
+    decode_user,
+    encode_user,
+    get_codec,
+)
+from vaccine.models import StateData, User
+
+
+@pytest.fixture
+def user():
+    return User(
+        "27820001001",
+        lang="eng",
+        answers={"state_name": "Test"},
+        state=StateData("state_start"),
+        metadata={"persona_emoji": "🤖", "categories": {"root": {"1": "Clinics"}}},
+        session_id="1",
+    )
+
+
+def test_json_codec(user):
+    """
+    The JSON codec should be the same as the legacy format
+    """
+    data = encode_user(user, JSONCodec())
+    assert data == user.to_json()
+    assert decode_user("27820001001", data) == user
+
+
+def test_compact_codec(user):
+    """
+    The compact codec should have a header, and be smaller than the JSON format
+    """
+    data = encode_user(user, CompactJSONCodec())
+    assert data.startswith("v1:")
+    assert json.loads(data[3:]) == json.loads(user.to_json())
+    assert len(data.encode()) < len(user.to_json().encode())
+    assert decode_user("27820001001", data) == user
+
+
+def test_decode_legacy_data():
+    """
+    Users stored in the legacy format without a version should still be readable
+    """
+    data = json.dumps({"addr": "27820001001", "state": {"name": "state_start"}})
+    assert decode_user("27820001001", data) == User(
+        "27820001001", state=StateData("state_start")
+    )
+
+
+def test_decode_invalid_data():
+    """
+    If the data is invalid or missing, a new user should be returned
+    """
+    assert decode_user("27820001001", None) == User("27820001001")
+    assert decode_user("27820001001", "") == User("27820001001")
+    assert decode_user("27820001001", "v1:invalid") == User("27820001001")
+    assert decode_user("27820001001", '{"state": {}}') == User("27820001001")
+
+
+def test_get_codec():
+    assert get_codec("compact").name == "compact"
+    with pytest.raises(ValueError):
+        get_codec("invalid")
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from prometheus_client import REGISTRY
+from sanic import Sanic, response
+
+from vaccine import clients, deadline
+from vaccine.base_application import BaseApplication
+from vaccine.models import Message, StateData, User
+from vaccine.states import FreeText
+from vaccine.testing import FakeWorker, TState, run_sanic
+
+
+@pytest.fixture
+async def upstream_mock():
+    Sanic.test_mode = True
+    app = Sanic("upstream_mock")
+    tstate = TState()
+
+    @app.route("/", methods=["GET"])
+    async def slow(request):
+        tstate.requests.append(request)
+        await asyncio.sleep(1)
+        return response.json({})
+
+    async with run_sanic(app) as server:
+        server.tstate = tstate
+        server.url = f"http://{server.host}:{server.port}/"
+        yield server
+
+
+def test_remaining():
+    """
+    Should return the time left until the deadline, if there is one
+    """
+    assert deadline.remaining() is None
+    with deadline.deadline(time.monotonic() + 10):
+        assert 9 < deadline.remaining() <= 10
+        deadline.clear()
+        assert deadline.remaining() is None
+    assert deadline.remaining() is None
+
+
+def test_cap_timeout():
+    """
+    Should cap the total timeout to the time left until the deadline
+    """
+    timeout = aiohttp.ClientTimeout(total=5, connect=1)
+    assert deadline.cap_timeout(timeout) is timeout
+    with deadline.deadline(time.monotonic() + 2):
+        capped = deadline.cap_timeout(timeout)
+        assert 1 < capped.total <= 2
+        assert capped.connect == 1
+    with deadline.deadline(time.monotonic() + 10):
+        assert deadline.cap_timeout(timeout).total == 5
+
+
+@pytest.mark.asyncio
+async def test_session_deadline(upstream_mock):
+    """
+    Requests should time out at the deadline, and no requests should be started once
+    the deadline has passed
+    """
+    with deadline.deadline(time.monotonic() + 0.1):
+        async with clients.get_session("test") as session:
+            with pytest.raises(asyncio.TimeoutError):
+                await session.get(upstream_mock.url)
+            with pytest.raises(deadline.DeadlineExceeded):
+                await session.get(upstream_mock.url)
+    assert len(upstream_mock.tstate.requests) == 1
+
+
+class OverrunApplication(BaseApplication):
+    START_STATE = "state_question"
+
+    async def state_question(self):
+        return FreeText(self, question="Question", next="state_answer")
+
+    async def state_answer(self):
+        return FreeText(self, question="Answer", next=self.START_STATE)
+
+
+@pytest.mark.asyncio
+async def test_overrun_state():
+    """
+    Overruns should be counted against the state that the message was processed in,
+    not the state that the user moved on to
+    """
+    worker = FakeWorker()
+    worker.ApplicationClass = OverrunApplication
+    user = User("+27820001001", state=StateData(name="state_question"), session_id="1")
+    msg = Message(
+        to_addr="27820001002",
+        from_addr="27820001001",
+        transport_name="whatsapp",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+        content="reply",
+    )
+
+    def overruns(state):
+        return REGISTRY.get_sample_value("deadline_overruns_total", {"state": state})
+
+    before = overruns("state_question") or 0
+    with deadline.deadline(time.monotonic() - 1):
+        await worker.run_application(user, msg)
+    assert user.state.name == "state_answer"
+    assert overruns("state_question") == before + 1
+    assert overruns("state_answer") is None
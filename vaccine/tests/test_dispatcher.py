@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from vaccine.dispatcher import LaneDispatcher
+
+
+@pytest.mark.asyncio
+async def test_same_key_processed_in_order():
+    """
+    Items with the same key should be processed one at a time, in dispatch order
+    """
+    processed = []
+
+    async def handler(item):
+        processed.append(("start", item))
+        await asyncio.sleep(0.01)
+        processed.append(("end", item))
+
+    dispatcher = LaneDispatcher(4, handler)
+    dispatcher.start()
+    for i in range(3):
+        dispatcher.dispatch("27820001001", i)
+    await dispatcher.join()
+    await dispatcher.stop()
+
+    assert processed == [
+        ("start", 0),
+        ("end", 0),
+        ("start", 1),
+        ("end", 1),
+        ("start", 2),
+        ("end", 2),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_different_lanes_processed_concurrently():
+    """
+    Items on different lanes shouldn't wait for each other
+    """
+    dispatcher = LaneDispatcher(4, None)
+    key1 = "27820001001"
+    key2 = next(
+        f"2782000100{i}"
+        for i in range(2, 10)
+        if dispatcher.get_lane(f"2782000100{i}") != dispatcher.get_lane(key1)
+    )
+    release = asyncio.Event()
+    processed = []
+
+    async def handler(item):
+        if item == key1:
+            await release.wait()
+        processed.append(item)
+        release.set()
+
+    dispatcher.handler = handler
+    dispatcher.start()
+    dispatcher.dispatch(key1, key1)
+    dispatcher.dispatch(key2, key2)
+    await dispatcher.join()
+    await dispatcher.stop()
+
+    assert processed == [key2, key1]
+
+
+@pytest.mark.asyncio
+async def test_handler_error():
+    """
+    An error processing an item shouldn't stop the lane
+    """
+    processed = []
+
+    async def handler(item):
+        if item == "error":
+            raise Exception("test error")
+        processed.append(item)
+
+    dispatcher = LaneDispatcher(1, handler)
+    dispatcher.start()
+    dispatcher.dispatch("27820001001", "error")
+    dispatcher.dispatch("27820001001", "ok")
+    await dispatcher.join()
+    await dispatcher.stop()
+
+    assert processed == ["ok"]
+    assert dispatcher.tasks == []
+
+
+@pytest.mark.asyncio
+async def test_dispatch_done():
+    """
+    The future returned when dispatching should be done once the item is processed,
+    even if processing it failed
+    """
+    processed = []
+
+    async def handler(item):
+        await asyncio.sleep(0.01)
+        if item == "error":
+            raise Exception("test error")
+        processed.append(item)
+
+    dispatcher = LaneDispatcher(1, handler)
+    dispatcher.start()
+    error = dispatcher.dispatch("27820001001", "error")
+    ok = dispatcher.dispatch("27820001001", "ok")
+    assert not ok.done()
+    await ok
+    assert error.done()
+    assert processed == ["ok"]
+    await dispatcher.stop()
+
+
+def test_get_lane():
+    """
+    A key should always map to the same lane
+    """
+    dispatcher = LaneDispatcher(8, None)
+    assert dispatcher.get_lane("27820001001") == dispatcher.get_lane("27820001001")
+    assert 0 <= dispatcher.get_lane("27820001001") < 8
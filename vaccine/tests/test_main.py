@@ -2,7 +2,7 @@ from sanic import Sanic
 from sanic_testing import TestManager
 from sentry_sdk.integrations import sanic as si_sanic
 
-from vaccine.main import app
+from vaccine.main import app, config
 
 # Fix multiple additions of sentry signal handlers.
 if hasattr(si_sanic, "old_startup"):
@@ -39,3 +39,28 @@ def test_health():
 
 
 # TODO: Tests for when services are down. These tests are currently done manually
+
+
+def test_purge_cache(monkeypatch):
+    monkeypatch.setattr(config, "PURGE_CACHE_TOKEN", "testtoken")
+    _, response = app.test_client.post(
+        app.url_for("purge_cache"), headers={"Authorization": "Token testtoken"}
+    )
+    assert response.status == 200
+    assert response.json == {"status": "ok"}
+
+    _, response = app.test_client.post(
+        app.url_for("purge_cache"), headers={"Authorization": "Token wrong"}
+    )
+    assert response.status == 401
+
+
+def test_purge_cache_disabled(monkeypatch):
+    """
+    Should refuse to purge the cache if there's no token configured
+    """
+    monkeypatch.setattr(config, "PURGE_CACHE_TOKEN", None)
+    _, response = app.test_client.post(
+        app.url_for("purge_cache"), headers={"Authorization": "Token None"}
+    )
+    assert response.status == 403
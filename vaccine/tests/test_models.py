@@ -1,7 +1,7 @@
 import json
 from datetime import date, datetime, timezone
 
-from vaccine.models import Answer, Event, Message, StateData, User
+from vaccine.models import Answer, Event, Message, StateData, User, parse_timestamp
 
 
 def test_message_serialisation():
@@ -177,3 +177,46 @@ def test_answer_serialization():
         session_id="1",
     )
     assert answer == Answer.from_json(answer.to_json())
+
+
+def test_message_only_decodes_timestamp_field():
+    """
+    Only the timestamp field should be decoded as a timestamp, not other fields that
+    contain timestamp-like strings
+    """
+    message = Message(
+        to_addr="27820001001",
+        from_addr="27820001002",
+        transport_name="whatsapp",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+        content="2021-02-03 04:05:06",
+        timestamp=datetime(2021, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+    )
+    decoded = Message.from_json(message.to_json())
+    assert decoded.content == "2021-02-03 04:05:06"
+    assert decoded.timestamp == message.timestamp
+
+
+def test_parse_timestamp():
+    """
+    Should parse timestamps with or without microseconds
+    """
+    assert parse_timestamp("2021-02-03 04:05:06.789000") == datetime(
+        2021, 2, 3, 4, 5, 6, 789000, tzinfo=timezone.utc
+    )
+    assert parse_timestamp("2021-02-03 04:05:06") == datetime(
+        2021, 2, 3, 4, 5, 6, tzinfo=timezone.utc
+    )
+    assert parse_timestamp("2021-02-03 04:05:06.7") == datetime(
+        2021, 2, 3, 4, 5, 6, 700000, tzinfo=timezone.utc
+    )
+
+
+def test_user_to_dict_does_not_copy():
+    """
+    Serialising the user shouldn't need a deep copy of the user data
+    """
+    user = User("27820001001", metadata={"categories": {"root": {"1": "Clinics"}}})
+    data = user.to_dict()
+    assert data["metadata"] is user.metadata
+    assert data["state"] == {"name": None, "metadata": {}}
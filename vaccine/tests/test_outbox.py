@@ -0,0 +1,168 @@
+from unittest import mock
+
+import pytest
+import redis.asyncio as aioredis
+from sanic import Sanic, response
+
+from vaccine import clients, config, outbox
+from vaccine.base_application import BaseApplication
+from vaccine.models import Message, StateData, User
+from vaccine.outbox import OutboxWorker, Submission, deliver_with_retries
+from vaccine.testing import TState, run_sanic
+
+
+@pytest.fixture
+async def redis():
+    redis = aioredis.from_url(config.REDIS_URL, encoding="utf-8", decode_responses=True)
+    yield redis
+    for key in await redis.keys("outbox.*"):
+        await redis.delete(key)
+    await redis.close()
+
+
+@pytest.fixture
+async def upstream_mock():
+    Sanic.test_mode = True
+    app = Sanic("upstream_mock")
+    tstate = TState()
+
+    @app.route("/submit", methods=["POST"])
+    def submit(request):
+        tstate.requests.append(request)
+        if tstate.errormax and tstate.errors < tstate.errormax:
+            tstate.errors += 1
+            return response.json({}, status=500)
+        return response.json({}, status=201)
+
+    async with run_sanic(app) as server:
+        server.tstate = tstate
+        outbox.register_target("test", lambda: clients.get_session("test"))
+        yield server
+        outbox.TARGETS.pop("test")
+
+
+def get_submission(server) -> Submission:
+    return Submission(
+        target="test",
+        url=f"http://{server.host}:{server.port}/submit",
+        data={"msisdn": "+27820001001"},
+    )
+
+
+def test_submission_serialisation():
+    """
+    Submissions should be able to be serialised to JSON and back
+    """
+    submission = Submission("test", "http://upstream/submit", {"a": 1}, {"b": "2"})
+    assert Submission.from_json(submission.to_json()) == submission
+
+
+@pytest.mark.asyncio
+async def test_submission_ids():
+    """
+    Processing the same message again should make submissions with the same ids, so
+    that they're only delivered once
+    """
+    msg = Message(
+        to_addr="27820001001",
+        from_addr="27820001002",
+        transport_name="whatsapp",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+    )
+
+    async def get_submission_ids():
+        worker = mock.AsyncMock()
+        app = BaseApplication(User(addr=msg.from_addr, state=StateData()), worker)
+        app.inbound = msg
+        app.state_name = "state_test"
+        await app.submit("test", "http://upstream/submit", {})
+        await app.submit("test", "http://upstream/submit", {})
+        return [c.args[0].id for c in worker.submit.call_args_list]
+
+    ids = await get_submission_ids()
+    assert len(set(ids)) == 2
+    assert await get_submission_ids() == ids
+
+
+@pytest.mark.asyncio
+async def test_deliver_with_retries(upstream_mock):
+    """
+    Should retry delivering the submission, and return whether it failed
+    """
+    upstream_mock.tstate.errormax = 2
+    assert await deliver_with_retries(get_submission(upstream_mock)) is False
+    assert len(upstream_mock.tstate.requests) == 3
+    assert upstream_mock.tstate.requests[-1].json == {"msisdn": "+27820001001"}
+
+    upstream_mock.tstate.errors = 0
+    upstream_mock.tstate.errormax = 3
+    assert await deliver_with_retries(get_submission(upstream_mock)) is True
+
+
+@pytest.mark.asyncio
+async def test_outbox_worker_deliver(upstream_mock, redis):
+    """
+    Should retry with backoff, up to the maximum attempts
+    """
+    worker = OutboxWorker(None, redis, consumers=1, max_attempts=3, backoff=0)
+    upstream_mock.tstate.errormax = 2
+    assert await worker.deliver(get_submission(upstream_mock)) is False
+    assert len(upstream_mock.tstate.requests) == 3
+
+    upstream_mock.tstate.errors = 0
+    upstream_mock.tstate.errormax = 3
+    assert await worker.deliver(get_submission(upstream_mock)) is True
+
+
+@pytest.mark.asyncio
+async def test_outbox_worker_unknown_target(redis):
+    """
+    Submissions for targets that we don't know about should go straight to the dead
+    letter queue, instead of being requeued
+    """
+    worker = OutboxWorker(None, redis)
+    worker.exchange = mock.AsyncMock()
+    submission = Submission("unknown", "http://upstream/submit", {})
+    amqp_msg = mock.MagicMock(body=submission.to_json().encode("utf-8"))
+
+    await worker.process_submission(amqp_msg)
+
+    [publish] = worker.exchange.publish.call_args_list
+    assert publish.kwargs["routing_key"] == f"{config.TRANSPORT_NAME}.outbox.dead"
+    assert publish.args[0].body == amqp_msg.body
+    assert await outbox.wait_for_result(redis, submission.id, 0.1) is True
+
+
+@pytest.mark.asyncio
+async def test_outbox_worker_duplicate(upstream_mock, redis):
+    """
+    Submissions that have already been delivered shouldn't be delivered again, but
+    should still have their result set for anyone waiting on them
+    """
+    worker = OutboxWorker(None, redis)
+    submission = get_submission(upstream_mock)
+    amqp_msg = mock.MagicMock(body=submission.to_json().encode("utf-8"))
+
+    await worker.process_submission(amqp_msg)
+    assert await outbox.wait_for_result(redis, submission.id, 0.1) is False
+    await worker.process_submission(amqp_msg)
+    assert await outbox.wait_for_result(redis, submission.id, 0.1) is False
+
+    assert len(upstream_mock.tstate.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_for_result(redis):
+    """
+    Should return the result once the submission is processed, or None if it isn't
+    processed in time
+    """
+    worker = OutboxWorker(None, redis)
+    submission = Submission("test", "http://upstream/submit", {})
+    assert await outbox.wait_for_result(redis, submission.id, 0.1) is None
+
+    await worker.set_result(submission, False)
+    assert await outbox.wait_for_result(redis, submission.id, 0.1) is False
+
+    await worker.set_result(submission, True)
+    assert await outbox.wait_for_result(redis, submission.id, 0.1) is True
@@ -0,0 +1,133 @@
+import time
+
+import aiohttp
+import pytest
+
+from vaccine import clients, deadline, resilience
+from vaccine.resilience import CircuitBreaker, CircuitOpenError, RetryBudget
+
+
+@pytest.fixture
+async def registry():
+    registry = clients.ClientRegistry()
+    clients.set_registry(registry)
+    yield registry
+    clients.set_registry(None)
+    await registry.close()
+
+
+async def call(upstream, errors, attempts=3, backoff=0):
+    """
+    Makes a call that fails with each of the errors in turn, and then succeeds.
+    Returns how many attempts were made.
+    """
+    errors = list(errors)
+    made = 0
+    async for attempt in resilience.Retrying(upstream, attempts, backoff):
+        with attempt:
+            made += 1
+            if errors:
+                raise errors.pop(0)
+    return made
+
+
+def server_error():
+    return aiohttp.ClientResponseError(None, (), status=500)
+
+
+@pytest.mark.asyncio
+async def test_retrying():
+    """
+    Should retry failures, and raise the last error if there are no attempts left
+    """
+    assert await call("test", []) == 1
+    assert await call("test", [server_error(), aiohttp.ClientError()]) == 3
+
+    error = aiohttp.ClientError()
+    with pytest.raises(aiohttp.ClientError) as e:
+        await call("test", [server_error(), server_error(), error])
+    assert e.value is error
+
+
+@pytest.mark.asyncio
+async def test_retrying_other_errors():
+    """
+    Errors that aren't HTTP errors shouldn't be retried
+    """
+    with pytest.raises(KeyError):
+        await call("test", [KeyError()])
+
+
+@pytest.mark.asyncio
+async def test_retrying_deadline():
+    """
+    Shouldn't retry if the backoff would go past the deadline
+    """
+    with deadline.deadline(time.monotonic() + 0.01), pytest.raises(aiohttp.ClientError):
+        await call("test", [server_error()], backoff=1)
+
+
+@pytest.mark.asyncio
+async def test_retry_budget(registry):
+    """
+    Once the upstream's retry budget is used up, failures shouldn't be retried
+    """
+    registry.retry_budgets["test"] = RetryBudget(ratio=0.5, capacity=1)
+    assert await call("test", [server_error()]) == 2
+    with pytest.raises(aiohttp.ClientError):
+        await call("test", [server_error()])
+    assert await call("test", [server_error()]) == 2
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker(registry):
+    """
+    After too many failures, the circuit breaker should open, and calls should fail
+    without making any requests
+    """
+    registry.breakers["test"] = breaker = CircuitBreaker("test", threshold=3)
+    with pytest.raises(aiohttp.ClientError):
+        await call("test", [server_error()] * 3)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert resilience.CIRCUIT_BREAKER_STATE.labels("test")._value.get() == 2
+
+    with pytest.raises(CircuitOpenError):
+        await call("test", [])
+
+    # Other upstreams aren't affected
+    assert await call("other", []) == 1
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_client_errors(registry):
+    """
+    Client errors mean that the upstream is up, so shouldn't open the breaker
+    """
+    registry.breakers["test"] = breaker = CircuitBreaker("test", threshold=3)
+    not_found = aiohttp.ClientResponseError(None, (), status=404)
+    with pytest.raises(aiohttp.ClientError):
+        await call("test", [not_found] * 3)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_half_open(registry):
+    """
+    After the reset timeout, a single trial request should be allowed, which closes
+    the breaker if it succeeds, or opens it again if it fails
+    """
+    registry.breakers["test"] = breaker = CircuitBreaker(
+        "test", threshold=1, reset_timeout=0
+    )
+    with pytest.raises(aiohttp.ClientError):
+        await call("test", [server_error()], attempts=1)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert breaker.allow() is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() is False
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert await call("test", []) == 1
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,128 @@
+import time
+
+import pytest
+import redis.asyncio as aioredis
+from aio_pika import ExchangeType, connect_robust
+from aio_pika import Message as AMQPMessage
+from aio_pika.exceptions import DeliveryError
+
+from vaccine import config
+from vaccine.models import Message
+from vaccine.routing import HashRing, StickyRouter
+
+ADDRESSES = [f"278200{i:05}" for i in range(1000)]
+
+
+@pytest.fixture
+async def redis():
+    redis = aioredis.from_url(config.REDIS_URL, encoding="utf-8", decode_responses=True)
+    yield redis
+    for key in await redis.keys("workers.*"):
+        await redis.delete(key)
+    await redis.close()
+
+
+def make_router(redis, worker_id, rebalances):
+    return StickyRouter(
+        worker_id=worker_id,
+        redis=redis,
+        channel=None,
+        exchange=None,
+        handler=None,
+        on_rebalance=rebalances.append,
+        timeout=10,
+    )
+
+
+def test_hash_ring():
+    """
+    Keys should be spread between the members, and when a member leaves, only its keys
+    should move
+    """
+    assert HashRing([]).get("27820001001") is None
+
+    ring = HashRing(["a", "b", "c"])
+    owners = {addr: ring.get(addr) for addr in ADDRESSES}
+    for member in ("a", "b", "c"):
+        assert 200 < list(owners.values()).count(member) < 500
+
+    smaller = HashRing(["a", "b"])
+    for addr, owner in owners.items():
+        if owner != "c":
+            assert smaller.get(addr) == owner
+
+
+@pytest.mark.asyncio
+async def test_heartbeat(redis: aioredis.Redis):
+    """
+    Workers should be added to the ring when they send heartbeats, and removed when
+    they leave
+    """
+    rebalances: list[HashRing] = []
+    router = make_router(redis, "a", rebalances)
+    await router.heartbeat()
+    assert router.ring.members == ["a"]
+
+    await make_router(redis, "b", []).heartbeat()
+    await router.heartbeat()
+    assert router.ring.members == ["a", "b"]
+    assert len(rebalances) == 2
+
+    # Nothing changed, so there's no rebalancing
+    await router.heartbeat()
+    assert len(rebalances) == 2
+
+    await redis.zadd(router.members_key, {"b": time.time() - 1})
+    await router.heartbeat()
+    assert router.ring.members == ["a"]
+    assert "b" in router.drains
+    # There's no AMQP channel, so draining fails, and it's tried again later
+    await router.drains["b"]
+    assert router.drains == {}
+
+
+@pytest.mark.asyncio
+async def test_route_missing_queue(redis: aioredis.Redis):
+    """
+    If the owner's queue doesn't exist, then the forwarded message should be requeued
+    instead of being lost
+    """
+    connection = await connect_robust(config.AMQP_URL)
+    async with connection:
+        channel = await connection.channel(
+            publisher_confirms=True, on_return_raises=True
+        )
+        exchange = await channel.declare_exchange(
+            "vumi", type=ExchangeType.DIRECT, durable=True, auto_delete=False
+        )
+        queue = await channel.declare_queue("test.routing", auto_delete=True)
+        await queue.bind(exchange, "test.routing")
+
+        router = StickyRouter(
+            worker_id="a",
+            redis=redis,
+            channel=channel,
+            exchange=exchange,
+            handler=None,
+            on_rebalance=lambda ring: None,
+        )
+        router.ring = HashRing(["a", "missing"])
+        addr = next(a for a in ADDRESSES if router.ring.get(a) == "missing")
+        msg = Message(
+            to_addr="27820001001",
+            from_addr=addr,
+            transport_name="whatsapp",
+            transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+        )
+        await exchange.publish(
+            AMQPMessage(msg.to_json().encode("utf-8")), routing_key="test.routing"
+        )
+
+        amqp_msg = await queue.get()
+        with pytest.raises(DeliveryError):
+            await router.route(amqp_msg)
+
+        requeued = await queue.get()
+        assert requeued.body == amqp_msg.body
+        assert requeued.redelivered
+        requeued.ack()
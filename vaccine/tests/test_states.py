@@ -1,6 +1,15 @@
-from ..base_application import BaseApplication
-from ..models import User
-from ..states import BaseWhatsAppChoiceState, Choice
+import pytest
+
+from ..base_application import BaseApplication, get_translations
+from ..models import Message, StateData, User
+from ..states import (
+    BaseWhatsAppChoiceState,
+    Choice,
+    ChoiceState,
+    EndState,
+    get_choice_index,
+    static_state,
+)
 
 
 def test_base_whatsapp_choice_state():
@@ -17,3 +26,180 @@ def test_base_whatsapp_choice_state():
     )
     assert state._get_choice("Choice that is longer than 20 characters") == choice
     assert state._get_choice("Choice that is longe") == choice
+    # The truncated label shouldn't be added to the choice's keywords
+    assert choice.additional_keywords == []
+
+
+def test_choice_state_get_choice():
+    """
+    Replies should select choices by number, label, or keyword, ignoring case and
+    whitespace, with the first matching choice winning
+    """
+    app = BaseApplication(User("+27820001001"))
+    choices = [
+        Choice("first", "2", additional_keywords=["one", "👍"]),
+        Choice("second", "Second", additional_keywords=["one", "2nd"]),
+        Choice("third", "1"),
+    ]
+    state = ChoiceState(app, "question", choices, "error", "next")
+    assert state._get_choice("1") == choices[0]
+    assert state._get_choice("2") == choices[0]
+    assert state._get_choice(" SECOND ") == choices[1]
+    assert state._get_choice("2nd") == choices[1]
+    assert state._get_choice("one") == choices[0]
+    assert state._get_choice("👍🏽") == choices[0]
+    assert state._get_choice("3") == choices[2]
+    assert state._get_choice("4") is None
+    assert state._get_choice(None) is None
+
+    state = ChoiceState(app, "question", choices, "error", "next", accept_labels=False)
+    assert state._get_choice("second") is None
+    assert state._get_choice("2") == choices[1]
+
+
+def test_choice_index_shared():
+    """
+    States with the same choices should share the same index
+    """
+    app = BaseApplication(User("+27820001001"))
+    choices = [Choice("yes", "Yes"), Choice("no", "No")]
+    state = ChoiceState(app, "question", choices, "error", "next")
+    state._get_choice("yes")
+    hits = get_choice_index.cache_info().hits
+    state = ChoiceState(app, "question", list(choices), "error", "next")
+    assert state._get_choice("no") == choices[1]
+    assert get_choice_index.cache_info().hits == hits + 1
+
+
+class MixinApplication(BaseApplication):
+    async def state_start(self):
+        return ChoiceState(self, "question", [Choice("a", "A")], "error", "next")
+
+    async def state_end(self):
+        return EndState(self, "goodbye")
+
+
+class StatesApplication(MixinApplication):
+    async def state_start(self):
+        return await self.go_to_state("state_end")
+
+
+def test_state_registry():
+    """
+    Each application class should have a registry of its states, including the states
+    of its mixins, and which class defines each one
+    """
+    assert set(StatesApplication.STATES) == {"state_start", "state_end", "state_error"}
+    assert "state_name" not in StatesApplication.STATES
+
+    start = StatesApplication.STATES["state_start"]
+    assert start.owner is StatesApplication
+    assert start.accepts_input is False
+    assert MixinApplication.STATES["state_start"].accepts_input is True
+
+    end = StatesApplication.STATES["state_end"]
+    assert end.owner is MixinApplication
+    assert end.accepts_input is False
+    assert StatesApplication.STATES["state_error"].owner is BaseApplication
+
+
+@pytest.mark.asyncio
+async def test_unknown_state():
+    """
+    If the user is in a state that doesn't exist, they should get the error state
+    """
+    user = User("+27820001001", state=StateData(name="state_missing"))
+    app = StatesApplication(user)
+    [reply] = await app.process_message(
+        Message(
+            to_addr="27820001002",
+            from_addr="27820001001",
+            transport_name="whatsapp",
+            transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+            content="hi",
+        )
+    )
+    assert reply.content == "Something went wrong. Please try again later."
+
+
+def make_static_application() -> type[BaseApplication]:
+    """
+    Returns a new application class, with its own build count and cached states
+    """
+
+    class StaticApplication(BaseApplication):
+        builds = 0
+
+        @static_state
+        async def state_static(self, question="question"):
+            StaticApplication.builds += 1
+            return ChoiceState(
+                self, question, [Choice("yes", "Yes")], "error", next=self._next
+            )
+
+        async def _next(self, choice):
+            return f"state_{self.user.addr}"
+
+    return StaticApplication
+
+
+@pytest.mark.asyncio
+async def test_static_state():
+    """
+    Static states should only be built once for each language, and each copy should
+    be bound to the application that it's for
+    """
+    StaticApplication = make_static_application()
+    first = StaticApplication(User("+27820001001"))
+    state = await first.state_static()
+    second = StaticApplication(User("+27820001002"))
+    copied = await second.state_static()
+    assert StaticApplication.builds == 1
+    assert copied is not state
+    assert copied.app is second
+    assert await copied._get_next(Choice("yes", "Yes")) == "state_+27820001002"
+    assert copied._display_choices == "1. Yes"
+
+    await StaticApplication(User("+27820001003", lang="zul")).state_static()
+    assert StaticApplication.builds == 2
+
+    # States that are passed arguments aren't static
+    state = await second.state_static(question="other")
+    assert state.question == "other"
+    assert StaticApplication.builds == 3
+
+
+@pytest.mark.asyncio
+async def test_static_state_cache_clear():
+    """
+    Clearing the cache should build the states again
+    """
+    StaticApplication = make_static_application()
+    app = StaticApplication(User("+27820001001"))
+    await app.state_static()
+    await app.state_static()
+    assert StaticApplication.builds == 1
+
+    StaticApplication.state_static.cache_clear()
+    await app.state_static()
+    assert StaticApplication.builds == 2
+
+
+def test_translations():
+    """
+    Applications should use the preloaded catalogue for their user's language
+    """
+    translations = get_translations()
+    assert set(translations) == {"afr", "sot", "xho", "zul"}
+
+    app = BaseApplication(User("+27820001001", lang="zul"))
+    assert app.translation is translations["zul"]
+    app.set_language("afr")
+    assert app.translation is translations["afr"]
+    assert app.user.lang == "afr"
+
+    app.set_language("eng")
+    assert app._("Yes") == "Yes"
+    # Languages without a catalogue are also only looked up once
+    other = BaseApplication(User("+27820001002", lang="eng"))
+    assert other.translation is app.translation
@@ -0,0 +1,130 @@
+import asyncio
+import signal
+import time
+
+import pytest
+from prometheus_client import Counter
+
+from vaccine import supervisor
+from vaccine.supervisor import Supervisor
+
+TEST_COUNTER = Counter("supervisor_test", "Incremented by each test worker")
+PURGE_COUNTER = Counter("supervisor_test_purges", "Incremented by each test purge")
+
+
+def wait():
+    time.sleep(60)
+
+
+def ignore_sigterm():
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(60)
+
+
+def increment_counter():
+    TEST_COUNTER.inc()
+    time.sleep(60)
+
+
+def count_purges():
+    signal.signal(signal.SIGUSR1, lambda signum, frame: PURGE_COUNTER.inc())
+    TEST_COUNTER.inc()
+    time.sleep(60)
+
+
+async def wait_for_metric(expected: bytes):
+    for _ in range(100):
+        response = await supervisor.metrics(None)
+        if expected in response.body:
+            break
+        await asyncio.sleep(0.1)
+    assert expected in response.body
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_supervisor(metrics_dir):
+    """
+    Should start the worker processes, and stop them on shutdown
+    """
+    sup = Supervisor(processes=2, shutdown_timeout=5, target=wait)
+    sup.start()
+    workers = list(sup.workers)
+    assert sup.alive() == 2
+    await sup.stop()
+    assert sup.alive() == 0
+    assert not any(process.is_alive() for process in workers)
+
+
+@pytest.mark.asyncio
+async def test_supervisor_kill(metrics_dir):
+    """
+    Workers that don't stop within the shutdown timeout should be killed
+    """
+    sup = Supervisor(processes=1, shutdown_timeout=0.5, target=ignore_sigterm)
+    sup.start()
+    [process] = sup.workers
+    # Give the worker time to start ignoring SIGTERM
+    await asyncio.sleep(1)
+    await sup.stop()
+    assert process.exitcode == -signal.SIGKILL
+
+
+@pytest.mark.asyncio
+async def test_health(metrics_dir):
+    """
+    Should only be healthy if all the workers are running
+    """
+    sup = Supervisor(processes=1, shutdown_timeout=5, target=wait)
+    supervisor.app.ctx.supervisor = sup
+    sup.start()
+    try:
+        response = await supervisor.health(None)
+        assert response.status == 200
+        [process] = sup.workers
+        process.kill()
+        process.join()
+        response = await supervisor.health(None)
+        assert response.status == 500
+    finally:
+        await sup.stop()
+
+
+@pytest.mark.asyncio
+async def test_metrics(metrics_dir):
+    """
+    Should aggregate the metrics from all the workers
+    """
+    sup = Supervisor(processes=2, shutdown_timeout=5, target=increment_counter)
+    sup.start()
+    try:
+        expected = b"supervisor_test_total 2.0"
+        for _ in range(100):
+            response = await supervisor.metrics(None)
+            if expected in response.body:
+                break
+            await asyncio.sleep(0.1)
+        assert expected in response.body
+    finally:
+        await sup.stop()
+
+
+@pytest.mark.asyncio
+async def test_purge_cache(metrics_dir):
+    """
+    Should tell each of the running workers to purge their caches
+    """
+    sup = Supervisor(processes=2, shutdown_timeout=5, target=count_purges)
+    sup.start()
+    try:
+        # Wait for the workers to start handling SIGUSR1
+        await wait_for_metric(b"supervisor_test_total 2.0")
+        assert sup.purge_cache() == 2
+        await wait_for_metric(b"supervisor_test_purges_total 2.0")
+    finally:
+        await sup.stop()
@@ -0,0 +1,72 @@
+import logging
+
+import aiohttp
+import pytest
+from sanic import Sanic, response
+
+from vaccine import clients, tracing
+from vaccine.testing import run_sanic
+
+
+@pytest.fixture
+async def upstream_mock():
+    Sanic.test_mode = True
+    app = Sanic("tracing_mock")
+
+    @app.route("/ok", methods=["GET"])
+    def ok(request):
+        return response.json({})
+
+    @app.route("/error", methods=["GET"])
+    def error(request):
+        return response.json({}, status=503)
+
+    async with run_sanic(app) as server:
+        yield f"http://{server.host}:{server.port}"
+
+
+def latency_count(upstream, method, status):
+    for sample in tracing.UPSTREAM_LATENCY.collect()[0].samples:
+        if sample.name.endswith("_count") and sample.labels == {
+            "upstream": upstream,
+            "method": method,
+            "status": status,
+        }:
+            return sample.value
+    return 0
+
+
+@pytest.mark.asyncio
+async def test_upstream_latency(upstream_mock):
+    """
+    Should record the latency of each request by upstream and status class
+    """
+    async with clients.get_session("trace_test") as session:
+        await session.get(f"{upstream_mock}/ok")
+        await session.get(f"{upstream_mock}/error")
+    assert latency_count("trace_test", "GET", "2xx") == 1
+    assert latency_count("trace_test", "GET", "5xx") == 1
+
+
+@pytest.mark.asyncio
+async def test_upstream_latency_error():
+    """
+    Requests that fail without a response should be recorded as errors
+    """
+    async with clients.get_session("trace_error_test") as session:
+        with pytest.raises(aiohttp.ClientError):
+            await session.get("http://127.0.0.1:1/")
+    assert latency_count("trace_error_test", "GET", "error") == 1
+
+
+@pytest.mark.asyncio
+async def test_request_context_logged(upstream_mock, caplog):
+    """
+    Requests with a trace request context should be logged with the context
+    """
+    caplog.set_level(logging.INFO, logger="vaccine.tracing")
+    async with clients.get_session("trace_log_test") as session:
+        await session.get(f"{upstream_mock}/ok")
+        await session.get(f"{upstream_mock}/ok", trace_request_ctx={"msisdn": "*1001"})
+    [record] = [r for r in caplog.records if r.name == "vaccine.tracing"]
+    assert "trace_log_test request (msisdn:*1001)" in record.getMessage()
@@ -0,0 +1,280 @@
+import asyncio
+import json
+
+import pytest
+import redis.asyncio as aioredis
+
+from vaccine import config
+from vaccine.models import StateData, User
+from vaccine.user_store import (
+    CachedUserStore,
+    HashUserStore,
+    OptimisticUserStore,
+    UserStore,
+)
+
+
+@pytest.fixture
+async def redis():
+    redis = aioredis.from_url(config.REDIS_URL, encoding="utf-8", decode_responses=True)
+    yield redis
+    for key in await redis.keys("user*"):
+        await redis.delete(key)
+    await redis.close()
+
+
+@pytest.mark.asyncio
+async def test_load_new_user(redis: aioredis.Redis):
+    """
+    If there's no stored user, then a new user should be returned
+    """
+    store = UserStore(redis)
+    user = await store.load("27820001001")
+    assert user == User("27820001001")
+
+
+@pytest.mark.asyncio
+async def test_save_and_load(redis: aioredis.Redis):
+    """
+    Saving should store the user, with a TTL, and increment the version
+    """
+    store = UserStore(redis)
+    user = User("27820001001", state=StateData("state_start"))
+    assert await store.save(user) is True
+    assert user.version == 1
+    assert await store.load("27820001001") == user
+    assert await redis.ttl("user.27820001001") > 0
+
+
+@pytest.mark.asyncio
+async def test_optimistic_save(redis: aioredis.Redis):
+    """
+    Should save the user if no one else has changed it since it was loaded
+    """
+    store = OptimisticUserStore(redis)
+    user = await store.load("27820001001")
+    assert await store.save(user) is True
+    user = await store.load("27820001001")
+    assert user.version == 1
+    user.state.name = "state_start"
+    assert await store.save(user) is True
+    assert (await store.load("27820001001")).state.name == "state_start"
+
+
+@pytest.mark.asyncio
+async def test_optimistic_save_conflict(redis: aioredis.Redis):
+    """
+    Should not save the user if someone else has saved it since it was loaded
+    """
+    store = OptimisticUserStore(redis)
+    await store.save(User("27820001001"))
+    user1 = await store.load("27820001001")
+    user2 = await store.load("27820001001")
+
+    user1.state.name = "state_one"
+    assert await store.save(user1) is True
+    user2.state.name = "state_two"
+    assert await store.save(user2) is False
+    assert user2.version == 1
+
+    user = await store.load("27820001001")
+    assert user.state.name == "state_one"
+    assert user.version == 2
+
+
+@pytest.mark.asyncio
+async def test_optimistic_save_legacy_data(redis: aioredis.Redis):
+    """
+    Users stored without a version, or with invalid data, should be overwritten
+    """
+    store = OptimisticUserStore(redis)
+    data = json.loads(User("27820001001", version=3).to_json())
+    await redis.set("user.27820001001", json.dumps(data))
+    user = await store.load("27820001001")
+    assert await store.save(user) is True
+    assert await redis.get("user_version.27820001001") == "4"
+
+    await redis.set("user.27820001001", "invalid")
+    user = await store.load("27820001001")
+    assert await store.save(user) is True
+    assert (await store.load("27820001001")).version == 5
+
+
+@pytest.mark.asyncio
+async def test_optimistic_save_any_format(redis: aioredis.Redis):
+    """
+    Conflicts should be detected from the stored version, whatever format the user
+    data is stored in
+    """
+    store = OptimisticUserStore(redis)
+    await store.save(User("27820001001"))
+    user = await store.load("27820001001")
+    await redis.set("user.27820001001", "not json")
+    await redis.incr("user_version.27820001001")
+    assert await store.save(user) is False
+
+
+@pytest.mark.asyncio
+async def test_optimistic_save_compact_codec(redis: aioredis.Redis):
+    """
+    Versions should be checked for users stored with a codec header
+    """
+    store = OptimisticUserStore(redis, codec="compact")
+    await store.save(User("27820001001"))
+    assert (await redis.get("user.27820001001")).startswith("v1:")
+    user1 = await store.load("27820001001")
+    user2 = await store.load("27820001001")
+    assert await store.save(user1) is True
+    assert await store.save(user2) is False
+
+
+@pytest.mark.asyncio
+async def test_hash_save_and_load(redis: aioredis.Redis):
+    """
+    Should store the user as a hash, with a TTL, and load it again
+    """
+    store = HashUserStore(redis)
+    user = User(
+        "27820001001",
+        lang="eng",
+        answers={"state_name": "Jane", "state.dotted": ["a", 1]},
+        state=StateData("state_start", {"page": 2}),
+        metadata={"emoji": "👍"},
+        session_id=1,
+    )
+    assert await store.save(user) is True
+    assert user.version == 1
+    assert await redis.hget("user_fields.27820001001", "answers.state_name") == '"Jane"'
+    assert await redis.ttl("user_fields.27820001001") > 0
+    assert await store.load("27820001001") == user
+    assert await store.load("27820001002") == User("27820001002")
+
+
+@pytest.mark.asyncio
+async def test_hash_save_changes(redis: aioredis.Redis):
+    """
+    Should only write the fields that changed, and remove ones that were deleted
+    """
+    store = HashUserStore(redis)
+    await store.save(User("27820001001", answers={"a": "1", "b": "2"}))
+    user = await store.load("27820001001")
+    user.answers["a"] = "3"
+    del user.answers["b"]
+    # Changes that weren't made by us shouldn't be overwritten
+    await redis.hset("user_fields.27820001001", "metadata.other", '"x"')
+
+    assert await store.save(user) is True
+    user = await store.load("27820001001")
+    assert user.answers == {"a": "3"}
+    assert user.metadata == {"other": "x"}
+    assert user.version == 2
+
+
+@pytest.mark.asyncio
+async def test_hash_save_unchanged(redis: aioredis.Redis):
+    """
+    If nothing changed, then only the TTL should be refreshed
+    """
+    store = HashUserStore(redis, ttl=100)
+    await store.save(User("27820001001", answers={"a": "1"}))
+    await redis.expire("user_fields.27820001001", 10)
+    user = await store.load("27820001001")
+    assert await store.save(user) is True
+    assert user.version == 1
+    assert await redis.ttl("user_fields.27820001001") > 10
+
+
+@pytest.mark.asyncio
+async def test_hash_migrate(redis: aioredis.Redis):
+    """
+    Users stored as JSON should be loaded, and moved to the hash when saved
+    """
+    store = HashUserStore(redis)
+    await UserStore(redis, codec="compact").save(
+        User("27820001001", answers={"a": "1"})
+    )
+    user = await store.load("27820001001")
+    assert user.answers == {"a": "1"}
+    assert await store.save(user) is True
+    assert await redis.exists("user.27820001001") == 0
+    assert await store.load("27820001001") == user
+
+
+@pytest.mark.asyncio
+async def test_cached_load(redis: aioredis.Redis):
+    """
+    Saved users should be loaded from the cache, and users from redis should be cached
+    """
+    store = CachedUserStore(redis, cache_size=2)
+    await store.save(User("27820001001", state=StateData("state_start")))
+    await redis.set("user.27820001001", "invalid")
+    assert (await store.load("27820001001")).state.name == "state_start"
+
+    await UserStore(redis).save(User("27820001002"))
+    await store.load("27820001002")
+    await redis.set("user.27820001002", "invalid")
+    assert (await store.load("27820001002")).version == 1
+
+    # The least recently used user should be removed from the cache
+    await store.save(User("27820001003"))
+    assert list(store.cache) == ["27820001002", "27820001003"]
+
+
+@pytest.mark.asyncio
+async def test_cached_load_expired(redis: aioredis.Redis):
+    """
+    Users that expired from redis shouldn't be loaded from the cache
+    """
+    store = CachedUserStore(redis, ttl=1)
+    await store.save(User("27820001001", state=StateData("state_start")))
+    await UserStore(redis, ttl=1).save(
+        User("27820001002", state=StateData("state_start"))
+    )
+    await store.load("27820001002")
+    assert list(store.cache) == ["27820001001", "27820001002"]
+
+    await asyncio.sleep(1.1)
+    assert await redis.exists("user.27820001001", "user.27820001002") == 0
+    assert (await store.load("27820001001")).state.name is None
+    assert (await store.load("27820001002")).state.name is None
+    assert list(store.cache) == []
+
+
+@pytest.mark.asyncio
+async def test_cached_changes_not_saved(redis: aioredis.Redis):
+    """
+    Changes to a loaded user shouldn't affect the cache until the user is saved
+    """
+    store = CachedUserStore(redis)
+    await store.save(User("27820001001"))
+    user = await store.load("27820001001")
+    user.state.name = "state_start"
+    assert (await store.load("27820001001")).state.name is None
+
+
+@pytest.mark.asyncio
+async def test_cached_save_conflict(redis: aioredis.Redis):
+    """
+    If someone else changed the user, then saving should fail, and the next load
+    should get their changes from redis
+    """
+    store = CachedUserStore(redis)
+    await store.save(User("27820001001"))
+    user = await store.load("27820001001")
+    await OptimisticUserStore(redis).save(
+        User("27820001001", state=StateData("state_other"), version=1)
+    )
+    assert await store.save(user) is False
+    assert (await store.load("27820001001")).state.name == "state_other"
+
+
+@pytest.mark.asyncio
+async def test_cached_evict(redis: aioredis.Redis):
+    """
+    Should remove the users that match the predicate from the cache
+    """
+    store = CachedUserStore(redis)
+    await store.save(User("27820001001"))
+    await store.save(User("27820001002"))
+    store.evict(lambda addr: addr.endswith("1"))
+    assert list(store.cache) == ["27820001002"]
@@ -6,6 +6,7 @@ from vaccine.utils import (
     Countries,
     SAIDNumber,
     calculate_age,
+    check_token,
     display_phonenumber,
     enforce_character_limit_in_choices,
     get_display_choices,
@@ -96,6 +97,13 @@ class MiscellaneousTests(TestCase):
         assert len(reduced_choices) == 3
         assert len(get_display_choices(reduced_choices)) < 160
 
+    def test_check_token(self):
+        assert check_token("Token secret", "secret")
+        assert not check_token("Token wrong", "secret")
+        assert not check_token(None, "secret")
+        assert not check_token("Token None", None)
+        assert not check_token("Token ", "")
+
 
 class CalculateAgeTests(TestCase):
     @mock.patch("vaccine.utils.get_today")
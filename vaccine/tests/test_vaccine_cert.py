@@ -22,8 +22,8 @@ async def whatsapp_mock(tester):
 
     async with run_sanic(app) as server:
         whatsapp_media_url = tester.application.whatsapp_media_url
-        tester.application.whatsapp_media_url = (
-            lambda media_id: f"http://{server.host}:{server.port}/v1/media/{media_id}"
+        tester.application.whatsapp_media_url = lambda media_id: (
+            f"http://{server.host}:{server.port}/v1/media/{media_id}"
         )
         yield server
         tester.application.whatsapp_media_url = whatsapp_media_url
@@ -3,6 +3,7 @@ import logging
 from asyncio import Future, sleep
 from datetime import datetime, timezone
 from io import StringIO
+from unittest import mock
 
 import pytest
 import redis.asyncio as aioredis
@@ -10,6 +11,8 @@ from aio_pika import DeliveryMode, Exchange, Queue, connect_robust
 from aio_pika import Message as AMQPMessage
 from sanic import Sanic, response
 
+from vaccine import clients
+from vaccine.dispatcher import LaneDispatcher
 from vaccine.models import Answer, Event, Message, StateData, User
 from vaccine.testing import TState, run_sanic
 from vaccine.worker import AnswerWorker, Worker, config, logger
@@ -203,6 +206,164 @@ async def test_setup_answer_worker():
     config.ANSWER_RESOURCE_ID = None
 
 
+@pytest.mark.asyncio
+async def test_worker_http_clients():
+    """
+    The worker should own the shared HTTP client registry for its lifetime
+    """
+    worker = Worker()
+    await worker.setup()
+    assert clients.get_registry() is worker.http_clients
+    await worker.teardown()
+    assert clients.get_registry() is None
+
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append((json.loads(message.body), routing_key))
+
+
+@pytest.mark.asyncio
+async def test_worker_batch_publishes():
+    """
+    Anything published while collecting should only be published with the batch, in
+    the order that it was published in
+    """
+    worker = Worker()
+    worker.exchange = FakeExchange()
+    first = Message(
+        to_addr="27820001001",
+        from_addr="27820001002",
+        transport_name="whatsapp",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+        content="first",
+    )
+    second = Message(
+        to_addr="27820001001",
+        from_addr="27820001002",
+        transport_name="whatsapp",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+        content="second",
+    )
+    with worker.collect_publishes() as batch:
+        await worker.publish_message(first)
+        await worker.publish_message(second)
+    assert worker.exchange.published == []
+    assert len(batch) == 2
+
+    await worker.publish_batch(first, batch)
+    assert [(m["content"], k) for m, k in worker.exchange.published] == [
+        ("first", "whatsapp.outbound"),
+        ("second", "whatsapp.outbound"),
+    ]
+
+    # Outside of collecting, should publish immediately
+    await worker.publish_message(first)
+    assert len(worker.exchange.published) == 3
+
+
+@pytest.mark.asyncio
+async def test_worker_delayed_publishes():
+    """
+    Messages after a delay should be delivered in the background, in order, and
+    further messages for the user should be delivered in the background after them
+    """
+    worker = Worker()
+    worker.exchange = FakeExchange()
+    msg = Message(
+        to_addr="27820001001",
+        from_addr="27820001002",
+        transport_name="whatsapp",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+    )
+    with worker.collect_publishes() as batch:
+        await worker.publish_message(msg.reply("first"))
+        await worker.delay(0.01)
+        await worker.publish_message(msg.reply("second"))
+    await worker.publish_batch(msg, batch)
+    assert [m["content"] for m, _ in worker.exchange.published] == ["first"]
+    assert msg.from_addr in worker.deliveries
+
+    with worker.collect_publishes() as batch:
+        await worker.publish_message(msg.reply("third"))
+    await worker.publish_batch(msg, batch)
+    # We don't wait for the previous delivery before carrying on
+    assert [m["content"] for m, _ in worker.exchange.published] == ["first"]
+
+    await worker.deliveries[msg.from_addr]
+    assert [m["content"] for m, _ in worker.exchange.published] == [
+        "first",
+        "second",
+        "third",
+    ]
+    assert worker.deliveries == {}
+
+
+@pytest.mark.asyncio
+async def test_worker_delayed_publishes_at_most_once():
+    """
+    Delayed messages are delivered after the inbound message is acked, so if they
+    can't be published, they should be logged and dropped rather than retried
+    """
+    worker = Worker()
+    worker.exchange = FakeExchange()
+    msg = Message(
+        to_addr="27820001001",
+        from_addr="27820001002",
+        transport_name="whatsapp",
+        transport_type=Message.TRANSPORT_TYPE.HTTP_API,
+    )
+    with worker.collect_publishes() as batch:
+        await worker.publish_message(msg.reply("first"))
+        await worker.delay(0.01)
+        await worker.publish_message(msg.reply("second"))
+    await worker.publish_batch(msg, batch)
+    delivery = worker.deliveries[msg.from_addr]
+
+    published = worker.exchange.published
+    worker.exchange = mock.AsyncMock()
+    worker.exchange.publish.side_effect = ConnectionError()
+    with mock.patch.object(logger, "exception") as log_exception:
+        await delivery
+    log_exception.assert_called_once()
+    assert [m["content"] for m, _ in published] == ["first"]
+    assert worker.exchange.publish.call_count == 1
+    assert worker.deliveries == {}
+
+
+@pytest.mark.asyncio
+async def test_worker_teardown_order():
+    """
+    Should stop consuming, then finish processing the messages in the lanes, and only
+    then close the connection
+    """
+    calls = []
+
+    async def handler(item):
+        await sleep(0.01)
+        calls.append(f"processed {item}")
+
+    worker = Worker()
+    worker.dispatcher = LaneDispatcher(2, handler)
+    worker.dispatcher.start()
+    worker.dispatcher.dispatch("27820001001", "message")
+    queue = mock.Mock(cancel=mock.AsyncMock(side_effect=lambda tag: calls.append(tag)))
+    worker.consumers = [(queue, "consumer")]
+    worker.connection = mock.Mock(
+        close=mock.AsyncMock(side_effect=lambda: calls.append("close"))
+    )
+    worker.redis = mock.AsyncMock()
+    worker.answer_worker = None
+    worker.http_clients = clients.ClientRegistry()
+
+    await worker.teardown()
+    assert calls == ["consumer", "processed message", "close"]
+    assert worker.dispatcher.tasks == []
+
+
 @pytest.mark.asyncio
 async def test_worker_valid_event(worker: Worker):
     """
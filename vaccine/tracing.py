@@ -0,0 +1,74 @@
+"""
+Metrics for requests to upstream APIs, recorded through an aiohttp TraceConfig that's
+added to every client session.
+
+Labels are limited to the upstream name, request method, and status class, so that the
+number of metrics stays bounded, no matter which URLs are requested.
+"""
+
+import logging
+import time
+from datetime import datetime
+from functools import partial
+from types import SimpleNamespace
+
+import aiohttp
+from prometheus_client import Histogram
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_latency_seconds",
+    "Time taken by requests to upstream APIs",
+    ("upstream", "method", "status"),
+)
+
+logger = logging.getLogger(__name__)
+
+_trace_configs: dict[str, aiohttp.TraceConfig] = {}
+
+
+def status_class(status: int) -> str:
+    return f"{status // 100}xx"
+
+
+def observe(context: SimpleNamespace, method: str, status: str) -> float:
+    elapsed = time.monotonic() - context.request_start
+    UPSTREAM_LATENCY.labels(context.upstream, method, status).observe(elapsed)
+    return elapsed
+
+
+async def on_request_start(session, context, params):
+    context.request_start = time.monotonic()
+
+
+async def on_request_end(session, context, params):
+    elapsed = observe(context, params.method, status_class(params.response.status))
+    # Requests made with a trace_request_ctx are logged, with the context's values
+    if context.trace_request_ctx:
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        details = ", ".join(f"{k}:{v}" for k, v in context.trace_request_ctx.items())
+        logger.info(
+            f"[{now}] {context.upstream} request ({details}) - "
+            f"{round(elapsed * 1000)}ms <{params.url}>"
+        )
+
+
+async def on_request_exception(session, context, params):
+    observe(context, params.method, "error")
+
+
+def get_trace_config(upstream: str) -> aiohttp.TraceConfig:
+    """
+    Returns the trace config for requests to the upstream. It's shared by all of the
+    upstream's sessions.
+    """
+    trace_config = _trace_configs.get(upstream)
+    if trace_config is None:
+        trace_config = aiohttp.TraceConfig(
+            trace_config_ctx_factory=partial(SimpleNamespace, upstream=upstream)
+        )
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.freeze()
+        _trace_configs[upstream] = trace_config
+    return trace_config
@@ -0,0 +1,333 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import redis.asyncio as aioredis
+from prometheus_client import Counter, Histogram
+
+from vaccine import config
+from vaccine.codecs import decode_user, encode_user, get_codec
+from vaccine.models import USER_DECODE_EXCEPTIONS, StateData, User
+
+USER_SAVE_CONFLICTS = Counter(
+    "worker_user_save_conflicts",
+    "Whenever a user was changed by someone else between loading and saving",
+)
+
+USER_CACHE = Counter(
+    "worker_user_cache",
+    "Whenever a user is loaded, and whether it was in the worker's cache",
+    ("result",),
+)
+USER_SIZE = Histogram(
+    "worker_user_size",
+    "The size of each user's stored data when it's saved, in bytes",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+
+logger = logging.getLogger(__name__)
+
+# Only saves the user if the stored version is still the version that we loaded. The
+# version is kept in its own key, so that the user data can be in any format. Users
+# without a stored version, eg. ones saved by older releases, are overwritten.
+SAVE_IF_VERSION_SCRIPT = """
+local current = redis.call("GET", KEYS[2])
+if current and tonumber(current) ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call("SETEX", KEYS[1], ARGV[3], ARGV[2])
+redis.call("SETEX", KEYS[2], ARGV[3], ARGV[4])
+return 1
+"""
+
+
+class UserSaveConflict(Exception):
+    """
+    The user kept on being changed by someone else while we were processing a message
+    """
+
+
+class UserStore:
+    """
+    Stores each user as a JSON blob under `user.{addr}`, and its version under
+    `user_version.{addr}`. Concurrent access needs to be prevented by locking the user.
+    """
+
+    optimistic = False
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        ttl: int = config.TTL,
+        codec: str = config.USER_CODEC,
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.codec = get_codec(codec)
+
+    def key(self, addr: str) -> str:
+        return f"user.{addr}"
+
+    def version_key(self, addr: str) -> str:
+        return f"user_version.{addr}"
+
+    async def load(self, addr: str) -> User:
+        user_data = await self.redis.get(self.key(addr))
+        return decode_user(addr, user_data)
+
+    async def save(self, user: User) -> bool:
+        """
+        Saves the user. Returns False if the user couldn't be saved because of a
+        conflicting change.
+        """
+        # Keep the version up to date, so that optimistic stores can detect our changes
+        user.version += 1
+        data = encode_user(user, self.codec)
+        USER_SIZE.observe(len(data.encode("utf-8")))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.setex(self.key(user.addr), self.ttl, data)
+            pipe.setex(self.version_key(user.addr), self.ttl, user.version)
+            await pipe.execute()
+        return True
+
+
+class OptimisticUserStore(UserStore):
+    """
+    Uses the version counter on the user to only save if no one else has saved the
+    user since we loaded it, so that no lock is needed. Loading and saving are a single
+    round trip each.
+    """
+
+    optimistic = True
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        ttl: int = config.TTL,
+        codec: str = config.USER_CODEC,
+    ):
+        super().__init__(redis, ttl, codec)
+        self.save_if_version = redis.register_script(SAVE_IF_VERSION_SCRIPT)
+
+    async def load(self, addr: str) -> User:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self.key(addr))
+            pipe.get(self.version_key(addr))
+            data, version = await pipe.execute()
+        return self.decode(addr, data, version)
+
+    def decode(self, addr: str, data: Optional[str], version: Optional[str]) -> User:
+        user = decode_user(addr, data)
+        if version is not None:
+            # Saving compares against the stored version, so use it even if the data
+            # was invalid and replaced with a new user
+            user.version = int(version)
+        return user
+
+    async def save(self, user: User) -> bool:
+        loaded_version = user.version
+        user.version += 1
+        data = encode_user(user, self.codec)
+        USER_SIZE.observe(len(data.encode("utf-8")))
+        if await self.save_data(user.addr, loaded_version, data):
+            return True
+        user.version = loaded_version
+        USER_SAVE_CONFLICTS.inc()
+        return False
+
+    async def save_data(self, addr: str, loaded_version: int, data: str) -> bool:
+        saved = await self.save_if_version(
+            keys=[self.key(addr), self.version_key(addr)],
+            args=[loaded_version, data, self.ttl, loaded_version + 1],
+        )
+        return bool(saved)
+
+
+class CachedUserStore(OptimisticUserStore):
+    """
+    Keeps the most recently used users in memory, and writes through to redis. Used
+    with sticky routing, where each user's messages go to the same worker, so most
+    users are already in memory when their next message arrives.
+
+    Cached users are only used until their key expires in redis, so that sessions that
+    expired aren't brought back.
+
+    If another worker changes the user anyway, eg. while workers are rebalancing, then
+    saving fails the same way it does for OptimisticUserStore, the cached user is
+    removed, and the message is processed again with the user from redis.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        ttl: int = config.TTL,
+        codec: str = config.USER_CODEC,
+        cache_size: int = config.USER_CACHE_SIZE,
+    ):
+        super().__init__(redis, ttl, codec)
+        self.cache_size = cache_size
+        # The users are cached encoded, so that changes made while processing a message
+        # that fails don't change the cached user, along with their stored version and
+        # the time.monotonic() time that they expire from redis, so that expired users
+        # aren't brought back
+        self.cache: OrderedDict[str, tuple[str, Optional[str], float]] = OrderedDict()
+
+    async def load(self, addr: str) -> User:
+        cached = self.cache.get(addr)
+        if cached is not None:
+            data, version, expires_at = cached
+            if expires_at > time.monotonic():
+                USER_CACHE.labels("hit").inc()
+                self.cache.move_to_end(addr)
+                return self.decode(addr, data, version)
+            del self.cache[addr]
+        USER_CACHE.labels("miss").inc()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self.key(addr))
+            pipe.get(self.version_key(addr))
+            pipe.pttl(self.key(addr))
+            data, version, pttl = await pipe.execute()
+        if data is not None:
+            ttl = pttl / 1000 if pttl > 0 else self.ttl
+            self.add_to_cache(addr, data, version, time.monotonic() + ttl)
+        return self.decode(addr, data, version)
+
+    async def save_data(self, addr: str, loaded_version: int, data: str) -> bool:
+        # Measured before saving, so that the cached user expires before the saved one
+        expires_at = time.monotonic() + self.ttl
+        saved = await super().save_data(addr, loaded_version, data)
+        if saved:
+            self.add_to_cache(addr, data, str(loaded_version + 1), expires_at)
+        else:
+            self.cache.pop(addr, None)
+        return saved
+
+    def add_to_cache(
+        self, addr: str, data: str, version: Optional[str], expires_at: float
+    ):
+        self.cache[addr] = (data, version, expires_at)
+        self.cache.move_to_end(addr)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def evict(self, predicate: Callable[[str], bool]):
+        """
+        Removes the cached users whose address matches the predicate, eg. when they're
+        no longer routed to this worker
+        """
+        for addr in [addr for addr in self.cache if predicate(addr)]:
+            del self.cache[addr]
+
+
+class HashUserStore(UserStore):
+    """
+    Stores each user as a redis hash under `user_fields.{addr}`, with a field for each
+    answer and metadata entry, so that saving only writes the fields that changed. If
+    nothing changed, the TTL is refreshed without writing any data, and the version
+    isn't incremented.
+
+    Users that are still stored as JSON under `user.{addr}` are loaded from there, and
+    moved to the hash the first time that they're saved.
+    """
+
+    def hash_key(self, addr: str) -> str:
+        return f"user_fields.{addr}"
+
+    def encode_fields(self, user: User) -> dict[str, str]:
+        """
+        Returns the hash fields for the user, and records their total size
+        """
+        fields = {
+            "lang": json.dumps(user.lang),
+            "session_id": json.dumps(user.session_id),
+            "version": json.dumps(user.version),
+            "state.name": json.dumps(user.state.name),
+            "state.metadata": dumps_compact(user.state.metadata),
+        }
+        for prefix in ("answers", "metadata"):
+            for key, value in getattr(user, prefix).items():
+                fields[f"{prefix}.{key}"] = dumps_compact(value)
+        USER_SIZE.observe(
+            sum(len(k) + len(v.encode("utf-8")) for k, v in fields.items())
+        )
+        return fields
+
+    def decode_fields(self, addr: str, fields: dict[str, str]) -> User:
+        user = User(
+            addr=addr,
+            lang=json.loads(fields["lang"]),
+            session_id=json.loads(fields["session_id"]),
+            version=json.loads(fields["version"]),
+            state=StateData(
+                name=json.loads(fields["state.name"]),
+                metadata=json.loads(fields["state.metadata"]),
+            ),
+        )
+        for field, value in fields.items():
+            prefix, _, key = field.partition(".")
+            if prefix in ("answers", "metadata"):
+                getattr(user, prefix)[key] = json.loads(value)
+        return user
+
+    async def load(self, addr: str) -> User:
+        fields = await self.redis.hgetall(self.hash_key(addr))
+        if not fields:
+            return await super().load(addr)
+        try:
+            user = self.decode_fields(addr, fields)
+        except USER_DECODE_EXCEPTIONS:
+            return User(addr)
+        # Kept on the user rather than on the store, so that nothing is left behind
+        # for users that are loaded but never saved
+        user._stored_fields = fields  # type: ignore[attr-defined]
+        return user
+
+    async def save(self, user: User) -> bool:
+        key = self.hash_key(user.addr)
+        stored = getattr(user, "_stored_fields", None)
+        if stored is None:
+            # Either a new user, or one that isn't stored in the hash yet, so replace
+            # anything that is stored
+            user.version += 1
+            fields = self.encode_fields(user)
+            async with self.redis.pipeline() as pipe:
+                pipe.delete(self.key(user.addr), self.version_key(user.addr), key)
+                pipe.hset(key, mapping=fields)
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+            user._stored_fields = fields  # type: ignore[attr-defined]
+            return True
+
+        fields = self.encode_fields(user)
+        changed = {k: v for k, v in fields.items() if stored.get(k) != v}
+        removed = [k for k in stored if k not in fields]
+        if not changed and not removed:
+            await self.redis.expire(key, self.ttl)
+            return True
+
+        user.version += 1
+        changed["version"] = fields["version"] = json.dumps(user.version)
+        async with self.redis.pipeline() as pipe:
+            pipe.hset(key, mapping=changed)
+            if removed:
+                pipe.hdel(key, *removed)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        user._stored_fields = fields  # type: ignore[attr-defined]
+        return True
+
+
+def dumps_compact(value) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def get_user_store(redis: aioredis.Redis) -> UserStore:
+    if config.STICKY_ROUTING:
+        return CachedUserStore(redis)
+    if config.USER_STORE == "optimistic":
+        return OptimisticUserStore(redis)
+    if config.USER_STORE == "hash":
+        return HashUserStore(redis)
+    return UserStore(redis)
@@ -1,7 +1,9 @@
 import asyncio
+import hmac
 import json
 import re
 import time
+import warnings
 from collections.abc import Awaitable
 from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta, timezone
@@ -13,7 +15,6 @@ from uuid import uuid4
 
 import aiohttp
 import phonenumbers
-import pycountry
 from rapidfuzz import process
 
 DECODE_MESSAGE_EXCEPTIONS = (
@@ -36,6 +37,16 @@ def random_id():
     return uuid4().hex
 
 
+def check_token(authorization: Optional[str], token: Optional[str]) -> bool:
+    """
+    Whether the Authorization header is `Token <token>`. If there's no token, then
+    nothing is authorized.
+    """
+    if not token or authorization is None:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Token {token}".encode())
+
+
 def current_timestamp():
     return datetime.now(timezone.utc)
 
@@ -140,9 +151,21 @@ def display_phonenumber(phonenumber):
         return phonenumber
 
 
+def import_pycountry():
+    """
+    pycountry is slow to import, so it's only imported when it's first needed
+    """
+    with warnings.catch_warnings():
+        # pycountry uses the deprecated pkg_resources
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import pycountry
+    return pycountry
+
+
 class Countries:
     @cached_property
     def countries(self):
+        pycountry = import_pycountry()
         return {
             country.alpha_2: getattr(country, "official_name", "") or country.name
             for country in pycountry.countries
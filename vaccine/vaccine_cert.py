@@ -5,11 +5,9 @@ import re
 from urllib.parse import ParseResult, urlunparse
 
 import aiohttp
-import cv2
-import numpy
-import zbar
 
 import vaccine.vaccine_cert_config as config
+from vaccine import clients
 from vaccine.base_application import BaseApplication
 from vaccine.models import Message
 from vaccine.states import EndState, ErrorMessage, FreeText
@@ -31,6 +29,15 @@ class Application(BaseApplication):
             )
         )
 
+    @classmethod
+    def warm_up(cls):
+        super().warm_up()
+        # The image libraries are slow to import, so they're only imported when
+        # they're first needed
+        import cv2  # noqa: F401
+        import numpy  # noqa: F401
+        import zbar  # noqa: F401
+
     async def process_message(self, message: Message) -> list[Message]:
         if message.session_event == Message.SESSION_EVENT.CLOSE:
             self.state_name = "state_timeout"
@@ -57,18 +64,24 @@ class Application(BaseApplication):
 
     async def state_start(self):
         async def get_whatsapp_media(media_id):
-            client = aiohttp.ClientSession(
+            async with clients.get_session(
+                "whatsapp",
                 timeout=aiohttp.ClientTimeout(total=5),
                 headers={
                     "User-Agent": "vaccine-cert",
                     "Authorization": f"Bearer {config.API_TOKEN}",
                 },
-            )
-            response = await client.get(self.whatsapp_media_url(media_id))
-            response.raise_for_status()
-            return numpy.frombuffer(await response.read(), numpy.uint8)
+            ) as client:
+                response = await client.get(self.whatsapp_media_url(media_id))
+                response.raise_for_status()
+                import numpy
+
+                return numpy.frombuffer(await response.read(), numpy.uint8)
 
         def decode_qrcode_image(image):
+            import cv2
+            import zbar
+
             image = cv2.imdecode(image, cv2.IMREAD_GRAYSCALE)
             _, bw_image = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
             return zbar.Scanner().scan(bw_image)
@@ -8,6 +8,7 @@ from urllib.parse import urljoin
 import aiohttp
 import sentry_sdk
 
+from vaccine import clients, outbox, resilience
 from vaccine import vacreg_config as config
 from vaccine.base_application import BaseApplication
 from vaccine.data.suburbs import suburbs
@@ -18,6 +19,7 @@ from vaccine.states import (
     ErrorMessage,
     FreeText,
     MenuState,
+    static_state,
 )
 from vaccine.utils import (
     HTTP_EXCEPTIONS,
@@ -36,12 +38,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_evds():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "evds",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Content-Type": "application/json",
@@ -53,12 +51,8 @@ def get_evds():
 
 
 def get_eventstore():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "eventstore",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Token {config.VACREG_EVENTSTORE_TOKEN}",
@@ -68,6 +62,9 @@ def get_eventstore():
     )
 
 
+outbox.register_target("vaccine_reg_ussd.eventstore", get_eventstore)
+
+
 class Application(BaseApplication):
     START_STATE = "state_age_gate"
 
@@ -82,6 +79,11 @@ class Application(BaseApplication):
 
         self.ID_TYPES = ID_TYPES
 
+    @classmethod
+    def warm_up(cls):
+        super().warm_up()
+        countries.countries  # noqa: B018 - Loads the country list
+
     async def state_age_gate(self):
         self.user.answers = {}
 
@@ -126,9 +128,11 @@ class Application(BaseApplication):
             next="state_confirm_notification",
         )
 
+    @static_state
     async def state_confirm_notification(self):
         return EndState(self, text="Thank you for confirming")
 
+    @static_state
     async def state_terms_and_conditions(self):
         return MenuState(
             self,
@@ -142,6 +146,7 @@ class Application(BaseApplication):
             error=self._("TYPE 1 to continue"),
         )
 
+    @static_state
     async def state_terms_and_conditions_2(self):
         return MenuState(
             self,
@@ -154,6 +159,7 @@ class Application(BaseApplication):
             error=self._("TYPE 1 to continue"),
         )
 
+    @static_state
     async def state_terms_and_conditions_3(self):
         return MenuState(
             self,
@@ -248,6 +254,7 @@ class Application(BaseApplication):
         del self.user.answers["state_identification_number"]
         return await self.go_to_state("state_identification_type")
 
+    @static_state
     async def state_passport_country(self):
         async def next_state(choice: Choice):
             if choice.value == "other":
@@ -270,6 +277,7 @@ class Application(BaseApplication):
             next=next_state,
         )
 
+    @static_state
     async def state_passport_country_search(self):
         return FreeText(
             self,
@@ -453,6 +461,7 @@ class Application(BaseApplication):
             next="state_surname",
         )
 
+    @static_state
     async def state_surname(self):
         return FreeText(
             self,
@@ -499,6 +508,7 @@ class Application(BaseApplication):
             next="state_suburb_search",
         )
 
+    @static_state
     async def state_suburb_search(self):
         return FreeText(
             self,
@@ -627,6 +637,7 @@ class Application(BaseApplication):
             ).format(number=number),
         )
 
+    @static_state
     async def state_vaccination_time(self):
         return ChoiceState(
             self,
@@ -645,6 +656,7 @@ class Application(BaseApplication):
             next="state_medical_aid",
         )
 
+    @static_state
     async def state_medical_aid(self):
         return ChoiceState(
             self,
@@ -703,34 +715,31 @@ class Application(BaseApplication):
                 ]
 
         async with evds as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        url=urljoin(
-                            config.EVDS_URL,
-                            f"/api/private/{config.EVDS_DATASET}/person/"
-                            f"{config.EVDS_VERSION}/record",
-                        ),
-                        json=data,
-                    )
-                    response_data = await response.json()
-                    self.evds_response = response_data
-                    sentry_sdk.set_context(
-                        "evds", {"request_data": data, "response_data": response_data}
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_err")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("evds"):
+                    with attempt:
+                        response = await session.post(
+                            url=urljoin(
+                                config.EVDS_URL,
+                                f"/api/private/{config.EVDS_DATASET}/person/"
+                                f"{config.EVDS_VERSION}/record",
+                            ),
+                            json=data,
+                        )
+                        response_data = await response.json()
+                        self.evds_response = response_data
+                        sentry_sdk.set_context(
+                            "evds",
+                            {"request_data": data, "response_data": response_data},
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_err")
 
         return await self.go_to_state("state_submit_to_eventstore")
 
     async def state_submit_to_eventstore(self):
-        eventstore = get_eventstore()
         date_of_birth = date(
             int(self.user.answers["state_dob_year"]),
             int(self.user.answers["state_dob_month"]),
@@ -775,25 +784,16 @@ class Application(BaseApplication):
                     "state_passport_country_list"
                 ]
 
-        async with eventstore as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        url=urljoin(
-                            config.VACREG_EVENTSTORE_URL, "/v2/vaccineregistration/"
-                        ),
-                        json=data,
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                    else:
-                        continue
+        # We show success even if this fails, so it doesn't need to be done now
+        await self.submit(
+            "vaccine_reg_ussd.eventstore",
+            urljoin(config.VACREG_EVENTSTORE_URL, "/v2/vaccineregistration/"),
+            data,
+        )
 
         return await self.go_to_state("state_success")
 
+    @static_state
     async def state_success(self):
         return EndState(
             self,
@@ -803,6 +803,7 @@ class Application(BaseApplication):
             ),
         )
 
+    @static_state
     async def state_err(self):
         return EndState(
             self,
@@ -9,6 +9,7 @@ from urllib.parse import urljoin
 import aiohttp
 import sentry_sdk
 
+from vaccine import clients, outbox, resilience
 from vaccine import vacreg_config as config
 from vaccine.base_application import BaseApplication
 from vaccine.data.medscheme import medical_aids
@@ -42,12 +43,8 @@ EXIT_KEYWORDS = {"menu", "0", "support"}
 
 
 def get_evds():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "evds",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Content-Type": "application/json",
@@ -59,12 +56,8 @@ def get_evds():
 
 
 def get_eventstore():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "eventstore",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Token {config.VACREG_EVENTSTORE_TOKEN}",
@@ -74,6 +67,9 @@ def get_eventstore():
     )
 
 
+outbox.register_target("vaccine_reg_whatsapp.eventstore", get_eventstore)
+
+
 class Application(BaseApplication):
     START_STATE = "state_language"
 
@@ -88,6 +84,11 @@ class Application(BaseApplication):
 
         self.ID_TYPES = ID_TYPES
 
+    @classmethod
+    def warm_up(cls):
+        super().warm_up()
+        countries.countries  # noqa: B018 - Loads the country list
+
     async def process_message(self, message: Message) -> list[Message]:
         if message.session_event == Message.SESSION_EVENT.CLOSE:
             self.state_name = "state_timeout"
@@ -1093,34 +1094,31 @@ class Application(BaseApplication):
             ]
 
         async with evds as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        url=urljoin(
-                            config.EVDS_URL,
-                            f"/api/private/{config.EVDS_DATASET}/person/"
-                            f"{config.EVDS_VERSION}/record",
-                        ),
-                        json=data,
-                    )
-                    response_data = await response.json()
-                    self.evds_response = response_data
-                    sentry_sdk.set_context(
-                        "evds", {"request_data": data, "response_data": response_data}
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_err")
-                    else:
-                        continue
+            try:
+                async for attempt in resilience.retrying("evds"):
+                    with attempt:
+                        response = await session.post(
+                            url=urljoin(
+                                config.EVDS_URL,
+                                f"/api/private/{config.EVDS_DATASET}/person/"
+                                f"{config.EVDS_VERSION}/record",
+                            ),
+                            json=data,
+                        )
+                        response_data = await response.json()
+                        self.evds_response = response_data
+                        sentry_sdk.set_context(
+                            "evds",
+                            {"request_data": data, "response_data": response_data},
+                        )
+                        response.raise_for_status()
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_err")
 
         return await self.go_to_state("state_submit_to_eventstore")
 
     async def state_submit_to_eventstore(self):
-        eventstore = get_eventstore()
         date_of_birth = date(
             int(self.user.answers["state_dob_year"]),
             int(self.user.answers["state_dob_month"]),
@@ -1160,22 +1158,12 @@ class Application(BaseApplication):
             data["passport_number"] = id_number
             data["passport_country"] = self.user.answers["state_passport_country_list"]
 
-        async with eventstore as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        url=urljoin(
-                            config.VACREG_EVENTSTORE_URL, "/v2/vaccineregistration/"
-                        ),
-                        json=data,
-                    )
-                    response.raise_for_status()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                    else:
-                        continue
+        # We show success even if this fails, so it doesn't need to be done now
+        await self.submit(
+            "vaccine_reg_whatsapp.eventstore",
+            urljoin(config.VACREG_EVENTSTORE_URL, "/v2/vaccineregistration/"),
+            data,
+        )
 
         return await self.go_to_state("state_success")
 
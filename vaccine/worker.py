@@ -1,35 +1,122 @@
 import asyncio
 import importlib
 import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
 from json import JSONDecodeError
-from typing import Callable
+from typing import Callable, Optional
 from urllib.parse import urljoin
 
 import aiohttp
 import redis.asyncio as aioredis
 import sentry_sdk
-from aio_pika import Connection, ExchangeType, IncomingMessage, connect_robust
+from aio_pika import Connection, ExchangeType, IncomingMessage, Queue, connect_robust
 from aio_pika import Message as AMQPMessage
 from aio_pika.message import DeliveryMode
+from prometheus_client import Histogram
 from redis.exceptions import LockNotOwnedError
 
-from vaccine import config
+from vaccine import clients, config, deadline
+from vaccine.blob_store import BlobStore
+from vaccine.dispatcher import LaneDispatcher
 from vaccine.models import Answer, Event, Message, User
-from vaccine.utils import DECODE_MESSAGE_EXCEPTIONS, HTTP_EXCEPTIONS, log_timing
+from vaccine.outbox import (
+    OutboxWorker,
+    Submission,
+    deliver_with_retries,
+    wait_for_result,
+)
+from vaccine.routing import HashRing, StickyRouter
+from vaccine.user_store import CachedUserStore, UserSaveConflict, get_user_store
+from vaccine.utils import (
+    DECODE_MESSAGE_EXCEPTIONS,
+    HTTP_EXCEPTIONS,
+    log_timing,
+    random_id,
+)
+
+USER_LOCK_WAIT = Histogram(
+    "worker_user_lock_wait_seconds", "Time spent waiting to acquire a user's lock"
+)
+USER_STORE_LATENCY = Histogram(
+    "worker_user_store_latency_seconds",
+    "Time taken to load or save a user in redis",
+    ("operation",),
+)
+AMQP_PUBLISH_LATENCY = Histogram(
+    "worker_amqp_publish_latency_seconds",
+    "Time taken to publish a message, including waiting for its publisher confirm",
+    ("routing_key",),
+)
+
+
+class PublishBatch:
+    """
+    The messages to publish for an inbound message, along with how long to wait before
+    publishing each one
+    """
+
+    def __init__(self):
+        self.messages: list[tuple[AMQPMessage, str, float]] = []
+        self.pending_delay = 0.0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, amqp_msg: AMQPMessage, routing_key: str):
+        self.messages.append((amqp_msg, routing_key, self.pending_delay))
+        self.pending_delay = 0.0
+
+    def delay(self, seconds: float):
+        self.pending_delay += seconds
+
+    def split(self):
+        """
+        Splits the messages into the ones that can be published immediately, and the
+        ones that need to be delayed
+        """
+        for i, (_, _, delay) in enumerate(self.messages):
+            if delay > 0:
+                return self.messages[:i], self.messages[i:]
+        return self.messages, []
+
+
+# The batch of messages to publish for the inbound message currently being processed
+PUBLISH_BATCH: ContextVar[Optional[PublishBatch]] = ContextVar(
+    "publish_batch", default=None
+)
 
 logging.basicConfig(level=config.LOG_LEVEL.upper())
 logger = logging.getLogger(__name__)
 
 
+def make_amqp_message(body: str) -> AMQPMessage:
+    return AMQPMessage(
+        body.encode("utf-8"),
+        delivery_mode=DeliveryMode.PERSISTENT,
+        content_type="application/json",
+        content_encoding="UTF-8",
+    )
+
+
 class Worker:
+    outbox: Optional[OutboxWorker] = None
+    blob_store: Optional[BlobStore] = None
+    router: Optional[StickyRouter] = None
+
     def __init__(self):
         modname, clsname = config.APPLICATION_CLASS.rsplit(".", maxsplit=1)
         module = importlib.import_module(modname)
         self.ApplicationClass = getattr(module, clsname)
+        self.deliveries: dict[str, asyncio.Task] = {}
+        self.consumers: list[tuple[Queue, str]] = []
+        self.message_budgets = clients.parse_limits(config.MESSAGE_BUDGETS)
 
     async def setup(self):
         self.connection = await connect_robust(config.AMQP_URL)
-        self.channel = await self.connection.channel()
+        self.channel = await self.connection.channel(publisher_confirms=True)
         await self.channel.set_qos(prefetch_count=config.CONCURRENCY)
         self.exchange = await self.channel.declare_exchange(
             "vumi", type=ExchangeType.DIRECT, durable=True, auto_delete=False
@@ -38,10 +125,55 @@ class Worker:
         self.redis = aioredis.from_url(
             config.REDIS_URL, encoding="utf-8", decode_responses=True
         )
+        self.user_store = get_user_store(self.redis)
+        if config.BLOB_STORE:
+            self.blob_store = BlobStore(self.redis)
 
-        self.inbound_queue = await self.setup_consume(
-            f"{config.TRANSPORT_NAME}.inbound", self.process_message
+        self.http_clients = clients.ClientRegistry(
+            limits=clients.parse_limits(config.HTTP_POOL_LIMITS)
         )
+        clients.set_registry(self.http_clients)
+
+        if config.WORKER_LANES > 0:
+            self.dispatcher = LaneDispatcher(
+                config.WORKER_LANES, lambda item: self.handle_message(*item)
+            )
+            self.dispatcher.start()
+        else:
+            self.dispatcher = None
+
+        await self.ApplicationClass.worker_setup(self)
+        if config.WARM_UP:
+            async with log_timing("Warmed up", logger):
+                self.ApplicationClass.warm_up()
+
+        if config.STICKY_ROUTING:
+            # Forwarded messages that can't be routed to the owner's queue must raise,
+            # so that they're requeued, instead of being confirmed and lost
+            router_channel = await self.connection.channel(
+                publisher_confirms=True, on_return_raises=True
+            )
+            self.router = StickyRouter(
+                worker_id=random_id(),
+                redis=self.redis,
+                channel=router_channel,
+                exchange=await router_channel.declare_exchange(
+                    "vumi", type=ExchangeType.DIRECT, durable=True, auto_delete=False
+                ),
+                handler=self.dispatch_message,
+                on_rebalance=self.rebalance,
+            )
+            await self.router.start()
+            await self.setup_consume(
+                self.router.queue_name(self.router.worker_id), self.process_message
+            )
+            self.inbound_queue = await self.setup_consume(
+                f"{config.TRANSPORT_NAME}.inbound", self.router.route
+            )
+        else:
+            self.inbound_queue = await self.setup_consume(
+                f"{config.TRANSPORT_NAME}.inbound", self.process_message
+            )
         self.event_queue = await self.setup_consume(
             f"{config.TRANSPORT_NAME}.event", self.process_event
         )
@@ -61,19 +193,38 @@ class Worker:
         else:
             self.answer_worker = None
 
+        if config.OUTBOX_CONSUMERS > 0:
+            self.outbox = OutboxWorker(self.connection, self.redis)
+            await self.outbox.setup()
+
     async def setup_consume(self, routing_key: str, callback: Callable):
         queue = await self.channel.declare_queue(
             routing_key, durable=True, auto_delete=False
         )
         await queue.bind(self.exchange, routing_key)
-        await queue.consume(callback)
+        self.consumers.append((queue, await queue.consume(callback)))
         return queue
 
     async def teardown(self):
-        await self.connection.close()
-        await self.redis.close()
+        # Stop consuming first, then finish processing the messages that we already
+        # have, and only close the connection once they've all been acked
+        for queue, consumer_tag in self.consumers:
+            await queue.cancel(consumer_tag)
+        if self.router:
+            await self.router.stop()
+        if self.dispatcher:
+            await self.dispatcher.join()
+            await self.dispatcher.stop()
+        await asyncio.gather(*self.deliveries.values(), return_exceptions=True)
+        if self.outbox:
+            await self.outbox.teardown()
         if self.answer_worker:
             await self.answer_worker.teardown()
+        await self.connection.close()
+        await self.redis.close()
+        await self.ApplicationClass.worker_teardown(self)
+        clients.set_registry(None)
+        await self.http_clients.close()
 
     async def process_message(self, amqp_msg: IncomingMessage):
         try:
@@ -82,58 +233,285 @@ class Worker:
             logger.exception(f"Invalid message body {amqp_msg.body!r}")
             amqp_msg.reject(requeue=False)
             return
+        await self.dispatch_message(amqp_msg, msg)
+
+    async def dispatch_message(
+        self, amqp_msg: IncomingMessage, msg: Message
+    ) -> Optional[asyncio.Future]:
+        """
+        Processes the message, or if it's dispatched onto a lane, returns a future that's
+        done once the lane has processed it
+        """
+        deadline_at = self.get_deadline(msg)
+        if self.dispatcher:
+            # Messages from the same user always go to the same lane, so they're
+            # processed in order without having to contend on the user lock
+            return self.dispatcher.dispatch(msg.from_addr, (amqp_msg, msg, deadline_at))
+        await self.handle_message(amqp_msg, msg, deadline_at)
+        return None
 
-        msg_id = msg.message_id
+    def rebalance(self, ring: HashRing):
+        """
+        Forgets the cached users that are now routed to other workers, so that if they
+        come back to us, we don't use stale data
+        """
+        if isinstance(self.user_store, CachedUserStore):
+            worker_id = self.router.worker_id if self.router else None
+            self.user_store.evict(lambda addr: ring.get(addr) != worker_id)
+
+    def get_deadline(self, msg: Message) -> Optional[float]:
+        """
+        Returns when the message needs to be processed by, according to the budget for
+        its transport type, in time.monotonic() time
+        """
+        budget = self.message_budgets.get(
+            msg.transport_type.value, config.MESSAGE_BUDGET
+        )
+        if budget <= 0:
+            return None
+        return time.monotonic() + budget
+
+    @asynccontextmanager
+    async def user_lock(self, addr: str):
+        """
+        Locks the user across all worker replicas. Within this process, the dispatcher
+        already ensures that each user's messages are processed one at a time.
+        """
+        if not config.USER_LOCK:
+            yield
+            return
+        start_time = time.monotonic()
+        async with self.redis.lock(
+            f"userlock.{addr}", timeout=config.USER_LOCK_TIMEOUT
+        ):
+            USER_LOCK_WAIT.observe(time.monotonic() - start_time)
+            yield
+
+    async def handle_message(
+        self,
+        amqp_msg: IncomingMessage,
+        msg: Message,
+        deadline_at: Optional[float] = None,
+    ):
+        with deadline.deadline(deadline_at):
+            await self._handle_message(amqp_msg, msg)
+
+    async def _handle_message(self, amqp_msg: IncomingMessage, msg: Message):
         async with amqp_msg.process(requeue=True):
+            logger.debug(f"Processing inbound message {msg}")
+            if self.user_store.optimistic:
+                await self.handle_message_optimistic(msg)
+                return
             try:
-                async with self.redis.lock(
-                    f"userlock.{msg.from_addr}", timeout=config.USER_LOCK_TIMEOUT
-                ):
-                    logger.debug(f"Processing inbound message {msg}")
-
-                    async with log_timing(f"{msg_id} Got user", logger):
-                        user_data = await self.redis.get(f"user.{msg.from_addr}")
-                        user = User.get_or_create(msg.from_addr, user_data)
-                    async with log_timing(f"{msg_id} Processed message", logger):
-                        app = self.ApplicationClass(user, self)
-                        messages = await app.process_message(msg)
-                    async with log_timing(f"{msg_id} Published responses", logger):
-                        for outbound in messages:
-                            await self.publish_message(outbound)
-                    async with log_timing(f"{msg_id} Published answers", logger):
-                        if self.answer_worker:
-                            for answer in app.answer_events:
-                                await self.publish_answer(answer)
-                    async with log_timing(f"{msg_id} Saved user", logger):
-                        await self.redis.setex(
-                            f"user.{msg.from_addr}", config.TTL, user.to_json()
-                        )
+                async with self.user_lock(msg.from_addr):
+                    user = await self.load_user(msg)
+                    with self.collect_publishes() as batch:
+                        app, messages = await self.run_application(user, msg)
+                        await self.publish_responses(app, messages)
+                    await self.publish_batch(msg, batch)
+                    await self.save_user(msg, user)
             except LockNotOwnedError:
                 # There's nothing we can do if a lock is no longer owned when we're
                 # done processing, so log it and carry on
                 logger.exception("")
 
+    async def handle_message_optimistic(self, msg: Message):
+        """
+        Processes the message without locking the user. If someone else changed the
+        user while we were processing, then we process the message again using their
+        changes.
+
+        Everything that's published, eg. replies, answers and outbox submissions, is
+        only published once the user is saved, so those aren't duplicated on retries.
+        Anything else that the application does directly while processing, eg.
+        requests to RapidPro, is done again on every retry, and so needs to be safe to
+        repeat. Outbox submissions that wait for their result are published
+        immediately, but have the same id on every retry, so they're only delivered
+        once.
+        """
+        for _ in range(config.USER_SAVE_RETRIES):
+            user = await self.load_user(msg)
+            with self.collect_publishes() as batch:
+                app, messages = await self.run_application(user, msg)
+                await self.publish_responses(app, messages)
+            if await self.save_user(msg, user):
+                await self.publish_batch(msg, batch)
+                return
+            logger.info(f"{msg.message_id} User changed during processing, retrying")
+        raise UserSaveConflict(f"Could not save user for message {msg.message_id}")
+
+    async def load_user(self, msg: Message) -> User:
+        async with log_timing(f"{msg.message_id} Got user", logger):
+            with USER_STORE_LATENCY.labels("load").time():
+                return await self.user_store.load(msg.from_addr)
+
+    async def run_application(self, user: User, msg: Message):
+        # Processing moves the user on to the next state, so record the state that
+        # the message was processed in, for the deadline overruns
+        state_name = user.state.name
+        async with log_timing(f"{msg.message_id} Processed message", logger):
+            app = self.ApplicationClass(user, self)
+            messages = await app.process_message(msg)
+        remaining = deadline.remaining()
+        if remaining is not None and remaining < 0:
+            deadline.DEADLINE_OVERRUNS.labels(state_name).inc()
+        return app, messages
+
+    async def publish_responses(self, app, messages: list[Message]):
+        for outbound in messages:
+            await self.publish_message(outbound)
+        if self.answer_worker:
+            for answer in app.answer_events:
+                await self.publish_answer(answer)
+
+    async def save_user(self, msg: Message, user: User) -> bool:
+        async with log_timing(f"{msg.message_id} Saved user", logger):
+            with USER_STORE_LATENCY.labels("save").time():
+                return await self.user_store.save(user)
+
+    @contextmanager
+    def collect_publishes(self):
+        """
+        Instead of publishing immediately, anything published inside this context,
+        including by the application while it is processing, is added to the yielded
+        batch, to be published later using publish_batch.
+        """
+        batch = PublishBatch()
+        token = PUBLISH_BATCH.set(batch)
+        try:
+            yield batch
+        finally:
+            PUBLISH_BATCH.reset(token)
+
+    async def publish_batch(self, msg: Message, batch: PublishBatch):
+        """
+        Publishes all the messages in the batch at once, and waits for all of their
+        publisher confirms together, instead of waiting for each confirm in turn.
+
+        Messages that need to be delayed are delivered in the background, so that we
+        don't hold up processing while waiting. Each user's deliveries happen in order,
+        so if the user still has deliveries in progress, all of the messages are
+        delivered in the background after them, instead of holding up the lane and the
+        user's lock.
+
+        Background deliveries are only kept in this worker's memory, and the inbound
+        message is acked without waiting for them, so they're delivered at most once.
+        Teardown waits for them, but if the worker crashes, or publishing them fails,
+        they're lost instead of being redelivered. They're also only ordered with the
+        user's other messages processed by this worker, which with sticky routing is
+        all of them.
+        """
+        if not batch:
+            return
+        previous = self.deliveries.get(msg.from_addr)
+        if previous is not None:
+            self.start_delivery(msg, batch.messages, previous)
+            return
+        immediate, delayed = batch.split()
+        async with log_timing(f"{msg.message_id} Published responses", logger):
+            # The channel writes each publish in the order that they're started, so the
+            # messages stay in order
+            await asyncio.gather(
+                *(
+                    self.publish_amqp(amqp_msg, routing_key)
+                    for amqp_msg, routing_key, _ in immediate
+                )
+            )
+        if delayed:
+            self.start_delivery(msg, delayed)
+
+    def start_delivery(
+        self,
+        msg: Message,
+        messages: list[tuple[AMQPMessage, str, float]],
+        previous: Optional[asyncio.Task] = None,
+    ):
+        task = asyncio.create_task(self.deliver_delayed(msg, messages, previous))
+        self.deliveries[msg.from_addr] = task
+        task.add_done_callback(partial(self.delivery_done, msg.from_addr))
+
+    def delivery_done(self, addr: str, task: asyncio.Task):
+        if self.deliveries.get(addr) is task:
+            del self.deliveries[addr]
+
+    async def deliver_delayed(
+        self,
+        msg: Message,
+        messages: list[tuple[AMQPMessage, str, float]],
+        previous: Optional[asyncio.Task] = None,
+    ):
+        try:
+            if previous is not None:
+                # Only wait for it to finish, it logs its own errors
+                await asyncio.wait([previous])
+            for amqp_msg, routing_key, delay in messages:
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.publish_amqp(amqp_msg, routing_key)
+        except Exception:
+            logger.exception(f"{msg.message_id} Error delivering delayed messages")
+
+    async def delay(self, seconds: float):
+        """
+        Waits before publishing the next message, eg. to give the previous message time
+        to be delivered first. If we're collecting publishes, then this doesn't wait,
+        but instead delays the next message in the batch.
+        """
+        batch = PUBLISH_BATCH.get()
+        if batch is not None:
+            batch.delay(seconds)
+        else:
+            await asyncio.sleep(seconds)
+
+    async def publish(self, body: str, routing_key: str):
+        amqp_msg = make_amqp_message(body)
+        batch = PUBLISH_BATCH.get()
+        if batch is not None:
+            batch.add(amqp_msg, routing_key)
+        else:
+            await self.publish_amqp(amqp_msg, routing_key)
+
+    async def publish_amqp(self, amqp_msg: AMQPMessage, routing_key: str):
+        with AMQP_PUBLISH_LATENCY.labels(routing_key).time():
+            await self.exchange.publish(amqp_msg, routing_key=routing_key)
+
     async def publish_message(self, msg: Message):
-        await self.exchange.publish(
-            AMQPMessage(
-                msg.to_json().encode("utf-8"),
-                delivery_mode=DeliveryMode.PERSISTENT,
-                content_type="application/json",
-                content_encoding="UTF-8",
-            ),
-            routing_key=f"{config.TRANSPORT_NAME}.outbound",
-        )
+        await self.publish(msg.to_json(), f"{config.TRANSPORT_NAME}.outbound")
 
     async def publish_answer(self, answer: Answer):
-        await self.exchange.publish(
-            AMQPMessage(
-                answer.to_json().encode("utf-8"),
-                delivery_mode=DeliveryMode.PERSISTENT,
-                content_type="application/json",
-                content_encoding="UTF-8",
-            ),
-            routing_key=f"{config.TRANSPORT_NAME}.answer",
-        )
+        await self.publish(answer.to_json(), f"{config.TRANSPORT_NAME}.answer")
+
+    async def submit(self, submission: Submission, wait: Optional[float] = None):
+        """
+        Puts the submission in the outbox, to be delivered by the outbox workers. Like
+        everything else that we publish, it's only published once the inbound message
+        has been processed successfully.
+
+        If wait is specified, the submission is published immediately instead, and we
+        wait up to that many seconds for it to be delivered. Returns True if it
+        couldn't be delivered, or if it wasn't delivered in time. It might still be
+        delivered later, so submitting it again should use the same id.
+
+        If the outbox isn't enabled, then the submission is delivered immediately.
+        """
+        if self.outbox is None:
+            return await deliver_with_retries(submission)
+
+        routing_key = f"{config.TRANSPORT_NAME}.outbox"
+        if wait is None:
+            await self.publish(submission.to_json(), routing_key)
+            return False
+
+        await self.publish_amqp(make_amqp_message(submission.to_json()), routing_key)
+        remaining = deadline.remaining()
+        if remaining is not None:
+            wait = min(wait, remaining)
+        error = await wait_for_result(self.redis, submission.id, wait)
+        if error is None:
+            # It's still in the outbox, and will be delivered or dead lettered later
+            logger.warning(f"Timed out waiting for submission {submission.id}")
+            return True
+        return error
 
     async def process_event(self, amqp_msg: IncomingMessage):
         try:
@@ -4,6 +4,7 @@ from urllib.parse import urljoin
 import aiohttp
 import sentry_sdk
 
+from vaccine import clients, resilience
 from vaccine.utils import HTTP_EXCEPTIONS
 from yal import config
 
@@ -11,7 +12,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_aaq_api():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "aaq",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"BEARER {config.AAQ_TOKEN}",
@@ -31,25 +33,21 @@ async def inbound_check(user, message_id, question):
     }
 
     async with get_aaq_api() as session:
-        for i in range(3):
-            try:
-                response = await session.post(
-                    url=urljoin(config.AAQ_URL, "/inbound/check"),
-                    json=data,
-                )
-                response_data = await response.json()
-                sentry_sdk.set_context(
-                    "model", {"request_data": data, "response_data": response_data}
-                )
-                response.raise_for_status()
-
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True, {}
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("aaq"):
+                with attempt:
+                    response = await session.post(
+                        url=urljoin(config.AAQ_URL, "/inbound/check"),
+                        json=data,
+                    )
+                    response_data = await response.json()
+                    sentry_sdk.set_context(
+                        "model", {"request_data": data, "response_data": response_data}
+                    )
+                    response.raise_for_status()
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True, {}
 
     answers = {}
     for id, title, body in response_data["top_responses"]:
@@ -67,19 +65,16 @@ async def inbound_check(user, message_id, question):
 
 async def get_page(url):
     async with get_aaq_api() as session:
-        for i in range(3):
-            try:
-                response = await session.get(url=urljoin(config.AAQ_URL, url))
-                response_data = await response.json()
-                sentry_sdk.set_context("model", {"response_data": response_data})
-                response.raise_for_status()
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True, {}
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("aaq"):
+                with attempt:
+                    response = await session.get(url=urljoin(config.AAQ_URL, url))
+                    response_data = await response.json()
+                    sentry_sdk.set_context("model", {"response_data": response_data})
+                    response.raise_for_status()
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True, {}
 
     answers = {}
     for id, title, body in response_data["top_responses"]:
@@ -108,24 +103,20 @@ async def add_feedback(secret_key, inbound_id, feedback_type, faq_id=None, page=
         data["feedback"]["page_number"] = page
 
     async with get_aaq_api() as session:
-        for i in range(3):
-            try:
-                response = await session.put(
-                    url=urljoin(config.AAQ_URL, "/inbound/feedback"),
-                    json=data,
-                )
-                response_data = await response.text()
-                sentry_sdk.set_context(
-                    "model", {"request_data": data, "response_data": response_data}
-                )
-                response.raise_for_status()
-
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("aaq"):
+                with attempt:
+                    response = await session.put(
+                        url=urljoin(config.AAQ_URL, "/inbound/feedback"),
+                        json=data,
+                    )
+                    response_data = await response.text()
+                    sentry_sdk.set_context(
+                        "model", {"request_data": data, "response_data": response_data}
+                    )
+                    response.raise_for_status()
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True
 
     return False
@@ -1,9 +1,9 @@
-import asyncio
 import logging
 from datetime import timedelta
 
 import aiohttp
 
+from vaccine import clients
 from vaccine.base_application import BaseApplication
 from vaccine.models import Message
 from vaccine.states import (
@@ -31,7 +31,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_aaq_api():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "aaq",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"BEARER {config.AAQ_TOKEN}",
@@ -283,7 +284,7 @@ class Application(BaseApplication):
             ]
         )
         await self.publish_message(question)
-        await asyncio.sleep(1.5)
+        await self.delay(1.5)
 
         return await self.go_to_state("state_get_content_feedback")
 
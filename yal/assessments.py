@@ -1,4 +1,5 @@
-import asyncio
+import importlib
+from collections.abc import Iterator, Mapping
 
 from vaccine.base_application import BaseApplication
 from vaccine.states import (
@@ -11,131 +12,71 @@ from vaccine.states import (
 from vaccine.utils import get_display_choices
 from yal import rapidpro, utils
 from yal.askaquestion import Application as AAQApplication
-
-# Assessments currently part of main flow
-from yal.assessment_data.A1_sexual_health_literacy import (
-    ASSESSMENT_QUESTIONS as SEXUAL_HEALTH_LITERACY_QUESTIONS,
-)
-from yal.assessment_data.A2_locus_of_control import (
-    ASSESSMENT_QUESTIONS as LOCUS_OF_CONTROL_QUESTIONS,
-)
-from yal.assessment_data.A3_depression_and_anxiety import (
-    ASSESSMENT_QUESTIONS as DEPRESSION_AND_ANXIETY_QUESTIONS,
-)
-from yal.assessment_data.A4_connectedness import (
-    ASSESSMENT_QUESTIONS as CONNECTEDNESS_QUESTIONS,
-)
-from yal.assessment_data.A5_gender_attitude import (
-    ASSESSMENT_QUESTIONS as GENDER_ATTITUDE,
-)
-from yal.assessment_data.A6_body_image import (
-    ASSESSMENT_QUESTIONS as BODY_IMAGE_QUESTIONS,
-)
-from yal.assessment_data.A7_self_perceived_healthcare import (
-    ASSESSMENT_QUESTIONS as SELF_PERCEIVED_HEALTHCARE_QUESTIONS,
-)
-from yal.assessment_data.A8_self_esteem import (
-    ASSESSMENT_QUESTIONS as SELF_ESTEEM_QUESTIONS,
-)
 from yal.assessment_data.reengagement import REENGAGEMENT
-from yal.assessment_data_V2.alcohol import ASSESSMENT_QUESTIONS as ALCOHOL_QUESTIONS_V2
-from yal.assessment_data_V2.anxiety import ASSESSMENT_QUESTIONS as ANXIETY_QUESTIONS_V2
-from yal.assessment_data_V2.body_image import (
-    ASSESSMENT_QUESTIONS as BODY_IMAGE_QUESTIONS_V2,
-)
-from yal.assessment_data_V2.connectedness import (
-    ASSESSMENT_QUESTIONS as CONNECTEDNESS_QUESTIONS_V2,
-)
-from yal.assessment_data_V2.depression import (
-    ASSESSMENT_QUESTIONS as DEPRESSION_QUESTIONS_V2,
-)
-from yal.assessment_data_V2.gender_attitude import (
-    ASSESSMENT_QUESTIONS as GENDER_ATTITUDE_QUESTIONS_V2,
-)
-
-# Assessments that form part of the Baseline study
-from yal.assessment_data_V2.self_esteem import (
-    ASSESSMENT_QUESTIONS as SELF_ESTEEM_QUESTIONS_V2,
-)
-from yal.assessment_data_V2.self_perceived_healthcare import (
-    ASSESSMENT_QUESTIONS as SELF_PERCEIVED_HEALTHCARE_QUESTIONS_V2,
-)
-from yal.assessment_data_V2.sexual_consent import (
-    ASSESSMENT_QUESTIONS as SEXUAL_CONSENT_QUESTIONS_V2,
-)
-from yal.assessment_data_V2.sexual_health_literacy import (
-    ASSESSMENT_QUESTIONS as SEXUAL_HEALTH_LITERACY_QUESTIONS_V2,
-)
-from yal.question_sets.endline.alcohol_endline import (
-    ASSESSMENT_QUESTIONS as ALCOHOL_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.anxiety_endline import (
-    ASSESSMENT_QUESTIONS as ANXIETY_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.body_image_endline import (
-    ASSESSMENT_QUESTIONS as BODY_IMAGE_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.connectedness_endline import (
-    ASSESSMENT_QUESTIONS as CONNECTEDNESS_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.depression_endline import (
-    ASSESSMENT_QUESTIONS as DEPRESSION_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.gender_attitude_endline import (
-    ASSESSMENT_QUESTIONS as GENDER_ATTITUDE_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.locus_of_control_endline import (
-    ASSESSMENT_QUESTIONS as LOCUS_OF_CONTROL_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.platform_review_endline import (
-    ASSESSMENT_QUESTIONS as PLATFORM_REVIEW_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.self_esteem_endline import (
-    ASSESSMENT_QUESTIONS as SELF_ESTEEM_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.self_perceived_healthcare_endline import (
-    ASSESSMENT_QUESTIONS as SELF_PERCEIVED_HEALTHCARE_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.sexual_consent_endline import (
-    ASSESSMENT_QUESTIONS as SEXUAL_CONSENT_QUESTIONS_ENDLINE,
-)
-from yal.question_sets.endline.sexual_health_literacy_endline import (
-    ASSESSMENT_QUESTIONS as SEXUAL_HEALTH_LITERACY_QUESTIONS_ENDLINE,
-)
 from yal.utils import get_current_datetime, get_generic_error, normalise_phonenumber
 
-QUESTIONS = {
-    "sexual_health_literacy": SEXUAL_HEALTH_LITERACY_QUESTIONS,
-    "locus_of_control": LOCUS_OF_CONTROL_QUESTIONS,
-    "depression_and_anxiety": DEPRESSION_AND_ANXIETY_QUESTIONS,
-    "connectedness": CONNECTEDNESS_QUESTIONS,
-    "gender_attitude": GENDER_ATTITUDE,
-    "body_image": BODY_IMAGE_QUESTIONS,
-    "self_perceived_healthcare": SELF_PERCEIVED_HEALTHCARE_QUESTIONS,
-    "self_esteem": SELF_ESTEEM_QUESTIONS,
-    "self_esteem_v2": SELF_ESTEEM_QUESTIONS_V2,
-    "connectedness_v2": CONNECTEDNESS_QUESTIONS_V2,
-    "body_image_v2": BODY_IMAGE_QUESTIONS_V2,
-    "depression_v2": DEPRESSION_QUESTIONS_V2,
-    "anxiety_v2": ANXIETY_QUESTIONS_V2,
-    "self_perceived_healthcare_v2": SELF_PERCEIVED_HEALTHCARE_QUESTIONS_V2,
-    "sexual_health_lit_v2": SEXUAL_HEALTH_LITERACY_QUESTIONS_V2,
-    "gender_attitude_v2": GENDER_ATTITUDE_QUESTIONS_V2,
-    "sexual_consent_v2": SEXUAL_CONSENT_QUESTIONS_V2,
-    "alcohol_v2": ALCOHOL_QUESTIONS_V2,
-    "self_esteem_endline": SELF_ESTEEM_QUESTIONS_ENDLINE,
-    "connectedness_endline": CONNECTEDNESS_QUESTIONS_ENDLINE,
-    "body_image_endline": BODY_IMAGE_QUESTIONS_ENDLINE,
-    "depression_endline": DEPRESSION_QUESTIONS_ENDLINE,
-    "anxiety_endline": ANXIETY_QUESTIONS_ENDLINE,
-    "self_perceived_healthcare_endline": SELF_PERCEIVED_HEALTHCARE_QUESTIONS_ENDLINE,
-    "sexual_health_literacy_endline": SEXUAL_HEALTH_LITERACY_QUESTIONS_ENDLINE,
-    "gender_attitude_endline": GENDER_ATTITUDE_QUESTIONS_ENDLINE,
-    "sexual_consent_endline": SEXUAL_CONSENT_QUESTIONS_ENDLINE,
-    "alcohol_endline": ALCOHOL_QUESTIONS_ENDLINE,
-    "platform_review_endline": PLATFORM_REVIEW_QUESTIONS_ENDLINE,
-    "locus_of_control_endline": LOCUS_OF_CONTROL_QUESTIONS_ENDLINE,
-}
+
+class QuestionSets(Mapping):
+    """
+    Maps assessment names to their questions. Each question set is only imported the
+    first time it's used, so that they don't all need to be loaded on startup.
+    """
+
+    def __init__(self, modules: dict[str, str]):
+        self.modules = modules
+        self.loaded: dict[str, dict] = {}
+
+    def __getitem__(self, name: str) -> dict:
+        if name not in self.loaded:
+            module = importlib.import_module(self.modules[name])
+            self.loaded[name] = module.ASSESSMENT_QUESTIONS
+        return self.loaded[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.modules)
+
+    def __len__(self) -> int:
+        return len(self.modules)
+
+    def load_all(self):
+        for name in self:
+            self[name]
+
+
+QUESTIONS = QuestionSets(
+    {
+        "sexual_health_literacy": "yal.assessment_data.A1_sexual_health_literacy",
+        "locus_of_control": "yal.assessment_data.A2_locus_of_control",
+        "depression_and_anxiety": "yal.assessment_data.A3_depression_and_anxiety",
+        "connectedness": "yal.assessment_data.A4_connectedness",
+        "gender_attitude": "yal.assessment_data.A5_gender_attitude",
+        "body_image": "yal.assessment_data.A6_body_image",
+        "self_perceived_healthcare": "yal.assessment_data.A7_self_perceived_healthcare",
+        "self_esteem": "yal.assessment_data.A8_self_esteem",
+        "self_esteem_v2": "yal.assessment_data_V2.self_esteem",
+        "connectedness_v2": "yal.assessment_data_V2.connectedness",
+        "body_image_v2": "yal.assessment_data_V2.body_image",
+        "depression_v2": "yal.assessment_data_V2.depression",
+        "anxiety_v2": "yal.assessment_data_V2.anxiety",
+        "self_perceived_healthcare_v2": "yal.assessment_data_V2.self_perceived_healthcare",
+        "sexual_health_lit_v2": "yal.assessment_data_V2.sexual_health_literacy",
+        "gender_attitude_v2": "yal.assessment_data_V2.gender_attitude",
+        "sexual_consent_v2": "yal.assessment_data_V2.sexual_consent",
+        "alcohol_v2": "yal.assessment_data_V2.alcohol",
+        "self_esteem_endline": "yal.question_sets.endline.self_esteem_endline",
+        "connectedness_endline": "yal.question_sets.endline.connectedness_endline",
+        "body_image_endline": "yal.question_sets.endline.body_image_endline",
+        "depression_endline": "yal.question_sets.endline.depression_endline",
+        "anxiety_endline": "yal.question_sets.endline.anxiety_endline",
+        "self_perceived_healthcare_endline": "yal.question_sets.endline.self_perceived_healthcare_endline",
+        "sexual_health_literacy_endline": "yal.question_sets.endline.sexual_health_literacy_endline",
+        "gender_attitude_endline": "yal.question_sets.endline.gender_attitude_endline",
+        "sexual_consent_endline": "yal.question_sets.endline.sexual_consent_endline",
+        "alcohol_endline": "yal.question_sets.endline.alcohol_endline",
+        "platform_review_endline": "yal.question_sets.endline.platform_review_endline",
+        "locus_of_control_endline": "yal.question_sets.endline.locus_of_control_endline",
+    }
+)
 
 
 class Application(BaseApplication):
@@ -230,7 +171,7 @@ class Application(BaseApplication):
 
         if question_type == "info":
             await self.publish_message(question["text"])
-            await asyncio.sleep(0.5)
+            await self.delay(0.5)
             return await self.go_to_state("state_survey_process_answer")
 
         header = "\n".join(
@@ -396,7 +337,7 @@ class Application(BaseApplication):
             # send reengagement message
             if REENGAGEMENT.get(assessment_name):
                 await self.publish_message(REENGAGEMENT.get(assessment_name))
-                await asyncio.sleep(0.5)
+                await self.delay(0.5)
 
             error = await rapidpro.update_profile(whatsapp_id, data, self.user.metadata)
             if error:
@@ -1,10 +1,10 @@
-import asyncio
 import logging
 import secrets
 from urllib.parse import urljoin
 
 import aiohttp
 
+from vaccine import clients, resilience
 from vaccine.base_application import BaseApplication
 from vaccine.states import (
     Choice,
@@ -28,7 +28,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_google_api():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "google",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={"Content-Type": "application/json", "User-Agent": "healthcheck-ussd"},
     )
@@ -399,44 +400,44 @@ class Application(BaseApplication):
 
         async with get_google_api() as session:
             if latitude and longitude:
-                for i in range(3):
-                    try:
-                        response = await session.get(
-                            urljoin(
-                                config.GOOGLE_PLACES_URL,
-                                "/maps/api/geocode/json",
-                            ),
-                            params={
-                                "latlng": f"{latitude},{longitude}",
-                                "key": config.GOOGLE_PLACES_KEY,
-                                "sessiontoken": secrets.token_bytes(20).hex(),
-                                "language": "en",
-                            },
-                        )
-                        response.raise_for_status()
-                        data = await response.json()
-
-                        logger.debug(data)
-
-                        if data["status"] != "OK":
-                            logger.debug("not ok")
-                            return await self.go_to_state("state_error")
-
-                        first_result = data["results"][0]
-                        self.save_metadata("place_id", first_result["place_id"])
-                        self.save_metadata(
-                            "new_location_description",
-                            first_result["formatted_address"],
-                        )
-
-                        return await self.go_to_state("state_update_location_confirm")
-                    except HTTP_EXCEPTIONS as e:
-                        if i == 2:
-                            logger.exception(e)
-                            logger.debug("http exception")
-                            return await self.go_to_state("state_error")
-                        else:
-                            continue
+                try:
+                    async for attempt in resilience.retrying("google"):
+                        with attempt:
+                            response = await session.get(
+                                urljoin(
+                                    config.GOOGLE_PLACES_URL,
+                                    "/maps/api/geocode/json",
+                                ),
+                                params={
+                                    "latlng": f"{latitude},{longitude}",
+                                    "key": config.GOOGLE_PLACES_KEY,
+                                    "sessiontoken": secrets.token_bytes(20).hex(),
+                                    "language": "en",
+                                },
+                            )
+                            response.raise_for_status()
+                            data = await response.json()
+
+                            logger.debug(data)
+
+                            if data["status"] != "OK":
+                                logger.debug("not ok")
+                                return await self.go_to_state("state_error")
+
+                            first_result = data["results"][0]
+                            self.save_metadata("place_id", first_result["place_id"])
+                            self.save_metadata(
+                                "new_location_description",
+                                first_result["formatted_address"],
+                            )
+
+                            return await self.go_to_state(
+                                "state_update_location_confirm"
+                            )
+                except HTTP_EXCEPTIONS as e:
+                    logger.exception(e)
+                    logger.debug("http exception")
+                    return await self.go_to_state("state_error")
 
     async def state_update_location_confirm(self):
         location = self.user.metadata.get("new_location_description")
@@ -645,7 +646,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(question)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
 
         return await self.go_to_state("state_update_bot_emoji")
 
@@ -762,7 +763,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(question)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_update_notifications_final")
 
     async def state_update_notifications_turn_on(self):
@@ -815,7 +816,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(question)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_update_notifications_final")
 
     async def state_update_notifications_final(self):
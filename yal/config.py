@@ -33,3 +33,14 @@ FACEBOOK_SURVEY_INVITE_SEEN_FEED_URL = environ.get(
     "FACEBOOK_SURVEY_INVITE_SEEN_FEED_URL",
     "https://docs.google.com/forms/d/e/1FAIpQLSe_YlROLiezkGFbdcK7HBA99ABrWvUcvZ20azvAEpQKHwr6kw/viewform?usp=sf_link",
 )
+RAPIDPRO_PROFILE_TTL = int(environ.get("RAPIDPRO_PROFILE_TTL", "0"))
+RAPIDPRO_PROFILE_STALE_TTL = int(environ.get("RAPIDPRO_PROFILE_STALE_TTL", "0"))
+RAPIDPRO_COALESCE_UPDATES = (
+    environ.get("RAPIDPRO_COALESCE_UPDATES", "false").lower() == "true"
+)
+RAPIDPRO_GLOBALS_REFRESH = int(environ.get("RAPIDPRO_GLOBALS_REFRESH", "60"))
+CONTENTREPO_CACHE_TTL = int(environ.get("CONTENTREPO_CACHE_TTL", "0"))
+CONTENTREPO_CACHE_STALE_TTL = int(environ.get("CONTENTREPO_CACHE_STALE_TTL", "3600"))
+CONTENTREPO_CACHE_REDIS = (
+    environ.get("CONTENTREPO_CACHE_REDIS", "false").lower() == "true"
+)
@@ -1,25 +1,174 @@
+import asyncio
+import json
 import logging
-from collections.abc import Iterable
-from typing import Any
+import time
+from collections.abc import Awaitable, Iterable
+from typing import Any, Callable, Optional
 from urllib.parse import urljoin
 
 import aiohttp
+import redis.asyncio as aioredis
+from prometheus_client import Counter
 
+from vaccine import clients, deadline, resilience
 from vaccine.models import User
 from vaccine.states import Choice
 from vaccine.utils import HTTP_EXCEPTIONS
 from yal import config, utils
 
+CONTENT_CACHE = Counter(
+    "contentrepo_cache",
+    "Whenever content is looked up in the cache",
+    ("result",),
+)
+
 logger = logging.getLogger(__name__)
 
 
+class ContentCache:
+    """
+    Caches content in memory. Entries are fresh for `ttl` seconds, and are then still
+    used for another `stale_ttl` seconds while they are revalidated in the background.
+    """
+
+    def __init__(
+        self,
+        ttl: int = config.CONTENTREPO_CACHE_TTL,
+        stale_ttl: int = config.CONTENTREPO_CACHE_STALE_TTL,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries: dict[str, tuple[float, Any]] = {}
+        self.revalidations: dict[str, asyncio.Task] = {}
+
+    async def get_entry(self, key: str) -> Optional[tuple[float, Any]]:
+        """
+        Returns when the entry expires, and its value
+        """
+        return self.entries.get(key)
+
+    async def set_entry(self, key: str, value: Any, ttl: int):
+        self.entries[key] = (time.time() + ttl, value)
+
+    async def delete_entries(self):
+        self.entries.clear()
+
+    async def get(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[tuple[bool, Any]]],
+        ttl: Optional[int] = None,
+    ) -> tuple[bool, Any]:
+        """
+        Gets the value for key from the cache, or using fetch if it's not cached. Like
+        fetch, returns whether there was an error, and the value.
+
+        ttl overrides how long the entry is fresh for.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        entry = await self.get_entry(key)
+        now = time.time()
+        if entry is not None and now < entry[0] + self.stale_ttl:
+            expires_at, value = entry
+            if now < expires_at:
+                CONTENT_CACHE.labels("hit").inc()
+            else:
+                CONTENT_CACHE.labels("stale").inc()
+                self.revalidate(key, fetch, ttl)
+            return False, value
+
+        CONTENT_CACHE.labels("miss").inc()
+        error, value = await fetch()
+        if not error:
+            await self.set_entry(key, value, ttl)
+        return error, value
+
+    def revalidate(
+        self, key: str, fetch: Callable[[], Awaitable[tuple[bool, Any]]], ttl: int
+    ):
+        if key in self.revalidations:
+            return
+        task = asyncio.create_task(self._revalidate(key, fetch, ttl))
+        self.revalidations[key] = task
+        task.add_done_callback(lambda _: self.revalidations.pop(key, None))
+
+    async def _revalidate(
+        self, key: str, fetch: Callable[[], Awaitable[tuple[bool, Any]]], ttl: int
+    ):
+        deadline.clear()
+        try:
+            error, value = await fetch()
+            if not error:
+                await self.set_entry(key, value, ttl)
+        except Exception:
+            logger.exception(f"Error revalidating {key}")
+
+    async def purge(self):
+        """
+        Removes all the cached content, eg. when new content is published
+        """
+        for task in self.revalidations.values():
+            task.cancel()
+        await self.delete_entries()
+
+    async def close(self):
+        for task in self.revalidations.values():
+            task.cancel()
+        await asyncio.gather(*self.revalidations.values(), return_exceptions=True)
+
+
+class RedisContentCache(ContentCache):
+    """
+    Caches content in redis, so that it is shared between all the workers. Values
+    need to be JSON serialisable.
+    """
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        ttl: int = config.CONTENTREPO_CACHE_TTL,
+        stale_ttl: int = config.CONTENTREPO_CACHE_STALE_TTL,
+    ):
+        super().__init__(ttl, stale_ttl)
+        self.redis = redis
+
+    def key(self, key: str) -> str:
+        return f"contentrepo.{key}"
+
+    async def get_entry(self, key: str) -> Optional[tuple[float, Any]]:
+        data = await self.redis.get(self.key(key))
+        if data is None:
+            return None
+        expires_at, value = json.loads(data)
+        return expires_at, value
+
+    async def set_entry(self, key: str, value: Any, ttl: int):
+        await self.redis.setex(
+            self.key(key),
+            ttl + self.stale_ttl,
+            json.dumps([time.time() + ttl, value]),
+        )
+
+    async def delete_entries(self):
+        async for key in self.redis.scan_iter(match=self.key("*")):
+            await self.redis.delete(key)
+
+
+_content_cache: Optional[ContentCache] = None
+
+
+def get_content_cache() -> Optional[ContentCache]:
+    return _content_cache
+
+
+def set_content_cache(cache: Optional[ContentCache]):
+    global _content_cache
+    _content_cache = cache
+
+
 def get_contentrepo_api():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "contentrepo",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Content-Type": "application/json",
@@ -47,15 +196,15 @@ def get_study_consent_form_url():
 
 
 async def get_choices_by_tag(tag: str) -> tuple[bool, list[Choice]]:
-    return await get_choices_by_path(f"/api/v2/pages?tag={tag}")
+    return await get_cached_choices_by_path(f"/api/v2/pages?tag={tag}")
 
 
 async def get_choices_by_parent(parent_id):
-    return await get_choices_by_path(f"/api/v2/pages?child_of={parent_id}")
+    return await get_cached_choices_by_path(f"/api/v2/pages?child_of={parent_id}")
 
 
 async def get_choices_by_id(page_id):
-    return await get_choices_by_path(f"/api/v2/pages?id={page_id}")
+    return await get_cached_choices_by_path(f"/api/v2/pages?id={page_id}")
 
 
 async def get_suggested_choices(topics_viewed):
@@ -65,7 +214,7 @@ async def get_suggested_choices(topics_viewed):
 
 
 async def get_page_detail_by_tag(user, tag):
-    error, choices = await get_choices_by_path(f"/api/v2/pages?tag={tag}")
+    error, choices = await get_choices_by_tag(tag)
 
     if error:
         return error, choices
@@ -73,31 +222,46 @@ async def get_page_detail_by_tag(user, tag):
     return await get_page_details(user, choices[0].value, 1)
 
 
+async def get_cached_choices_by_path(path: str) -> tuple[bool, list[Choice]]:
+    """
+    Like get_choices_by_path, but uses the content cache if it's enabled
+    """
+    cache = get_content_cache()
+    if cache is None:
+        return await get_choices_by_path(path)
+
+    async def fetch():
+        error, choices = await get_choices_by_path(path)
+        return error, [[c.value, c.label] for c in choices]
+
+    error, choices = await cache.get(path, fetch)
+    return error, [Choice(value, label) for value, label in choices]
+
+
 async def get_choices_by_path(path: str) -> tuple[bool, list[Choice]]:
     if not config.CONTENTREPO_API_URL:
         logger.error("CONTENTREPO_API_URL not configured")
         return False, []
     choices = []
     async with get_contentrepo_api() as session:
-        for i in range(3):
-            try:
-                logger.info(f">>>> get_choices_by_path {path}")
-                response = await session.get(urljoin(config.CONTENTREPO_API_URL, path))
-                response.raise_for_status()
-                response_body = await response.json()
-
-                for page in response_body["results"]:
-                    choices.append(Choice(str(page["id"]), page["title"]))
-                response.close()
-                break
-            except HTTP_EXCEPTIONS as e:
-                # TODO: better error handling once contentrepo is updated to
-                # return 404 errors on page not found
-                if i == 2:
-                    logger.warning(e)
-                    return True, []
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("contentrepo"):
+                with attempt:
+                    logger.info(f">>>> get_choices_by_path {path}")
+                    response = await session.get(
+                        urljoin(config.CONTENTREPO_API_URL, path)
+                    )
+                    response.raise_for_status()
+                    response_body = await response.json()
+
+                    for page in response_body["results"]:
+                        choices.append(Choice(str(page["id"]), page["title"]))
+                    response.close()
+        except HTTP_EXCEPTIONS as e:
+            # TODO: better error handling once contentrepo is updated to
+            # return 404 errors on page not found
+            logger.warning(e)
+            return True, []
     return False, choices
 
 
@@ -109,107 +273,118 @@ async def get_page_details(
         return False, {}
     page_details: dict[str, Any] = {}
     async with get_contentrepo_api() as session:
-        for i in range(3):
-            try:
-                params = {
-                    "whatsapp": "true",
-                    "message": message_id,
-                    "data__session_id": user.session_id or "",
-                    "data__user_addr": user.addr,
-                }
-                if suggested:
-                    params["data__suggested"] = True
-
-                logger.info(f">>>> get_page_details /api/v2/pages/{page_id}")
-                logger.info(params)
-                response = await session.get(
-                    urljoin(config.CONTENTREPO_API_URL, f"/api/v2/pages/{page_id}"),
-                    params=params,
-                )
-                response.raise_for_status()
-                response_body = await response.json()
-
-                page_details["page_id"] = page_id
-                page_details["has_children"] = response_body["has_children"]
-                page_details["title"] = response_body["title"]
-                page_details["body"] = response_body["body"]["text"]["value"]["message"]
-
-                variations: dict[str, Any] = {}
-                for v in response_body["body"]["text"]["value"].get(
-                    "variation_messages", []
-                ):
-                    if v["profile_field"] in variations:
-                        variations[v["profile_field"]][v["value"]] = v["message"]
-                    else:
-                        variations[v["profile_field"]] = {v["value"]: v["message"]}
-                page_details["variations"] = variations
-
-                page_details["parent_id"] = response_body["meta"]["parent"]["id"]
-                page_details["parent_title"] = response_body["meta"]["parent"]["title"]
-
-                page_details["tags"] = response_body["tags"]
-
-                page_details["feature_redirects"] = []
-
-                if not page_details["has_children"]:
-                    message_number = response_body["body"]["message"]
-                    total_messages = response_body["body"]["total_messages"]
-
-                    if total_messages > message_number:
-                        page_details["next_prompt"] = (
-                            response_body["body"]["text"]["value"].get("next_prompt")
-                            or "Next"
-                        )
-                    else:
-                        if "prompt_quiz" in page_details["tags"]:
-                            quiz_tag = next(
-                                i for i in page_details["tags"] if i.startswith("quiz_")
-                            )
-                            page_details["quiz_tag"] = quiz_tag
-
-                        tags = ["aaq", "pleasecallme"]
-
-                        if await utils.check_if_service_finder_active() is True:
-                            tags.append("servicefinder")
-
-                        for tag in tags:
-                            if tag in page_details["tags"]:
-                                page_details["feature_redirects"].append(tag)
-
-                    if response_body["related_pages"]:
-                        # Get the content titles, because related_pages contains the
-                        # WhatsApp titles
-                        related_pages = await get_page_titles(
-                            [p["value"] for p in response_body["related_pages"]]
-                        )
-                        page_details["related_pages"] = related_pages
-                    else:
-                        # TODO: deprecate using tags for related content
-                        related_pages = await find_related_pages(response_body["tags"])
-                        if related_pages:
-                            page_details["related_pages"] = related_pages
-
-                    if message_number == 1:
-                        page_details["quick_replies"] = response_body["quick_replies"]
-
-                if response_body["body"]["text"]["value"].get("image"):
-                    image_id = response_body["body"]["text"]["value"]["image"]
+        try:
+            async for attempt in resilience.retrying("contentrepo"):
+                with attempt:
+                    params = {
+                        "whatsapp": "true",
+                        "message": message_id,
+                        "data__session_id": user.session_id or "",
+                        "data__user_addr": user.addr,
+                    }
+                    if suggested:
+                        params["data__suggested"] = True
+
+                    logger.info(f">>>> get_page_details /api/v2/pages/{page_id}")
+                    logger.info(params)
                     response = await session.get(
-                        urljoin(
-                            config.CONTENTREPO_API_URL, f"/api/v2/images/{image_id}"
-                        )
+                        urljoin(config.CONTENTREPO_API_URL, f"/api/v2/pages/{page_id}"),
+                        params=params,
                     )
                     response.raise_for_status()
                     response_body = await response.json()
-                    page_details["image_path"] = response_body["meta"]["download_url"]
-                response.close()
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True, {}
-                else:
-                    continue
+
+                    page_details["page_id"] = page_id
+                    page_details["has_children"] = response_body["has_children"]
+                    page_details["title"] = response_body["title"]
+                    page_details["body"] = response_body["body"]["text"]["value"][
+                        "message"
+                    ]
+
+                    variations: dict[str, Any] = {}
+                    for v in response_body["body"]["text"]["value"].get(
+                        "variation_messages", []
+                    ):
+                        if v["profile_field"] in variations:
+                            variations[v["profile_field"]][v["value"]] = v["message"]
+                        else:
+                            variations[v["profile_field"]] = {v["value"]: v["message"]}
+                    page_details["variations"] = variations
+
+                    page_details["parent_id"] = response_body["meta"]["parent"]["id"]
+                    page_details["parent_title"] = response_body["meta"]["parent"][
+                        "title"
+                    ]
+
+                    page_details["tags"] = response_body["tags"]
+
+                    page_details["feature_redirects"] = []
+
+                    if not page_details["has_children"]:
+                        message_number = response_body["body"]["message"]
+                        total_messages = response_body["body"]["total_messages"]
+
+                        if total_messages > message_number:
+                            page_details["next_prompt"] = (
+                                response_body["body"]["text"]["value"].get(
+                                    "next_prompt"
+                                )
+                                or "Next"
+                            )
+                        else:
+                            if "prompt_quiz" in page_details["tags"]:
+                                quiz_tag = next(
+                                    i
+                                    for i in page_details["tags"]
+                                    if i.startswith("quiz_")
+                                )
+                                page_details["quiz_tag"] = quiz_tag
+
+                            tags = ["aaq", "pleasecallme"]
+
+                            if await utils.check_if_service_finder_active() is True:
+                                tags.append("servicefinder")
+
+                            for tag in tags:
+                                if tag in page_details["tags"]:
+                                    page_details["feature_redirects"].append(tag)
+
+                        if response_body["related_pages"]:
+                            # Get the content titles, because related_pages contains the
+                            # WhatsApp titles
+                            related_pages = await get_page_titles(
+                                [p["value"] for p in response_body["related_pages"]]
+                            )
+                            page_details["related_pages"] = related_pages
+                        else:
+                            # TODO: deprecate using tags for related content
+                            related_pages = await find_related_pages(
+                                response_body["tags"]
+                            )
+                            if related_pages:
+                                page_details["related_pages"] = related_pages
+
+                        if message_number == 1:
+                            page_details["quick_replies"] = response_body[
+                                "quick_replies"
+                            ]
+
+                    if response_body["body"]["text"]["value"].get("image"):
+                        image_id = response_body["body"]["text"]["value"]["image"]
+                        response = await session.get(
+                            urljoin(
+                                config.CONTENTREPO_API_URL, f"/api/v2/images/{image_id}"
+                            )
+                        )
+                        response.raise_for_status()
+                        response_body = await response.json()
+                        page_details["image_path"] = response_body["meta"][
+                            "download_url"
+                        ]
+                    response.close()
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True, {}
     return False, page_details
 
 
@@ -240,27 +415,24 @@ async def get_page_titles(page_ids: Iterable[int]) -> dict[int, str]:
 
 async def add_page_rating(user, page_id, helpful, comment=""):
     async with get_contentrepo_api() as session:
-        for i in range(3):
-            try:
-                response = await session.post(
-                    urljoin(config.CONTENTREPO_API_URL, "api/v2/custom/ratings/"),
-                    json={
-                        "page": page_id,
-                        "helpful": helpful,
-                        "comment": comment,
-                        "data": {
-                            "session_id": user.session_id,
-                            "user_addr": user.addr,
+        try:
+            async for attempt in resilience.retrying("contentrepo"):
+                with attempt:
+                    response = await session.post(
+                        urljoin(config.CONTENTREPO_API_URL, "api/v2/custom/ratings/"),
+                        json={
+                            "page": page_id,
+                            "helpful": helpful,
+                            "comment": comment,
+                            "data": {
+                                "session_id": user.session_id,
+                                "user_addr": user.addr,
+                            },
                         },
-                    },
-                )
-                response.raise_for_status()
-                response.close()
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True
-                else:
-                    continue
+                    )
+                    response.raise_for_status()
+                    response.close()
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True
     return False
@@ -1,5 +1,3 @@
-import asyncio
-
 from vaccine.base_application import BaseApplication
 from vaccine.states import (
     Choice,
@@ -386,7 +384,7 @@ class Application(BaseApplication):
         await self.worker.publish_message(
             self.inbound.reply(self._("Excellent - now we can get you set up."))
         )
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state(EndlineApplication.START_STATE)
 
     async def state_endline_limit_reached(self):
@@ -0,0 +1,150 @@
+"""
+Routes the keywords that interrupt a user's current flow to the state that handles
+them, with a single lookup for each inbound message.
+
+Keyword sets are added in priority order, and compiled into a dictionary of keyword to
+routes. Fuzzy matching against the emergency keywords only happens for keywords that
+aren't in the dictionary, and only compares against keywords that are close enough in
+length to reach the score cutoff.
+"""
+
+from collections import defaultdict
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+
+@dataclass(frozen=True)
+class Route:
+    state: str
+    # Only route messages that the user typed, not replies to interactive messages
+    typed_only: bool = False
+    # Only route users that have this metadata set
+    metadata: Optional[str] = None
+
+    def matches(self, typed: bool, metadata: Mapping[str, Any]) -> bool:
+        if self.typed_only and not typed:
+            return False
+        return self.metadata is None or bool(metadata.get(self.metadata))
+
+
+class FuzzyMatcher:
+    """
+    Finds the closest keyword by fuzz.ratio, that scores at least score_cutoff. Like
+    process.extract in rapidfuzz 1.x, which check_keyword used, the text and keywords
+    are both run through default_process first.
+
+    fuzz.ratio scores strings of lengths a and b at most 200 * min(a, b) / (a + b), so
+    keywords are bucketed by length, and only the buckets that can reach the cutoff are
+    searched.
+    """
+
+    def __init__(self, keywords: Iterable[str], score_cutoff: float):
+        self.score_cutoff = score_cutoff
+        by_length: dict[int, list[str]] = defaultdict(list)
+        for keyword in dict.fromkeys(default_process(k) for k in keywords):
+            if keyword:
+                by_length[len(keyword)].append(keyword)
+        self.by_length = dict(by_length)
+        # The longest text that could score above the cutoff
+        longest = max(self.by_length, default=0)
+        self.max_length = int(longest * (200 - score_cutoff) / score_cutoff)
+        self.candidates: dict[int, list[str]] = {}
+
+    def can_match(self, length: int, keyword_length: int) -> bool:
+        total = length + keyword_length
+        return total > 0 and 200 * min(length, keyword_length) / total >= (
+            self.score_cutoff
+        )
+
+    def get_candidates(self, length: int) -> list[str]:
+        if length > self.max_length:
+            return []
+        candidates = self.candidates.get(length)
+        if candidates is None:
+            candidates = [
+                keyword
+                for keyword_length, keywords in sorted(self.by_length.items())
+                if self.can_match(length, keyword_length)
+                for keyword in keywords
+            ]
+            self.candidates[length] = candidates
+        return candidates
+
+    def match(self, text: str) -> Optional[str]:
+        text = default_process(text)
+        candidates = self.get_candidates(len(text))
+        if not candidates:
+            return None
+        result = process.extractOne(
+            text,
+            candidates,
+            scorer=fuzz.ratio,
+            processor=None,
+            score_cutoff=self.score_cutoff,
+        )
+        return None if result is None else result[0]
+
+
+class KeywordRouter:
+    """
+    Routes are checked in the order that they're added, and the first one that matches
+    the message is used
+    """
+
+    def __init__(self):
+        self.exact: dict[str, list[Route]] = {}
+        self.fuzzy: Optional[FuzzyMatcher] = None
+        self.fuzzy_route: Optional[Route] = None
+
+    def add(self, keywords: Iterable[str], route: Route):
+        for keyword in keywords:
+            if keyword not in self.exact:
+                self.exact[keyword] = []
+                # The fuzzy match would have been checked before this route
+                fuzzy_route = self.match_fuzzy(keyword)
+                if fuzzy_route is not None:
+                    self.exact[keyword].append(fuzzy_route)
+            self.exact[keyword].append(route)
+
+    def add_fuzzy(self, keywords: Iterable[str], route: Route, score_cutoff=76):
+        """
+        Routes keywords that fuzzy match any of the keywords. There can only be one
+        fuzzy route.
+        """
+        self.fuzzy = FuzzyMatcher(keywords, score_cutoff)
+        self.fuzzy_route = route
+        for keyword, routes in self.exact.items():
+            if self.fuzzy.match(keyword) is not None:
+                routes.append(route)
+
+    def match_fuzzy(self, keyword: str) -> Optional[Route]:
+        if self.fuzzy is None or self.fuzzy.match(keyword) is None:
+            return None
+        return self.fuzzy_route
+
+    def route(
+        self, keyword: str, typed: bool, metadata: Mapping[str, Any]
+    ) -> Optional[Route]:
+        """
+        Returns the route for the cleaned inbound keyword, or None if it shouldn't be
+        routed
+
+        keyword: The inbound message content, cleaned with clean_inbound
+        typed: Whether the user typed the message, rather than replying to an
+               interactive message
+        metadata: The user's metadata, for routes that depend on it
+        """
+        routes = self.exact.get(keyword)
+        if routes is None:
+            fuzzy_route = self.match_fuzzy(keyword)
+            if fuzzy_route is None:
+                return None
+            routes = [fuzzy_route]
+        for route in routes:
+            if route.matches(typed, metadata):
+                return route
+        return None
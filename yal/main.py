@@ -1,15 +1,16 @@
-import asyncio
 import logging
+from functools import cache
 
 from vaccine.models import Message
 from vaccine.states import Choice, EndState, WhatsAppButtonState
 from vaccine.utils import get_display_choices, random_id
-from yal import rapidpro, utils
+from yal import assessments, config, contentrepo, rapidpro, utils
 from yal.askaquestion import Application as AaqApplication
 from yal.assessments import Application as AssessmentApplication
 from yal.change_preferences import Application as ChangePreferencesApplication
 from yal.content_feedback_survey import ContentFeedbackSurveyApplication
 from yal.endline_terms_and_conditions import Application as EndlineTermsApplication
+from yal.keyword_router import KeywordRouter, Route
 from yal.mainmenu import Application as MainMenuApplication
 from yal.onboarding import Application as OnboardingApplication
 from yal.optout import Application as OptOutApplication
@@ -67,6 +68,14 @@ TRACKING_KEYWORDS_ROUND_3 = {"youth", "yth", "yuth", "yut", "yoth", "yot", "yoh"
 TRACKING_KEYWORDS_ROUND_4 = {"registerme"}
 TRACKING_KEYWORDS_ROUND_5 = {"holdmyhand"}
 TRACKING_KEYWORDS_TIKTOK = {"sho"}
+ALL_TRACKING_KEYWORDS = frozenset().union(
+    TRACKING_KEYWORDS,
+    TRACKING_KEYWORDS_ROUND_2,
+    TRACKING_KEYWORDS_ROUND_3,
+    TRACKING_KEYWORDS_ROUND_4,
+    TRACKING_KEYWORDS_ROUND_5,
+    TRACKING_KEYWORDS_TIKTOK,
+)
 OPTOUT_KEYWORDS = {"stop", "opt out", "cancel", "quit"}
 ONBOARDING_REMINDER_KEYWORDS = {
     "continue",
@@ -88,7 +97,6 @@ ASSESSMENT_REENGAGEMENT_KEYWORDS = {
 CALLBACK_CHECK_KEYWORDS = {"callback"}
 FEEDBACK_KEYWORDS = {"feedback"}
 QA_RESET_FEEDBACK_TIMESTAMP_KEYWORDS = {"resetfeedbacktimestampobzvmp"}
-EMERGENCY_KEYWORDS = utils.get_keywords("emergency")
 AAQ_KEYWORDS = {"ask a question"}
 EJAF_LOCATION_SURVEY_KEYWORDS = {
     "start survey",
@@ -101,6 +109,53 @@ FACEBOOK_INVITE_KEYWORDS = {
 UPDATE_SETTINGS = {"update settings"}
 
 
+@cache
+def get_keyword_router() -> KeywordRouter:
+    """
+    The routes for keywords that interrupt the user's current flow, in priority order
+    """
+    router = KeywordRouter()
+    router.add(
+        GREETING_KEYWORDS | UPDATE_SETTINGS | ALL_TRACKING_KEYWORDS,
+        Route(Application.START_STATE),
+    )
+    # Go straight to please call me application start, phrase matches exactly
+    emergency_keywords = utils.get_keywords("emergency")
+    router.add(
+        emergency_keywords,
+        Route(PleaseCallMeApplication.START_STATE, typed_only=True),
+    )
+    router.add_fuzzy(
+        emergency_keywords,
+        Route(PleaseCallMeApplication.CONFIRM_REDIRECT, typed_only=True),
+    )
+    router.add(HELP_KEYWORDS, Route(PleaseCallMeApplication.START_STATE))
+    router.add(OPTOUT_KEYWORDS, Route(OptOutApplication.START_STATE))
+    router.add(FEEDBACK_KEYWORDS, Route(FeedbackApplication.START_STATE))
+    router.add(AAQ_KEYWORDS, Route(AaqApplication.START_STATE))
+    router.add(
+        CALLBACK_CHECK_KEYWORDS,
+        Route(PleaseCallMeApplication.CALLBACK_RESPONSE_STATE),
+    )
+    router.add(
+        QA_RESET_FEEDBACK_TIMESTAMP_KEYWORDS,
+        Route("state_qa_reset_feedback_timestamp_keywords"),
+    )
+    router.add(
+        ONBOARDING_REMINDER_KEYWORDS,
+        Route(
+            OnboardingApplication.REMINDER_STATE, metadata="onboarding_reminder_sent"
+        ),
+    )
+    router.add(
+        ASSESSMENT_REENGAGEMENT_KEYWORDS,
+        Route(
+            AssessmentApplication.REMINDER_STATE, metadata="assessment_reminder_sent"
+        ),
+    )
+    return router
+
+
 class Application(
     TermsApplication,
     OnboardingApplication,
@@ -125,11 +180,72 @@ class Application(
 ):
     START_STATE = "state_start"
 
+    @classmethod
+    async def worker_setup(cls, worker):
+        if config.RAPIDPRO_PROFILE_TTL > 0:
+            rapidpro.set_profile_cache(rapidpro.ProfileCache(worker.redis))
+        if config.RAPIDPRO_GLOBALS_REFRESH > 0:
+            globals_cache = rapidpro.GlobalsCache()
+            globals_cache.start()
+            rapidpro.set_globals_cache(globals_cache)
+        if config.CONTENTREPO_CACHE_TTL > 0:
+            if config.CONTENTREPO_CACHE_REDIS:
+                content_cache = contentrepo.RedisContentCache(worker.redis)
+            else:
+                content_cache = contentrepo.ContentCache()
+            contentrepo.set_content_cache(content_cache)
+
+    @classmethod
+    async def worker_teardown(cls, worker):
+        cache = rapidpro.get_profile_cache()
+        rapidpro.set_profile_cache(None)
+        if cache is not None:
+            await cache.close()
+        globals_cache = rapidpro.get_globals_cache()
+        rapidpro.set_globals_cache(None)
+        if globals_cache is not None:
+            await globals_cache.stop()
+        content_cache = contentrepo.get_content_cache()
+        contentrepo.set_content_cache(None)
+        if content_cache is not None:
+            await content_cache.close()
+
+    @classmethod
+    def warm_up(cls):
+        super().warm_up()
+        assessments.QUESTIONS.load_all()
+        get_keyword_router()
+        utils.get_provinces()
+
+    @classmethod
+    async def purge_cache(cls, worker):
+        content_cache = contentrepo.get_content_cache()
+        if content_cache is not None:
+            await content_cache.purge()
+
     async def process_message(self, message):
+        if not config.RAPIDPRO_COALESCE_UPDATES:
+            return await self.process_inbound(message)
+        with rapidpro.buffer_profile_updates() as updates:
+            messages = await self.process_inbound(message)
+        try:
+            await rapidpro.flush_profile_updates(updates)
+        except rapidpro.ProfileUpdateError:
+            # Unbuffered, the failed update would have sent the user to the error
+            # state, so do the same here rather than replying as if it succeeded
+            logger.exception("Profile update error")
+            self.messages = []
+            self.state_name = self.ERROR_STATE
+            state = await self.get_current_state()
+            await state.process_message(message)
+            return self.messages
+        return messages
+
+    async def process_inbound(self, message):
         try:
             msisdn = utils.normalise_phonenumber(message.from_addr)
             whatsapp_id = msisdn.removeprefix("+")
-            error, fields = await rapidpro.get_profile(whatsapp_id)
+            error, fields = await rapidpro.get_cached_profile(whatsapp_id)
             if error:
                 return await self.go_to_state("state_error")
             for key, value in fields.items():
@@ -147,75 +263,22 @@ class Application(
 
             await self.reset_whatsapp_delivery_failure(whatsapp_id)
 
-            # Restart keywords that interrupt the current flow
-
-            if (
-                keyword in GREETING_KEYWORDS
-                or keyword in UPDATE_SETTINGS
-                or keyword in TRACKING_KEYWORDS
-                or keyword in TRACKING_KEYWORDS_ROUND_2
-                or keyword in TRACKING_KEYWORDS_ROUND_3
-                or keyword in TRACKING_KEYWORDS_ROUND_4
-                or keyword in TRACKING_KEYWORDS_ROUND_5
-                or keyword in TRACKING_KEYWORDS_TIKTOK
-            ):
-                self.user.session_id = None
-                self.state_name = self.START_STATE
-
-            elif (
-                keyword in EMERGENCY_KEYWORDS
-                and message.transport_metadata.get("message", {}).get("type")
-                != "interactive"
-            ):
-                # Go straight to please call me application start,
-                # phrase matches exactly
-                self.user.session_id = None
-                self.state_name = PleaseCallMeApplication.START_STATE
-            elif (
-                utils.check_keyword(keyword, EMERGENCY_KEYWORDS)
-                and message.transport_metadata.get("message", {}).get("type")
-                != "interactive"
-            ):
-                self.save_metadata("emergency_keyword_previous_state", self.state_name)
-                # If keyword fuzzy matches an emergency keyword,
-                # First confirm redirect with user
-                self.user.session_id = None
-                self.state_name = PleaseCallMeApplication.CONFIRM_REDIRECT
-
-            elif keyword in HELP_KEYWORDS:
-                self.user.session_id = None
-                self.state_name = PleaseCallMeApplication.START_STATE
-
-            elif keyword in OPTOUT_KEYWORDS:
-                self.user.session_id = None
-                self.state_name = OptOutApplication.START_STATE
-
-            elif keyword in FEEDBACK_KEYWORDS:
-                self.user.session_id = None
-                self.state_name = FeedbackApplication.START_STATE
-
-            elif keyword in AAQ_KEYWORDS:
-                self.user.session_id = None
-                self.state_name = AaqApplication.START_STATE
-
-            elif keyword in CALLBACK_CHECK_KEYWORDS:
-                self.user.session_id = None
-                self.state_name = PleaseCallMeApplication.CALLBACK_RESPONSE_STATE
-
-            elif keyword in QA_RESET_FEEDBACK_TIMESTAMP_KEYWORDS:
-                self.user.session_id = None
-                self.state_name = "state_qa_reset_feedback_timestamp_keywords"
-
-            elif keyword in ONBOARDING_REMINDER_KEYWORDS and self.user.metadata.get(
-                "onboarding_reminder_sent"
-            ):
-                self.user.session_id = None
-                self.state_name = OnboardingApplication.REMINDER_STATE
-            elif keyword in ASSESSMENT_REENGAGEMENT_KEYWORDS and self.user.metadata.get(
-                "assessment_reminder_sent"
-            ):
+            # Keywords that interrupt the current flow
+            route = get_keyword_router().route(
+                keyword,
+                typed=message.transport_metadata.get("message", {}).get("type")
+                != "interactive",
+                metadata=self.user.metadata,
+            )
+            if route is not None:
+                if route.state == PleaseCallMeApplication.CONFIRM_REDIRECT:
+                    # If keyword fuzzy matches an emergency keyword, first confirm
+                    # the redirect with the user
+                    self.save_metadata(
+                        "emergency_keyword_previous_state", self.state_name
+                    )
                 self.user.session_id = None
-                self.state_name = AssessmentApplication.REMINDER_STATE
+                self.state_name = route.state
 
             # Fields that RapidPro sets after a feedback push message
             elif feedback_state:
@@ -228,7 +291,7 @@ class Application(
                 self.state_name = ChangePreferencesApplication.START_STATE
 
             # Replies to template push messages
-            elif payload and payload.startswith("state_") and payload in dir(self):
+            elif payload in self.STATES:
                 self.user.session_id = None
                 self.state_name = payload
 
@@ -315,27 +378,12 @@ class Application(
         inbound = utils.clean_inbound(self.inbound.content)
 
         # Save keywords that are used for source tracking
-        if (
-            inbound in TRACKING_KEYWORDS
-            or inbound in TRACKING_KEYWORDS_ROUND_2
-            or inbound in TRACKING_KEYWORDS_ROUND_3
-            or inbound in TRACKING_KEYWORDS_ROUND_4
-            or inbound in TRACKING_KEYWORDS_ROUND_5
-            or inbound in TRACKING_KEYWORDS_TIKTOK
-        ):
+        if inbound in ALL_TRACKING_KEYWORDS:
             self.save_answer("state_source_tracking", inbound)
 
         if inbound in OPTOUT_KEYWORDS:
             return await self.go_to_state(OptOutApplication.START_STATE)
-        if (
-            inbound in GREETING_KEYWORDS
-            or inbound in TRACKING_KEYWORDS
-            or inbound in TRACKING_KEYWORDS_ROUND_2
-            or inbound in TRACKING_KEYWORDS_ROUND_3
-            or inbound in TRACKING_KEYWORDS_ROUND_4
-            or inbound in TRACKING_KEYWORDS_ROUND_5
-            or inbound in TRACKING_KEYWORDS_TIKTOK
-        ):
+        if inbound in GREETING_KEYWORDS or inbound in ALL_TRACKING_KEYWORDS:
             if terms_accepted and onboarding_completed:
                 return await self.go_to_state(MainMenuApplication.START_STATE)
             elif terms_accepted:
@@ -394,7 +442,7 @@ class Application(
         )
 
         await self.publish_message(msg)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         score = self.user.metadata.get("assessment_score", 0)
         # score of 0-25 high risk
         # score of 26-30 low risk
@@ -454,7 +502,7 @@ class Application(
         risk = self.user.metadata.get("sexual_health_lit_risk", "high_risk")
         for message in questions[risk]:
             await self.publish_message(message)
-            await asyncio.sleep(0.5)
+            await self.delay(0.5)
         return await self.go_to_state("state_generic_what_would_you_like_to_do")
 
     async def state_sexual_health_literacy_assessment_later(self):
@@ -519,7 +567,7 @@ class Application(
         risk = self.user.metadata.get("depression_and_anxiety_risk", "high_risk")
         for message in questions[risk]:
             await self.publish_message(message)
-            await asyncio.sleep(0.5)
+            await self.delay(0.5)
         return await self.go_to_state("state_generic_what_would_you_like_to_do")
 
     async def state_depression_and_anxiety_assessment_later(self):
@@ -594,7 +642,7 @@ class Application(
 
         for message in questions[risk]:
             await self.publish_message(message)
-            await asyncio.sleep(0.5)
+            await self.delay(0.5)
         return await self.go_to_state("state_generic_what_would_you_like_to_do")
 
     async def state_connectedness_assessment_later(self):
@@ -686,7 +734,7 @@ class Application(
 
         for message in questions[risk]:
             await self.publish_message(message)
-            await asyncio.sleep(0.5)
+            await self.delay(0.5)
         return await self.go_to_state("state_generic_what_would_you_like_to_do")
 
     async def state_gender_attitude_assessment_later(self):
@@ -777,9 +825,9 @@ class Application(
         risk = self.user.metadata.get("body_image_risk", "high_risk")
 
         await self.publish_message(questions[risk][0])
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         await self.publish_message(questions[risk][1])
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_generic_what_would_you_like_to_do")
 
     async def state_body_image_assessment_later(self):
@@ -825,7 +873,7 @@ class Application(
             )
         )
         await self.publish_message(msg)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_generic_what_would_you_like_to_do")
 
     async def state_self_perceived_healthcare_assessment_later(self):
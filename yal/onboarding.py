@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 from vaccine.base_application import BaseApplication
@@ -70,7 +69,7 @@ class Application(BaseApplication):
                 )
             )
             await self.publish_message(msg)
-            await asyncio.sleep(0.5)
+            await self.delay(0.5)
             return await self.go_to_state("state_persona_emoji")
 
         return await self.go_to_state("state_age")
@@ -116,7 +115,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(msg)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_age")
 
     async def state_age(self):
@@ -342,7 +341,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(msg)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_locus_of_control_assessment_few_qs")
 
     async def state_locus_of_control_assessment_few_qs(self):
@@ -385,7 +384,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(msg)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state(PushmessageOptinApplication.START_STATE)
 
     async def state_stop_onboarding_reminders(self):
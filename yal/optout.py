@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 from vaccine.base_application import BaseApplication
@@ -101,9 +100,7 @@ class Application(BaseApplication):
         data = self.reminders_to_be_cleared
 
         error = await rapidpro.update_profile(
-            whatsapp_id,
-            data,
-            self.user.metadata,
+            whatsapp_id, data, self.user.metadata, sync=True
         )
         if error:
             return await self.go_to_state("state_error")
@@ -125,7 +122,7 @@ class Application(BaseApplication):
             )
         )
         await self.worker.publish_message(self.inbound.reply(msg))
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_optout_survey")
 
     async def state_optout_survey(self):
@@ -211,7 +208,7 @@ class Application(BaseApplication):
             batch_dict = dict(batch)
 
             error = await rapidpro.update_profile(
-                whatsapp_id, batch_dict, self.user.metadata
+                whatsapp_id, batch_dict, self.user.metadata, sync=True
             )
             if error:
                 return await self.go_to_state("state_error")
@@ -1,13 +1,13 @@
-import asyncio
 import logging
 from datetime import datetime, timedelta
 from urllib.parse import urljoin
 
 import aiohttp
 
+from vaccine import clients, outbox
 from vaccine.base_application import BaseApplication
 from vaccine.states import Choice, EndState, FreeText, WhatsAppButtonState
-from vaccine.utils import HTTP_EXCEPTIONS, get_display_choices
+from vaccine.utils import get_display_choices
 from yal import config, rapidpro
 from yal.change_preferences import Application as ChangePreferencesApplication
 from yal.utils import (
@@ -22,36 +22,22 @@ from yal.validators import phone_number_validator
 logger = logging.getLogger(__name__)
 
 
-async def on_request_start(session, context, params):
-    context.request_start = asyncio.get_event_loop().time()
-
-
-async def on_request_end(session, context, params):
-    elapsed_time = round(
-        (asyncio.get_event_loop().time() - context.request_start) * 1000
-    )
-    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    msisdn = context.trace_request_ctx["msisdn"]
-    logger.info(
-        f"[{now}] Lovelife request (msisdn:{msisdn}) - {elapsed_time}ms <{params.url}>"
-    )
-
-
 def get_lovelife_api():
-    trace_config = aiohttp.TraceConfig()
-    trace_config.on_request_start.append(on_request_start)
-    trace_config.on_request_end.append(on_request_end)
-
-    return aiohttp.ClientSession(
+    # Requests are timed by the session's trace config, and logged with the msisdn
+    # from the submission's context
+    return clients.get_session(
+        "lovelife",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Ocp-Apim-Subscription-Key": config.LOVELIFE_TOKEN or "",
             "Content-Type": "application/json",
         },
-        trace_configs=[trace_config],
     )
 
 
+outbox.register_target("yal.lovelife", get_lovelife_api)
+
+
 class Application(BaseApplication):
     START_STATE = "state_please_call_start"
     CALLBACK_RESPONSE_STATE = "state_handle_callback_check_response"
@@ -188,7 +174,7 @@ class Application(BaseApplication):
                 "[persona_emoji] *Say no more—I'm on it!*\n☝🏾 Hold tight just a sec..."
             ),
         )
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         await self.publish_message(
             self._(
                 "\n".join(
@@ -202,7 +188,7 @@ class Application(BaseApplication):
                 )
             )
         )
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_in_hours")
 
     async def state_in_hours(self):
@@ -244,26 +230,18 @@ class Application(BaseApplication):
         msisdn = normalise_phonenumber(
             answers.get("state_specify_msisdn", self.inbound.from_addr)
         )
-        async with get_lovelife_api() as session:
-            for i in range(3):
-                try:
-                    response = await session.post(
-                        url=urljoin(config.LOVELIFE_URL, "/lovelife/v1/queuemessage"),
-                        json={
-                            "PhoneNumber": msisdn,
-                            "SourceSystem": "Bwise by Young Africa live WhatsApp bot",
-                        },
-                        trace_request_ctx={"msisdn": f"*{msisdn[-4:]}"},
-                    )
-                    response.raise_for_status()
-                    response.close()
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+        error = await self.submit(
+            "yal.lovelife",
+            urljoin(config.LOVELIFE_URL, "/lovelife/v1/queuemessage"),
+            {
+                "PhoneNumber": msisdn,
+                "SourceSystem": "Bwise by Young Africa live WhatsApp bot",
+            },
+            context={"msisdn": f"*{msisdn[-4:]}"},
+            wait=True,
+        )
+        if error:
+            return await self.go_to_state("state_error")
 
         return await self.go_to_state("state_save_time_for_callback_check")
 
@@ -642,7 +620,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(msg)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_ask_to_call_again")
 
     async def state_ask_to_call_again(self):
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 from vaccine.base_application import BaseApplication
@@ -114,7 +113,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(msg)
-        await asyncio.sleep(1)
+        await self.delay(1)
         return await self.go_to_state("state_pushmessage_optin_final")
 
     async def state_pushmessage_optin_final(self):
@@ -180,7 +179,7 @@ class Application(BaseApplication):
                 helper_metadata={"document": contentrepo.get_study_consent_form_url()},
             )
         )
-        await asyncio.sleep(1.5)
+        await self.delay(1.5)
         return await self.go_to_state("state_study_consent")
 
     async def state_study_consent(self):
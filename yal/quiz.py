@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 from vaccine.base_application import BaseApplication
@@ -74,7 +73,7 @@ class Application(BaseApplication):
                         helper_metadata=helper_metadata,
                     )
                 )
-                await asyncio.sleep(0.5)
+                await self.delay(0.5)
                 self.save_metadata("quiz_result_sent", True)
 
             choices = [
@@ -1,16 +1,241 @@
+import asyncio
+import json
 import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
 from urllib.parse import urljoin
 
 import aiohttp
+import redis.asyncio as aioredis
+from prometheus_client import Counter, Gauge
 
+from vaccine import clients, deadline, resilience
+from vaccine.metrics import multiprocess_enabled
 from vaccine.utils import HTTP_EXCEPTIONS
 from yal import config
 
+PROFILE_CACHE = Counter(
+    "rapidpro_profile_cache",
+    "Whenever a contact profile is looked up in the cache",
+    ("result",),
+)
+GLOBALS_STALENESS = Gauge(
+    "rapidpro_globals_staleness_seconds",
+    "Time since the cached RapidPro globals were last refreshed",
+    multiprocess_mode="livemax",
+)
+PROFILE_UPDATE_FAILURES = Counter(
+    "rapidpro_profile_update_failures",
+    "Whenever buffered profile updates for a contact couldn't be sent to RapidPro",
+)
+
 logger = logging.getLogger(__name__)
 
+# RapidPro can only update 100 fields at a time
+MAX_UPDATE_FIELDS = 100
+
+# Profile updates buffered while processing the current inbound message, per contact
+PROFILE_UPDATES: ContextVar[Optional[dict[str, dict]]] = ContextVar(
+    "profile_updates", default=None
+)
+
+# Only updates the cached profile if there is one, so that we never cache a partial
+# profile
+UPDATE_IF_EXISTS_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    redis.call("HSET", KEYS[1], unpack(ARGV))
+end
+"""
+
+
+class ProfileUpdateError(Exception):
+    """
+    Buffered profile updates couldn't be sent to RapidPro
+    """
+
+
+class ProfileCache:
+    """
+    Caches contact profiles in redis, as a hash of JSON encoded field values.
+
+    Profiles are fresh for `ttl` seconds, and are then still used for another
+    `stale_ttl` seconds while they are revalidated in the background.
+    """
+
+    FETCHED_AT = "_fetched_at"
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        ttl: int = config.RAPIDPRO_PROFILE_TTL,
+        stale_ttl: int = config.RAPIDPRO_PROFILE_STALE_TTL,
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.update_if_exists = redis.register_script(UPDATE_IF_EXISTS_SCRIPT)
+        self.revalidations: dict[str, asyncio.Task] = {}
+
+    def key(self, whatsapp_id: str) -> str:
+        return f"rapidpro_profile.{whatsapp_id}"
+
+    async def get(self, whatsapp_id: str) -> tuple[Optional[dict], bool]:
+        """
+        Returns the cached fields, or None if there aren't any, and whether they're
+        still fresh
+        """
+        data = await self.redis.hgetall(self.key(whatsapp_id))
+        if not data:
+            return None, False
+        fetched_at = float(data.pop(self.FETCHED_AT, 0))
+        fields = {k: json.loads(v) for k, v in data.items()}
+        return fields, time.time() - fetched_at < self.ttl
+
+    async def set(self, whatsapp_id: str, fields: dict):
+        key = self.key(whatsapp_id)
+        mapping = {k: json.dumps(v) for k, v in fields.items()}
+        mapping[self.FETCHED_AT] = str(time.time())
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, self.ttl + self.stale_ttl)
+            await pipe.execute()
+
+    async def update(self, whatsapp_id: str, fields: dict):
+        """
+        Updates the specified fields in the cached profile, if there is one
+        """
+        args = []
+        for k, v in fields.items():
+            args.extend([k, json.dumps(v)])
+        if args:
+            await self.update_if_exists(keys=[self.key(whatsapp_id)], args=args)
+
+    async def invalidate(self, whatsapp_id: str):
+        await self.redis.delete(self.key(whatsapp_id))
+
+    def revalidate(self, whatsapp_id: str):
+        """
+        Refreshes the cached profile in the background
+        """
+        if whatsapp_id in self.revalidations:
+            return
+        task = asyncio.create_task(self._revalidate(whatsapp_id))
+        self.revalidations[whatsapp_id] = task
+        task.add_done_callback(lambda _: self.revalidations.pop(whatsapp_id, None))
+
+    async def _revalidate(self, whatsapp_id: str):
+        deadline.clear()
+        try:
+            error, fields = await get_profile(whatsapp_id)
+            if not error:
+                await self.set(whatsapp_id, fields)
+        except Exception:
+            logger.exception(f"Error revalidating profile for {whatsapp_id}")
+
+    async def close(self):
+        for task in self.revalidations.values():
+            task.cancel()
+        await asyncio.gather(*self.revalidations.values(), return_exceptions=True)
+
+
+class GlobalsCache:
+    """
+    Caches RapidPro globals and group membership counts in memory for the whole
+    process. Anything that has been looked up is refreshed every `refresh_interval`
+    seconds in the background, so lookups never wait for RapidPro after the first one.
+    """
+
+    def __init__(self, refresh_interval: int = config.RAPIDPRO_GLOBALS_REFRESH):
+        self.refresh_interval = refresh_interval
+        self.globals: dict[str, Any] = {}
+        self.group_counts: dict[str, int] = {}
+        self.refreshed_at = time.time()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not multiprocess_enabled():
+            GLOBALS_STALENESS.set_function(lambda: time.time() - self.refreshed_at)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def get_global(self, global_name: str) -> tuple[bool, Any]:
+        if global_name not in self.globals:
+            error, value = await fetch_global(global_name)
+            if error:
+                return True, None
+            self.globals[global_name] = value
+        return False, self.globals[global_name]
+
+    async def get_group_count(self, group_name: str) -> tuple[bool, int]:
+        if group_name not in self.group_counts:
+            error, count = await fetch_group_membership_count(group_name)
+            if error:
+                return True, 0
+            self.group_counts[group_name] = count
+        return False, self.group_counts[group_name]
+
+    async def refresh(self):
+        """
+        Refreshes all the globals in a single request, and each of the group counts
+        """
+        if self.globals:
+            error, values = await fetch_all_globals()
+            if error:
+                return
+            self.globals = {name: values.get(name) for name in self.globals}
+        for group_name in list(self.group_counts):
+            error, count = await fetch_group_membership_count(group_name)
+            if error:
+                return
+            self.group_counts[group_name] = count
+        self.refreshed_at = time.time()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Error refreshing RapidPro globals")
+            if multiprocess_enabled():
+                # Aggregated metrics can't use a function, so update it after each
+                # refresh instead
+                GLOBALS_STALENESS.set(time.time() - self.refreshed_at)
+
+
+_profile_cache: Optional[ProfileCache] = None
+_globals_cache: Optional[GlobalsCache] = None
+
+
+def get_profile_cache() -> Optional[ProfileCache]:
+    return _profile_cache
+
+
+def set_profile_cache(cache: Optional[ProfileCache]):
+    global _profile_cache
+    _profile_cache = cache
+
+
+def get_globals_cache() -> Optional[GlobalsCache]:
+    return _globals_cache
+
+
+def set_globals_cache(cache: Optional[GlobalsCache]):
+    global _globals_cache
+    _globals_cache = cache
+
 
 def get_rapidpro_api():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "rapidpro",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Token {config.RAPIDPRO_TOKEN}",
@@ -24,87 +249,179 @@ async def get_profile(whatsapp_id):
     urn = f"whatsapp:{whatsapp_id}"
     fields = {}
     async with get_rapidpro_api() as session:
-        for i in range(3):
-            try:
-                response = await session.get(
-                    urljoin(config.RAPIDPRO_URL, "/api/v2/contacts.json"),
-                    params={"urn": urn},
-                )
-                response.raise_for_status()
-                response_body = await response.json()
-
-                if len(response_body["results"]) > 0:
-                    contact = response_body["results"][0]
-                    fields = contact["fields"]
-                response.close()
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True, fields
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("rapidpro"):
+                with attempt:
+                    response = await session.get(
+                        urljoin(config.RAPIDPRO_URL, "/api/v2/contacts.json"),
+                        params={"urn": urn},
+                    )
+                    response.raise_for_status()
+                    response_body = await response.json()
+
+                    if len(response_body["results"]) > 0:
+                        contact = response_body["results"][0]
+                        fields = contact["fields"]
+                    response.close()
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True, fields
 
     return False, fields
 
 
-async def update_profile(whatsapp_id, fields, metadata):
+async def get_cached_profile(whatsapp_id):
+    """
+    Gets the user's profile from the profile cache if it's enabled, otherwise from
+    RapidPro. Stale profiles are returned while they are refreshed in the background.
+    """
+    cache = get_profile_cache()
+    if cache is None:
+        return await get_profile(whatsapp_id)
+
+    fields, fresh = await cache.get(whatsapp_id)
+    if fields is not None:
+        PROFILE_CACHE.labels("hit" if fresh else "stale").inc()
+        if not fresh:
+            cache.revalidate(whatsapp_id)
+        return False, fields
+
+    PROFILE_CACHE.labels("miss").inc()
+    error, fields = await get_profile(whatsapp_id)
+    if not error:
+        await cache.set(whatsapp_id, fields)
+    return error, fields
+
+
+async def invalidate_profile(whatsapp_id):
+    """
+    Removes the user's profile from the profile cache, for when it was changed on
+    RapidPro's side, so that it's fetched from RapidPro again on the next message
+    """
+    cache = get_profile_cache()
+    if cache is not None:
+        await cache.invalidate(whatsapp_id)
+
+
+@contextmanager
+def buffer_profile_updates():
+    """
+    Instead of updating RapidPro immediately, profile updates inside this context are
+    merged into the yielded buffer, to be sent later using flush_profile_updates.
+    """
+    updates: dict[str, dict] = {}
+    token = PROFILE_UPDATES.set(updates)
+    try:
+        yield updates
+    finally:
+        PROFILE_UPDATES.reset(token)
+
+
+async def flush_profile_updates(updates):
+    """
+    Sends the buffered profile updates, with a single request per contact where
+    possible. Updates that are sent are removed from the buffer.
+
+    Raises ProfileUpdateError if any of the updates couldn't be sent, so that the
+    caller can send the user to the error state, as it would for an unbuffered
+    update that failed.
+    """
+    failed = []
+    for whatsapp_id, fields in list(updates.items()):
+        items = list(fields.items())
+        for i in range(0, len(items), MAX_UPDATE_FIELDS):
+            batch = dict(items[i : i + MAX_UPDATE_FIELDS])
+            if await update_profile(whatsapp_id, batch, {}, sync=True):
+                PROFILE_UPDATE_FAILURES.inc()
+                failed.append(whatsapp_id)
+                break
+        else:
+            del updates[whatsapp_id]
+    if failed:
+        raise ProfileUpdateError(
+            f"Could not send profile updates for {len(failed)} contacts"
+        )
+
+
+async def update_profile(whatsapp_id, fields, metadata, sync=False):
     """
     Updates the user's profile on RapidPro.
 
     whatsapp_id: The user's whatsapp URN path
     fields: Keys are fields to update, values are values to update them to
     metadata: The user's metadata. Used to keep cached contact in sync with RapidPro
+    sync: If profile updates are being buffered, send this update immediately, eg.
+        because we need to know if it failed
     """
+    updates = PROFILE_UPDATES.get()
+    pending = {}
+    if updates is not None:
+        pending = updates.setdefault(whatsapp_id, {})
+        if not sync:
+            for key, value in fields.items():
+                metadata[key] = value
+                if value is not None:
+                    pending[key] = value
+            return False
+
     urn = f"whatsapp:{whatsapp_id}"
     async with get_rapidpro_api() as session:
-        for i in range(3):
-            try:
-                params = {"fields": {}}
-
-                for key, value in fields.items():
-                    if value is not None:
-                        params["fields"][key] = value
-
-                response = await session.post(
-                    urljoin(config.RAPIDPRO_URL, f"/api/v2/contacts.json?urn={urn}"),
-                    json=params,
-                )
-                response.raise_for_status()
-                for key, value in fields.items():
-                    metadata[key] = value
-                response.close()
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("rapidpro"):
+                with attempt:
+                    # Include any earlier buffered updates, so that they don't overwrite
+                    # this one when they're flushed
+                    params = {"fields": dict(pending)}
+
+                    for key, value in fields.items():
+                        if value is not None:
+                            params["fields"][key] = value
+
+                    response = await session.post(
+                        urljoin(
+                            config.RAPIDPRO_URL, f"/api/v2/contacts.json?urn={urn}"
+                        ),
+                        json=params,
+                    )
+                    response.raise_for_status()
+                    for key, value in fields.items():
+                        metadata[key] = value
+                    pending.clear()
+                    response.close()
+                    cache = get_profile_cache()
+                    if cache is not None:
+                        await cache.update(whatsapp_id, params["fields"])
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True
     return False
 
 
 async def start_flow(whatsapp_id, flow_uuid):
+    # The flow might use the contact's fields, so send any buffered updates first
+    updates = PROFILE_UPDATES.get()
+    if updates and updates.get(whatsapp_id):
+        await flush_profile_updates({whatsapp_id: updates.pop(whatsapp_id)})
+
     urn = f"whatsapp:{whatsapp_id}"
     async with get_rapidpro_api() as session:
-        for i in range(3):
-            try:
-                data = {
-                    "flow": flow_uuid,
-                    "urns": [urn],
-                }
-                response = await session.post(
-                    urljoin(config.RAPIDPRO_URL, "/api/v2/flow_starts.json"),
-                    json=data,
-                )
-                response.raise_for_status()
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("rapidpro"):
+                with attempt:
+                    data = {
+                        "flow": flow_uuid,
+                        "urns": [urn],
+                    }
+                    response = await session.post(
+                        urljoin(config.RAPIDPRO_URL, "/api/v2/flow_starts.json"),
+                        json=data,
+                    )
+                    response.raise_for_status()
+                    # The flow can change the contact's fields
+                    await invalidate_profile(whatsapp_id)
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True
     return False
 
 
@@ -113,47 +430,49 @@ async def get_instance_fields():
     Gets a list of all the CUSTOM fields in a given rapidpro instance
     """
     async with get_rapidpro_api() as session:
-        for i in range(3):
-            try:
-                response = await session.get(
-                    urljoin(config.RAPIDPRO_URL, "/api/v2/fields.json"),
-                )
-                response.raise_for_status()
-                response_body = await response.json()
-
-                if len(response_body["results"]) > 0:
-                    fields = response_body["results"]
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("rapidpro"):
+                with attempt:
+                    response = await session.get(
+                        urljoin(config.RAPIDPRO_URL, "/api/v2/fields.json"),
+                    )
+                    response.raise_for_status()
+                    response_body = await response.json()
+
+                    if len(response_body["results"]) > 0:
+                        fields = response_body["results"]
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True
     return fields
 
 
 async def get_group_membership_count(group_name):
+    cache = get_globals_cache()
+    if cache is not None:
+        return await cache.get_group_count(group_name)
+    return await fetch_group_membership_count(group_name)
+
+
+async def fetch_group_membership_count(group_name):
     async with get_rapidpro_api() as session:
-        for i in range(3):
-            try:
-                response = await session.get(
-                    urljoin(
-                        config.RAPIDPRO_URL, f"/api/v2/groups.json?name={group_name}"
-                    ),
-                )
-                response.raise_for_status()
-                response_body = await response.json()
-
-                if len(response_body["results"]) > 0:
-                    count = response_body["results"][0]["count"]
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True, 0
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("rapidpro"):
+                with attempt:
+                    response = await session.get(
+                        urljoin(
+                            config.RAPIDPRO_URL,
+                            f"/api/v2/groups.json?name={group_name}",
+                        ),
+                    )
+                    response.raise_for_status()
+                    response_body = await response.json()
+
+                    if len(response_body["results"]) > 0:
+                        count = response_body["results"][0]["count"]
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True, 0
     return False, count
 
 
@@ -161,31 +480,31 @@ async def get_global_flag(global_name):
     """
     Checks a Global var on the RapidPro instance to see if it is active
     """
+    cache = get_globals_cache()
+    if cache is not None:
+        error, value = await cache.get_global(global_name)
+        return not error and str(value).lower() == "true"
     async with get_rapidpro_api() as session:
         is_active = False
-        for i in range(3):
-            try:
-                response = await session.get(
-                    urljoin(
-                        config.RAPIDPRO_URL,
-                        f"/api/v2/globals.json?key={global_name}",
-                    ),
-                )
-                response.raise_for_status()
-                response_body = await response.json()
-
-                if len(response_body["results"]) > 0:
-                    is_active = (
-                        str(response_body["results"][0]["value"]).lower() == "true"
+        try:
+            async for attempt in resilience.retrying("rapidpro"):
+                with attempt:
+                    response = await session.get(
+                        urljoin(
+                            config.RAPIDPRO_URL,
+                            f"/api/v2/globals.json?key={global_name}",
+                        ),
                     )
+                    response.raise_for_status()
+                    response_body = await response.json()
 
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return False
-                else:
-                    continue
+                    if len(response_body["results"]) > 0:
+                        is_active = (
+                            str(response_body["results"][0]["value"]).lower() == "true"
+                        )
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return False
     return is_active
 
 
@@ -193,25 +512,76 @@ async def get_global_value(global_name):
     """
     Fetches a global variable.
     """
+    cache = get_globals_cache()
+    if cache is not None:
+        error, value = await cache.get_global(global_name)
+        if error or value is None:
+            return False
+        return str(value).lower()
     async with get_rapidpro_api() as session:
-        for i in range(3):
-            try:
-                response = await session.get(
-                    urljoin(
-                        config.RAPIDPRO_URL,
-                        f"/api/v2/globals.json?key={global_name}",
-                    ),
-                )
-                response.raise_for_status()
-                response_body = await response.json()
-
-                rapidpro_global = str(response_body["results"][0]["value"]).lower()
+        try:
+            async for attempt in resilience.retrying("rapidpro"):
+                with attempt:
+                    response = await session.get(
+                        urljoin(
+                            config.RAPIDPRO_URL,
+                            f"/api/v2/globals.json?key={global_name}",
+                        ),
+                    )
+                    response.raise_for_status()
+                    response_body = await response.json()
 
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return False
-                else:
-                    continue
+                    rapidpro_global = str(response_body["results"][0]["value"]).lower()
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return False
 
     return rapidpro_global
+
+
+async def fetch_global(global_name):
+    """
+    Fetches the raw value of a global variable, or None if it doesn't exist
+    """
+    async with get_rapidpro_api() as session:
+        try:
+            async for attempt in resilience.retrying("rapidpro"):
+                with attempt:
+                    response = await session.get(
+                        urljoin(config.RAPIDPRO_URL, "/api/v2/globals.json"),
+                        params={"key": global_name},
+                    )
+                    response.raise_for_status()
+                    response_body = await response.json()
+
+                    value = None
+                    if len(response_body["results"]) > 0:
+                        value = response_body["results"][0]["value"]
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True, None
+    return False, value
+
+
+async def fetch_all_globals():
+    """
+    Fetches the raw values of all the global variables
+    """
+    values = {}
+    url = urljoin(config.RAPIDPRO_URL, "/api/v2/globals.json")
+    async with get_rapidpro_api() as session:
+        while url:
+            try:
+                async for attempt in resilience.retrying("rapidpro"):
+                    with attempt:
+                        response = await session.get(url)
+                        response.raise_for_status()
+                        response_body = await response.json()
+
+                        for result in response_body["results"]:
+                            values[result["key"]] = result["value"]
+                        url = response_body.get("next")
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return True, values
+    return False, values
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import secrets
 from collections import defaultdict
@@ -8,6 +7,7 @@ from urllib.parse import urljoin
 import aiohttp
 import geopy.distance
 
+from vaccine import clients, resilience
 from vaccine.base_application import BaseApplication
 from vaccine.states import (
     Choice,
@@ -25,8 +25,8 @@ from yal.pleasecallme import Application as PleaseCallMeApplication
 from yal.utils import (
     BACK_TO_MAIN,
     GET_HELP,
-    PROVINCES,
     get_generic_error,
+    get_provinces,
     normalise_phonenumber,
 )
 
@@ -34,7 +34,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_servicefinder_api():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "servicefinder",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Authorization": f"Basic {config.SERVICEFINDER_TOKEN}",
@@ -44,7 +45,8 @@ def get_servicefinder_api():
 
 
 def get_google_api():
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "google",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={"Content-Type": "application/json", "User-Agent": "healthcheck-ussd"},
     )
@@ -111,7 +113,7 @@ class Application(BaseApplication):
         await self.publish_message(
             self._("[persona_emoji] *Okay, I just need to confirm some details...*")
         )
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
 
         msg = self._(
             "\n".join(
@@ -129,7 +131,7 @@ class Application(BaseApplication):
             )
         )
         await self.publish_message(msg)
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
 
         return await self.go_to_state("state_confirm_existing_address")
 
@@ -170,28 +172,24 @@ class Application(BaseApplication):
 
     async def state_category_lookup(self):
         async with get_servicefinder_api() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        url=urljoin(config.SERVICEFINDER_URL, "/api/categories"),
-                    )
-                    response.raise_for_status()
-                    response_body = await response.json()
-
-                    categories = defaultdict(dict)
-                    for c in response_body:
-                        parent = c["parent"] or "root"
-                        categories[parent][c["_id"]] = c["name"]
-
-                    self.save_metadata("categories", dict(categories))
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
-
+            try:
+                async for attempt in resilience.retrying("servicefinder"):
+                    with attempt:
+                        response = await session.get(
+                            url=urljoin(config.SERVICEFINDER_URL, "/api/categories"),
+                        )
+                        response.raise_for_status()
+                        response_body = await response.json()
+
+                        categories = defaultdict(dict)
+                        for c in response_body:
+                            parent = c["parent"] or "root"
+                            categories[parent][c["_id"]] = c["name"]
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
+
+        await self.save_shared_metadata("categories", dict(categories))
         return await self.go_to_state("state_pre_category_msg")
 
     async def state_pre_category_msg(self):
@@ -207,7 +205,7 @@ class Application(BaseApplication):
             ]
         )
         await self.publish_message(self._(msg))
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
 
         return await self.go_to_state("state_category")
 
@@ -216,7 +214,11 @@ class Application(BaseApplication):
 
         parent_category = self.user.answers["state_category"]
 
-        category = metadata["categories"][metadata["parent_category"]][parent_category]
+        categories = await self.get_metadata("categories")
+        if categories is None:
+            # The categories expired from the blob store, so fetch them again
+            return await self.go_to_state("state_category_lookup")
+        category = categories[metadata["parent_category"]][parent_category]
 
         self.save_metadata("parent_category", parent_category)
 
@@ -230,13 +232,17 @@ class Application(BaseApplication):
                 self.reset_metadata()
                 return PleaseCallMeApplication.START_STATE
 
-            if choice.value in self.user.metadata["categories"]:
+            if choice.value in all_categories:
                 return "state_save_parent_category"
 
             return "state_service_lookup"
 
         metadata = self.user.metadata
-        categories = metadata["categories"][metadata.get("parent_category", "root")]
+        all_categories = await self.get_metadata("categories")
+        if all_categories is None:
+            # The categories expired from the blob store, so fetch them again
+            return await self.go_to_state("state_category_lookup")
+        categories = all_categories[metadata.get("parent_category", "root")]
 
         category_text = "\n".join(
             [f"*{i + 1}* - {v}" for i, v in enumerate(categories.values())]
@@ -276,30 +282,27 @@ class Application(BaseApplication):
 
     async def state_service_lookup(self):
         async with get_servicefinder_api() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        url=urljoin(config.SERVICEFINDER_URL, "/api/locations"),
-                        params={
-                            "category": self.user.answers["state_category"],
-                            "latitude": self.user.metadata["latitude"],
-                            "longitude": self.user.metadata["longitude"],
-                            "radius": 50,
-                        },
-                    )
-                    response.raise_for_status()
-                    response_body = await response.json()
+            try:
+                async for attempt in resilience.retrying("servicefinder"):
+                    with attempt:
+                        response = await session.get(
+                            url=urljoin(config.SERVICEFINDER_URL, "/api/locations"),
+                            params={
+                                "category": self.user.answers["state_category"],
+                                "latitude": self.user.metadata["latitude"],
+                                "longitude": self.user.metadata["longitude"],
+                                "radius": 50,
+                            },
+                        )
+                        response.raise_for_status()
+                        response_body = await response.json()
 
-                    facility_count = len(response_body)
+                        facility_count = len(response_body)
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
 
-                    self.save_metadata("facilities", response_body)
-                    break
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+        await self.save_shared_metadata("facilities", response_body)
 
         if facility_count > 0:
             return await self.go_to_state("state_display_facilities")
@@ -327,6 +330,11 @@ class Application(BaseApplication):
         )
 
     async def state_display_facilities(self):
+        categories = await self.get_metadata("categories")
+        if categories is None:
+            # The categories expired from the blob store, so fetch them again
+            return await self.go_to_state("state_category_lookup")
+
         timestamp = utils.get_current_datetime() + self.SURVEY_DELAY
         whatsapp_id = utils.normalise_phonenumber(self.inbound.from_addr).lstrip("+")
         await rapidpro.update_profile(
@@ -339,6 +347,7 @@ class Application(BaseApplication):
         )
 
         metadata = self.user.metadata
+        facilities = await self.get_metadata("facilities", [])
         msg = "\n".join(
             [
                 "NEED HELP? / Find clinics and services / *Get help near you*",
@@ -348,7 +357,7 @@ class Application(BaseApplication):
             ]
         )
         await self.publish_message(self._(msg))
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
 
         user_location = (metadata["latitude"], metadata["longitude"])
 
@@ -366,10 +375,10 @@ class Application(BaseApplication):
             return "\n".join(details)
 
         services = "\n----\n\n".join(
-            [format_facility(i, f) for i, f in enumerate(metadata["facilities"][:5])]
+            [format_facility(i, f) for i, f in enumerate(facilities[:5])]
         )
 
-        category = metadata["categories"][metadata.get("parent_category", "root")][
+        category = categories[metadata.get("parent_category", "root")][
             self.user.answers["state_category"]
         ]
 
@@ -401,7 +410,7 @@ class Application(BaseApplication):
         await self.publish_message(
             self._("[persona_emoji] *Sure. Where would you like me to look?*")
         )
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
 
         question = "\n".join(
             [
@@ -499,40 +508,40 @@ class Application(BaseApplication):
         longitude = metadata.get("longitude")
 
         async with get_google_api() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        urljoin(
-                            config.GOOGLE_PLACES_URL,
-                            "/maps/api/geocode/json",
-                        ),
-                        params={
-                            "latlng": f"{latitude},{longitude}",
-                            "key": config.GOOGLE_PLACES_KEY,
-                            "sessiontoken": metadata.get("google_session_token"),
-                            "language": "en",
-                        },
-                    )
-                    response.raise_for_status()
-                    data = await response.json()
-
-                    if data["status"] != "OK":
-                        logger.error(f"Received non-OK status from geocode API: {data}")
-                        return await self.go_to_state("state_error")
-
-                    first_result = data["results"][0]
-                    self.save_metadata("place_id", first_result["place_id"])
-                    self.save_metadata(
-                        "location_description", first_result["formatted_address"]
-                    )
+            try:
+                async for attempt in resilience.retrying("google"):
+                    with attempt:
+                        response = await session.get(
+                            urljoin(
+                                config.GOOGLE_PLACES_URL,
+                                "/maps/api/geocode/json",
+                            ),
+                            params={
+                                "latlng": f"{latitude},{longitude}",
+                                "key": config.GOOGLE_PLACES_KEY,
+                                "sessiontoken": metadata.get("google_session_token"),
+                                "language": "en",
+                            },
+                        )
+                        response.raise_for_status()
+                        data = await response.json()
+
+                        if data["status"] != "OK":
+                            logger.error(
+                                f"Received non-OK status from geocode API: {data}"
+                            )
+                            return await self.go_to_state("state_error")
+
+                        first_result = data["results"][0]
+                        self.save_metadata("place_id", first_result["place_id"])
+                        self.save_metadata(
+                            "location_description", first_result["formatted_address"]
+                        )
 
-                    return await self.go_to_state("state_save_location")
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+                        return await self.go_to_state("state_save_location")
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
 
     async def state_save_location(self):
         metadata = self.user.metadata
@@ -554,9 +563,9 @@ class Application(BaseApplication):
 
     async def state_province(self):
         province_text = "\n".join(
-            [f"{i + 1} - {name}" for i, (_, name) in enumerate(PROVINCES)]
+            [f"{i + 1} - {name}" for i, (_, name) in enumerate(get_provinces())]
         )
-        province_choices = [Choice(code, name) for code, name in PROVINCES]
+        province_choices = [Choice(code, name) for code, name in get_provinces()]
         province_choices.append(Choice("skip", "Skip"))
 
         question = self._(
@@ -762,72 +771,68 @@ class Application(BaseApplication):
 
         address = f"{street_name} {suburb}, {province}".strip()
         async with get_google_api() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        urljoin(
-                            config.GOOGLE_PLACES_URL,
-                            "/maps/api/place/autocomplete/json",
-                        ),
-                        params={
-                            "input": address,
-                            "key": config.GOOGLE_PLACES_KEY,
-                            "sessiontoken": metadata.get("google_session_token"),
-                            "language": "en",
-                            "components": "country:za",
-                        },
-                    )
-                    response.raise_for_status()
-                    data = await response.json()
-
-                    if data["status"] != "OK":
-                        logger.error(
-                            f"Received non-OK response from autocomplete API: {data}"
+            try:
+                async for attempt in resilience.retrying("google"):
+                    with attempt:
+                        response = await session.get(
+                            urljoin(
+                                config.GOOGLE_PLACES_URL,
+                                "/maps/api/place/autocomplete/json",
+                            ),
+                            params={
+                                "input": address,
+                                "key": config.GOOGLE_PLACES_KEY,
+                                "sessiontoken": metadata.get("google_session_token"),
+                                "language": "en",
+                                "components": "country:za",
+                            },
                         )
-                        return await self.go_to_state("state_error")
+                        response.raise_for_status()
+                        data = await response.json()
+
+                        if data["status"] != "OK":
+                            logger.error(
+                                f"Received non-OK response from autocomplete API: {data}"
+                            )
+                            return await self.go_to_state("state_error")
 
-                    first_result = data["predictions"][0]
-                    self.save_metadata("place_id", first_result["place_id"])
-                    self.save_metadata("location_description", address)
+                        first_result = data["predictions"][0]
+                        self.save_metadata("place_id", first_result["place_id"])
+                        self.save_metadata("location_description", address)
 
-                    return await self.go_to_state("state_address_coords_lookup")
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+                        return await self.go_to_state("state_address_coords_lookup")
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
 
     async def state_address_coords_lookup(self):
         async with get_google_api() as session:
-            for i in range(3):
-                try:
-                    response = await session.get(
-                        urljoin(
-                            config.GOOGLE_PLACES_URL, "/maps/api/place/details/json"
-                        ),
-                        params={
-                            "key": config.GOOGLE_PLACES_KEY,
-                            "place_id": self.user.metadata.get("place_id"),
-                            "sessiontoken": self.user.metadata.get(
-                                "google_session_token"
+            try:
+                async for attempt in resilience.retrying("google"):
+                    with attempt:
+                        response = await session.get(
+                            urljoin(
+                                config.GOOGLE_PLACES_URL, "/maps/api/place/details/json"
                             ),
-                            "language": "en",
-                            "fields": "geometry",
-                        },
-                    )
-                    response.raise_for_status()
-                    data = await response.json()
+                            params={
+                                "key": config.GOOGLE_PLACES_KEY,
+                                "place_id": self.user.metadata.get("place_id"),
+                                "sessiontoken": self.user.metadata.get(
+                                    "google_session_token"
+                                ),
+                                "language": "en",
+                                "fields": "geometry",
+                            },
+                        )
+                        response.raise_for_status()
+                        data = await response.json()
 
-                    location = data["result"]["geometry"]["location"]
+                        location = data["result"]["geometry"]["location"]
 
-                    self.save_metadata("latitude", location["lat"])
-                    self.save_metadata("longitude", location["lng"])
+                        self.save_metadata("latitude", location["lat"])
+                        self.save_metadata("longitude", location["lng"])
 
-                    return await self.go_to_state("state_save_location")
-                except HTTP_EXCEPTIONS as e:
-                    if i == 2:
-                        logger.exception(e)
-                        return await self.go_to_state("state_error")
-                    else:
-                        continue
+                        return await self.go_to_state("state_save_location")
+            except HTTP_EXCEPTIONS as e:
+                logger.exception(e)
+                return await self.go_to_state("state_error")
@@ -1,5 +1,3 @@
-import asyncio
-
 from vaccine.base_application import BaseApplication
 from vaccine.states import (
     Choice,
@@ -66,7 +64,7 @@ class Application(BaseApplication):
                 )
             ),
         )
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
 
         return await self.go_to_state("state_location_introduction")
 
@@ -183,7 +181,7 @@ class Application(BaseApplication):
                 helper_metadata={"document": contentrepo.get_privacy_policy_url()},
             )
         )
-        await asyncio.sleep(1.5)
+        await self.delay(1.5)
         return await self.go_to_state("state_location_question")
 
     async def state_location_question(self):
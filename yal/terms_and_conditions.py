@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 from vaccine.base_application import BaseApplication
@@ -83,7 +82,7 @@ class Application(BaseApplication):
                 helper_metadata={"document": contentrepo.get_privacy_policy_url()},
             )
         )
-        await asyncio.sleep(1.5)
+        await self.delay(1.5)
         return await self.go_to_state("state_terms")
 
     async def state_decline_confirm(self):
@@ -134,7 +133,7 @@ class Application(BaseApplication):
                 )
             )
         )
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state("state_decline_2")
 
     async def state_decline_2(self):
@@ -178,5 +177,5 @@ class Application(BaseApplication):
         await self.worker.publish_message(
             self.inbound.reply(self._("Excellent - now we can get you set up."))
         )
-        await asyncio.sleep(0.5)
+        await self.delay(0.5)
         return await self.go_to_state(OnboardingApplication.START_STATE)
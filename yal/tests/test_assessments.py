@@ -8,6 +8,7 @@ from sanic import Sanic, response
 from vaccine.models import Message
 from vaccine.testing import AppTester, TState, run_sanic
 from yal import config
+from yal.assessments import QuestionSets
 from yal.main import Application
 
 
@@ -635,3 +636,16 @@ async def test_whatsapp_menu_after_not_interested(tester: AppTester, rapidpro_mo
     await tester.user_input("menu")
 
     tester.assert_state("state_mainmenu")
+
+
+def test_question_sets_lazy():
+    """
+    Question sets should only be imported when they're first used
+    """
+    questions = QuestionSets({"test": "yal.assessment_data.A2_locus_of_control"})
+    assert questions.loaded == {}
+    assert "test" in questions
+    assert questions["test"]["1"]["questions"]
+    assert list(questions.loaded) == ["test"]
+    with pytest.raises(KeyError):
+        questions["missing"]
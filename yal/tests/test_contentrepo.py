@@ -0,0 +1,102 @@
+import pytest
+import redis.asyncio as aioredis
+from sanic import Sanic, response
+
+from vaccine import config as vaccine_config
+from vaccine.states import Choice
+from vaccine.testing import TState, run_sanic
+from yal import config, contentrepo
+
+
+@pytest.fixture
+async def redis():
+    redis = aioredis.from_url(
+        vaccine_config.REDIS_URL, encoding="utf-8", decode_responses=True
+    )
+    yield redis
+    for key in await redis.keys("contentrepo.*"):
+        await redis.delete(key)
+    await redis.close()
+
+
+@pytest.fixture
+async def contentrepo_mock():
+    Sanic.test_mode = True
+    app = Sanic("contentrepo_mock")
+    tstate = TState()
+
+    @app.route("/api/v2/pages", methods=["GET"])
+    def get_pages(request):
+        tstate.requests.append(request)
+        if tstate.errormax and tstate.errors < tstate.errormax:
+            tstate.errors += 1
+            return response.json({}, status=500)
+        return response.json(
+            {"results": [{"id": 111, "title": "Main Menu 1"}]}, status=200
+        )
+
+    async with run_sanic(app) as server:
+        url = config.CONTENTREPO_API_URL
+        config.CONTENTREPO_API_URL = f"http://{server.host}:{server.port}"
+        server.tstate = tstate
+        yield server
+        config.CONTENTREPO_API_URL = url
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def content_cache(request, redis):
+    if request.param == "redis":
+        cache = contentrepo.RedisContentCache(redis, ttl=60, stale_ttl=60)
+    else:
+        cache = contentrepo.ContentCache(ttl=60, stale_ttl=60)
+    contentrepo.set_content_cache(cache)
+    yield cache
+    contentrepo.set_content_cache(None)
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_get_choices_cached(contentrepo_mock, content_cache):
+    """
+    Choices should only be fetched from ContentRepo if they're not cached
+    """
+    expected = (False, [Choice("111", "Main Menu 1")])
+    assert await contentrepo.get_choices_by_tag("mainmenu") == expected
+    assert await contentrepo.get_choices_by_tag("mainmenu") == expected
+    assert len(contentrepo_mock.tstate.requests) == 1
+
+    await content_cache.purge()
+    assert await contentrepo.get_choices_by_tag("mainmenu") == expected
+    assert len(contentrepo_mock.tstate.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_choices_error_not_cached(contentrepo_mock, content_cache):
+    """
+    Errors shouldn't be cached
+    """
+    contentrepo_mock.tstate.errormax = 3
+    assert await contentrepo.get_choices_by_tag("mainmenu") == (True, [])
+    assert await contentrepo.get_choices_by_tag("mainmenu") == (
+        False,
+        [Choice("111", "Main Menu 1")],
+    )
+    assert len(contentrepo_mock.tstate.requests) == 4
+
+
+@pytest.mark.asyncio
+async def test_content_cache_stale(content_cache):
+    """
+    Stale entries should be returned, and revalidated in the background
+    """
+
+    async def fetch_old():
+        return False, "old"
+
+    async def fetch_new():
+        return False, "new"
+
+    assert await content_cache.get("key", fetch_old, ttl=0) == (False, "old")
+    assert await content_cache.get("key", fetch_new) == (False, "old")
+    await content_cache.revalidations["key"]
+    assert await content_cache.get("key", fetch_old) == (False, "new")
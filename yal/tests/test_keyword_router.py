@@ -0,0 +1,86 @@
+from yal import utils
+from yal.keyword_router import FuzzyMatcher, KeywordRouter, Route
+from yal.main import get_keyword_router
+
+EMERGENCY = Route("state_emergency", typed_only=True)
+CONFIRM = Route("state_confirm", typed_only=True)
+OPTOUT = Route("state_optout")
+REMINDER = Route("state_reminder", metadata="reminder_sent")
+
+
+def make_router():
+    router = KeywordRouter()
+    router.add(["hi"], Route("state_start"))
+    router.add(["suicide"], EMERGENCY)
+    router.add_fuzzy(["suicide", "a&e"], CONFIRM)
+    router.add(["stop", "suicid", "continue"], OPTOUT)
+    router.add(["continue"], REMINDER)
+    return router
+
+
+def test_exact_routes():
+    """
+    The first route added for a keyword that matches the message should be used
+    """
+    router = make_router()
+    assert router.route("hi", typed=True, metadata={}) == Route("state_start")
+    assert router.route("stop", typed=True, metadata={}) == OPTOUT
+    assert router.route("suicide", typed=True, metadata={}) == EMERGENCY
+    assert router.route("hello there", typed=True, metadata={}) is None
+
+
+def test_route_conditions():
+    """
+    Routes that only apply to typed messages, or users with metadata, should be
+    skipped if the message doesn't match them
+    """
+    router = make_router()
+    assert router.route("suicide", typed=False, metadata={}) is None
+    assert router.route("continue", typed=True, metadata={}) == OPTOUT
+
+    router.add(["later"], REMINDER)
+    assert router.route("later", typed=True, metadata={}) is None
+    assert router.route("later", typed=True, metadata={"reminder_sent": True}) == (
+        REMINDER
+    )
+
+
+def test_fuzzy_route():
+    """
+    Keywords that fuzzy match come before routes that were added after the fuzzy
+    route, and punctuation in the fuzzy keywords is ignored, like check_keyword
+    """
+    router = make_router()
+    assert router.route("suiside", typed=True, metadata={}) == CONFIRM
+    assert router.route("suiside", typed=False, metadata={}) is None
+    assert router.route("suicid", typed=True, metadata={}) == CONFIRM
+    assert router.route("suicid", typed=False, metadata={}) == OPTOUT
+    assert router.route("a e", typed=True, metadata={}) == CONFIRM
+
+
+def test_fuzzy_matcher():
+    """
+    Should match the same keywords as check_keyword, only searching keywords that are
+    close enough in length
+    """
+    keywords = utils.get_keywords("emergency")
+    matcher = FuzzyMatcher(keywords, score_cutoff=76)
+    texts = ["i want to kil myself", "suicde", "help me please", "1", "hi"]
+    # Punctuation should be handled the same way too
+    texts += ["a e", "a&e", "cut", "#cut", "self_harm"]
+    for text in texts:
+        assert (matcher.match(text) is not None) == utils.check_keyword(text, keywords)
+    assert matcher.get_candidates(200) == []
+    assert all(len(k) <= 5 for k in matcher.get_candidates(3))
+
+
+def test_main_router():
+    """
+    The application's router should route its keywords
+    """
+    router = get_keyword_router()
+    assert router.route("hi", typed=False, metadata={}).state == "state_start"
+    assert router.route("stop", typed=False, metadata={}).state == "state_optout"
+    assert router.route("help", typed=False, metadata={}).state == (
+        "state_please_call_start"
+    )
@@ -9,7 +9,7 @@ from sanic import Sanic, response
 
 from vaccine.models import Message
 from vaccine.testing import AppTester, TState, run_sanic
-from yal import config
+from yal import assessments, config, rapidpro
 from yal.askaquestion import Application as AaqApplication
 from yal.assessments import Application as SegmentSurveyApplication
 from yal.change_preferences import Application as ChangePreferencesApplication
@@ -35,32 +35,26 @@ from yal.wa_fb_crossover_feedback import Application as WaFbCrossoverFeedbackApp
 
 
 def get_state_sets():
-    m_states = {s for s in dir(Application) if s.startswith("state_")}
-    mm_states = {s for s in dir(MainMenuApplication) if s.startswith("state_")}
-    on_states = {s for s in dir(OnboardingApplication) if s.startswith("state_")}
-    oo_states = {s for s in dir(OptoutApplication) if s.startswith("state_")}
-    te_states = {s for s in dir(TermsApplication) if s.startswith("state_")}
-    cp_states = {s for s in dir(ChangePreferencesApplication) if s.startswith("state_")}
-    q_states = {s for s in dir(QuizApplication) if s.startswith("state_")}
-    pc_states = {s for s in dir(PleaseCallMeApplication) if s.startswith("state_")}
-    sf_states = {s for s in dir(ServiceFinderApplication) if s.startswith("state_")}
-    aaq_states = {s for s in dir(AaqApplication) if s.startswith("state_")}
-    fb_states = {s for s in dir(FeedbackApplication) if s.startswith("state_")}
-    c_fb_states = {
-        s for s in dir(ContentFeedbackSurveyApplication) if s.startswith("state_")
-    }
-    sf_s_states = {
-        s for s in dir(ServiceFinderFeedbackSurveyApplication) if s.startswith("state_")
-    }
-    bs_states = {s for s in dir(BaselineSurveyApplication) if s.startswith("state_")}
-    es_states = {s for s in dir(EndlineSurveyApplication) if s.startswith("state_")}
-    fi_states = {s for s in dir(FacebookInviteApplication) if s.startswith("state_")}
-    ls_states = {s for s in dir(LocationSurveyApplication) if s.startswith("state_")}
-    ss_states = {s for s in dir(SegmentSurveyApplication) if s.startswith("state_")}
-    wa_fb_states = {
-        s for s in dir(WaFbCrossoverFeedbackApplication) if s.startswith("state_")
-    }
-    optin_states = {s for s in dir(OptinsApplication) if s.startswith("state_")}
+    m_states = set(Application.STATES)
+    mm_states = set(MainMenuApplication.STATES)
+    on_states = set(OnboardingApplication.STATES)
+    oo_states = set(OptoutApplication.STATES)
+    te_states = set(TermsApplication.STATES)
+    cp_states = set(ChangePreferencesApplication.STATES)
+    q_states = set(QuizApplication.STATES)
+    pc_states = set(PleaseCallMeApplication.STATES)
+    sf_states = set(ServiceFinderApplication.STATES)
+    aaq_states = set(AaqApplication.STATES)
+    fb_states = set(FeedbackApplication.STATES)
+    c_fb_states = set(ContentFeedbackSurveyApplication.STATES)
+    sf_s_states = set(ServiceFinderFeedbackSurveyApplication.STATES)
+    bs_states = set(BaselineSurveyApplication.STATES)
+    es_states = set(EndlineSurveyApplication.STATES)
+    fi_states = set(FacebookInviteApplication.STATES)
+    ls_states = set(LocationSurveyApplication.STATES)
+    ss_states = set(SegmentSurveyApplication.STATES)
+    wa_fb_states = set(WaFbCrossoverFeedbackApplication.STATES)
+    optin_states = set(OptinsApplication.STATES)
 
     return [
         m_states,
@@ -88,17 +82,14 @@ def get_state_sets():
 
 def test_no_state_name_clashes():
     state_sets = get_state_sets()
-    intersection = set.intersection(*state_sets) - {
-        "state_name",
-        "state_error",
-    }
+    intersection = set.intersection(*state_sets) - {"state_error"}
 
     assert len(intersection) == 0, f"Common states to both apps: {intersection}"
 
 
 def test_all_states_added_to_docs():
     state_sets = get_state_sets()
-    existing_states = set.union(*state_sets) - {"state_name"}
+    existing_states = set.union(*state_sets)
 
     # States from assessments are dynamic
     for assessment in iter_modules(["yal/assessment_data"]):
@@ -439,6 +430,21 @@ async def test_state_start_to_catch_all(tester: AppTester, rapidpro_mock):
     assert len(rapidpro_mock.tstate.requests) == 1
 
 
+@pytest.mark.asyncio
+@mock.patch("yal.config.RAPIDPRO_COALESCE_UPDATES", True)
+async def test_buffered_profile_update_error(tester: AppTester, rapidpro_mock):
+    """
+    If the buffered profile updates can't be sent, the user should get the error
+    message instead of the reply for the update that failed
+    """
+    error = rapidpro.ProfileUpdateError("error")
+    with mock.patch("yal.rapidpro.flush_profile_updates", side_effect=error):
+        await tester.user_input("AAA")
+    tester.assert_state(None)
+    tester.assert_num_messages(1)
+    tester.assert_message("Something went wrong. Please try again later.")
+
+
 @pytest.mark.asyncio
 async def test_state_start_to_mainmenu(
     tester: AppTester, rapidpro_mock, contentrepo_api_mock
@@ -1590,3 +1596,11 @@ async def test_update_settings_keyword(tester: AppTester, rapidpro_mock):
             ]
         )
     )
+
+
+def test_warm_up():
+    """
+    Warming up should load all the question sets
+    """
+    Application.warm_up()
+    assert set(assessments.QUESTIONS.loaded) == set(assessments.QUESTIONS)
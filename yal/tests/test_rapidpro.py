@@ -0,0 +1,280 @@
+import pytest
+import redis.asyncio as aioredis
+from sanic import Sanic, response
+
+from vaccine import clients, resilience
+from vaccine import config as vaccine_config
+from vaccine.testing import TState, run_sanic
+from yal import config, rapidpro
+
+
+@pytest.fixture
+async def redis():
+    redis = aioredis.from_url(
+        vaccine_config.REDIS_URL, encoding="utf-8", decode_responses=True
+    )
+    yield redis
+    for key in await redis.keys("rapidpro_profile.*"):
+        await redis.delete(key)
+    await redis.close()
+
+
+@pytest.fixture
+async def profile_cache(redis):
+    cache = rapidpro.ProfileCache(redis, ttl=60, stale_ttl=60)
+    rapidpro.set_profile_cache(cache)
+    yield cache
+    rapidpro.set_profile_cache(None)
+    await cache.close()
+
+
+@pytest.fixture
+async def rapidpro_mock():
+    Sanic.test_mode = True
+    app = Sanic("mock_rapidpro")
+    tstate = TState()
+    tstate.fields = {"province": "FS", "suburb": None}
+    tstate.globals = {"service_finder_active": "True", "facebook_survey_status": "X"}
+    tstate.group_count = 5
+
+    @app.route("/api/v2/contacts.json", methods=["GET"])
+    def get_contact(request):
+        tstate.requests.append(request)
+        return response.json(
+            {"results": [{"fields": tstate.fields}], "next": None}, status=200
+        )
+
+    @app.route("/api/v2/contacts.json", methods=["POST"])
+    def update_contact(request):
+        tstate.requests.append(request)
+        if tstate.errormax and tstate.errors < tstate.errormax:
+            tstate.errors += 1
+            return response.json({}, status=500)
+        return response.json({}, status=200)
+
+    @app.route("/api/v2/flow_starts.json", methods=["POST"])
+    def start_flow(request):
+        tstate.requests.append(request)
+        return response.json({}, status=200)
+
+    @app.route("/api/v2/globals.json", methods=["GET"])
+    def get_globals(request):
+        tstate.requests.append(request)
+        key = request.args.get("key")
+        results = [
+            {"key": k, "value": v}
+            for k, v in tstate.globals.items()
+            if key is None or k == key
+        ]
+        return response.json({"results": results, "next": None}, status=200)
+
+    @app.route("/api/v2/groups.json", methods=["GET"])
+    def get_groups(request):
+        tstate.requests.append(request)
+        return response.json(
+            {"results": [{"count": tstate.group_count}], "next": None}, status=200
+        )
+
+    async with run_sanic(app) as server:
+        url = config.RAPIDPRO_URL
+        config.RAPIDPRO_URL = f"http://{server.host}:{server.port}"
+        server.tstate = tstate
+        yield server
+        config.RAPIDPRO_URL = url
+
+
+@pytest.mark.asyncio
+async def test_get_cached_profile_no_cache(rapidpro_mock):
+    """
+    If the cache isn't enabled, should always fetch the profile from RapidPro
+    """
+    assert await rapidpro.get_cached_profile("27820001001") == (
+        False,
+        {"province": "FS", "suburb": None},
+    )
+    await rapidpro.get_cached_profile("27820001001")
+    assert len(rapidpro_mock.tstate.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_cached_profile(rapidpro_mock, profile_cache):
+    """
+    Should only fetch the profile from RapidPro if it's not cached
+    """
+    expected = (False, {"province": "FS", "suburb": None})
+    assert await rapidpro.get_cached_profile("27820001001") == expected
+    assert await rapidpro.get_cached_profile("27820001001") == expected
+    assert len(rapidpro_mock.tstate.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_cached_profile_stale(rapidpro_mock, profile_cache):
+    """
+    Stale profiles should be returned, and revalidated in the background
+    """
+    profile_cache.ttl = 0
+    await profile_cache.set("27820001001", {"province": "GP"})
+    rapidpro_mock.tstate.fields = {"province": "FS"}
+
+    assert await rapidpro.get_cached_profile("27820001001") == (
+        False,
+        {"province": "GP"},
+    )
+    await profile_cache.revalidations["27820001001"]
+    assert await profile_cache.get("27820001001") == ({"province": "FS"}, False)
+
+
+@pytest.mark.asyncio
+async def test_update_profile_writes_through(rapidpro_mock, profile_cache):
+    """
+    Updating the profile should update the cached profile, if there is one
+    """
+    await rapidpro.update_profile("27820001001", {"province": "GP"}, {})
+    assert await profile_cache.get("27820001001") == (None, False)
+
+    await rapidpro.get_cached_profile("27820001001")
+    await rapidpro.update_profile("27820001001", {"province": "GP", "suburb": None}, {})
+    assert await profile_cache.get("27820001001") == (
+        {"province": "GP", "suburb": None},
+        True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_start_flow_invalidates(rapidpro_mock, profile_cache):
+    """
+    Starting a flow should invalidate the cached profile
+    """
+    await rapidpro.get_cached_profile("27820001001")
+    await rapidpro.start_flow("27820001001", "flow-uuid")
+    assert await profile_cache.get("27820001001") == (None, False)
+
+
+@pytest.mark.asyncio
+async def test_buffer_profile_updates(rapidpro_mock):
+    """
+    Buffered updates should update the metadata immediately, and be merged into a
+    single request when flushed
+    """
+    metadata = {}
+    with rapidpro.buffer_profile_updates() as updates:
+        await rapidpro.update_profile("27820001001", {"a": "1", "b": "1"}, metadata)
+        await rapidpro.update_profile("27820001001", {"b": "2", "c": None}, metadata)
+    assert metadata == {"a": "1", "b": "2", "c": None}
+    assert rapidpro_mock.tstate.requests == []
+
+    await rapidpro.flush_profile_updates(updates)
+    [request] = rapidpro_mock.tstate.requests
+    assert request.json == {"fields": {"a": "1", "b": "2"}}
+
+
+@pytest.mark.asyncio
+async def test_buffer_profile_updates_sync(rapidpro_mock):
+    """
+    Synchronous updates should be sent immediately, along with any earlier buffered
+    updates
+    """
+    with rapidpro.buffer_profile_updates() as updates:
+        await rapidpro.update_profile("27820001001", {"a": "1", "b": "1"}, {})
+        await rapidpro.update_profile("27820001001", {"b": "2"}, {}, sync=True)
+        assert len(rapidpro_mock.tstate.requests) == 1
+    await rapidpro.flush_profile_updates(updates)
+
+    [request] = rapidpro_mock.tstate.requests
+    assert request.json == {"fields": {"a": "1", "b": "2"}}
+
+
+@pytest.mark.asyncio
+async def test_flush_profile_updates_error(rapidpro_mock):
+    """
+    If the buffered updates can't be sent, then they should be kept, and an error
+    raised so that the message is retried
+    """
+    rapidpro_mock.tstate.errormax = 3
+    with rapidpro.buffer_profile_updates() as updates:
+        await rapidpro.update_profile("27820001001", {"a": "1"}, {})
+    with pytest.raises(rapidpro.ProfileUpdateError):
+        await rapidpro.flush_profile_updates(updates)
+    assert updates == {"27820001001": {"a": "1"}}
+
+    await rapidpro.flush_profile_updates(updates)
+    assert updates == {}
+    assert rapidpro_mock.tstate.requests[-1].json == {"fields": {"a": "1"}}
+
+
+@pytest.mark.asyncio
+async def test_start_flow_flushes_updates(rapidpro_mock):
+    """
+    Buffered updates should be sent before starting a flow, since the flow might use
+    them
+    """
+    with rapidpro.buffer_profile_updates():
+        await rapidpro.update_profile("27820001001", {"a": "1"}, {})
+        await rapidpro.start_flow("27820001001", "flow-uuid")
+    assert [r.path for r in rapidpro_mock.tstate.requests] == [
+        "/api/v2/contacts.json",
+        "/api/v2/flow_starts.json",
+    ]
+
+
+@pytest.fixture
+async def globals_cache():
+    cache = rapidpro.GlobalsCache(refresh_interval=60)
+    rapidpro.set_globals_cache(cache)
+    yield cache
+    rapidpro.set_globals_cache(None)
+
+
+@pytest.mark.asyncio
+async def test_globals_cache(rapidpro_mock, globals_cache):
+    """
+    Globals and group counts should only be fetched the first time they're looked up
+    """
+    assert await rapidpro.get_global_flag("service_finder_active") is True
+    assert await rapidpro.get_global_flag("service_finder_active") is True
+    assert await rapidpro.get_global_value("facebook_survey_status") == "x"
+    assert await rapidpro.get_global_flag("missing") is False
+    assert await rapidpro.get_group_membership_count("group") == (False, 5)
+    assert await rapidpro.get_group_membership_count("group") == (False, 5)
+    assert len(rapidpro_mock.tstate.requests) == 4
+
+
+@pytest.mark.asyncio
+async def test_globals_cache_refresh(rapidpro_mock, globals_cache):
+    """
+    Refreshing should fetch all the globals in a single request
+    """
+    await rapidpro.get_global_flag("service_finder_active")
+    await rapidpro.get_global_value("facebook_survey_status")
+    await rapidpro.get_group_membership_count("group")
+    rapidpro_mock.tstate.requests = []
+    rapidpro_mock.tstate.globals = {"service_finder_active": "False"}
+    rapidpro_mock.tstate.group_count = 6
+
+    globals_cache.refreshed_at = 0
+    await globals_cache.refresh()
+    assert len(rapidpro_mock.tstate.requests) == 2
+    assert globals_cache.refreshed_at > 0
+    assert await rapidpro.get_global_flag("service_finder_active") is False
+    assert await rapidpro.get_global_value("facebook_survey_status") is False
+    assert await rapidpro.get_group_membership_count("group") == (False, 6)
+    assert len(rapidpro_mock.tstate.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_profile_circuit_open(rapidpro_mock):
+    """
+    If RapidPro's circuit breaker is open, should return an error without making a
+    request
+    """
+    registry = clients.ClientRegistry()
+    clients.set_registry(registry)
+    breaker = resilience.get_breaker("rapidpro")
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    try:
+        assert await rapidpro.get_profile("27820001001") == (True, {})
+    finally:
+        clients.set_registry(None)
+        await registry.close()
+    assert rapidpro_mock.tstate.requests == []
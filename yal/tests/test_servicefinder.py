@@ -6,6 +6,7 @@ from unittest import mock
 import pytest
 from sanic import Sanic, response
 
+from vaccine.models import Message
 from vaccine.testing import AppTester, TState, run_sanic
 from yal import config
 from yal.main import Application
@@ -493,6 +494,48 @@ async def test_state_category_talk(get_current_datetime, tester: AppTester):
     tester.assert_metadata("servicefinder_breadcrumb", "*Get help near you*")
 
 
+@pytest.mark.asyncio
+async def test_state_save_parent_category_expired(
+    tester: AppTester, servicefinder_mock, rapidpro_mock
+):
+    """
+    If the categories expired from the blob store, they should be fetched again
+    """
+    tester.setup_state("state_save_parent_category")
+    tester.setup_answer("state_category", "62dd86c14d7d919468144ed4")
+    tester.user.metadata["categories"] = {"$blob": "expired"}
+    tester.user.metadata["parent_category"] = "root"
+    tester.user.metadata["servicefinder_breadcrumb"] = "*Get help near you*"
+
+    await tester.user_input(session=Message.SESSION_EVENT.NEW)
+
+    tester.assert_state("state_category")
+    assert tester.user.metadata["categories"] == get_processed_categories()
+    assert [r.path for r in servicefinder_mock.tstate.requests] == ["/api/categories"]
+
+
+@pytest.mark.asyncio
+async def test_state_display_facilities_expired(
+    tester: AppTester, servicefinder_mock, rapidpro_mock
+):
+    """
+    If the categories expired from the blob store, they should be fetched again before
+    displaying the facilities
+    """
+    tester.setup_state("state_display_facilities")
+    tester.setup_answer("state_category", "62dd86d24d7d919468144ed5")
+    tester.user.metadata["categories"] = {"$blob": "expired"}
+    tester.user.metadata["facilities"] = FACILITIES
+    tester.user.metadata["parent_category"] = "root"
+    tester.user.metadata["servicefinder_breadcrumb"] = "*Get help near you*"
+
+    await tester.user_input(session=Message.SESSION_EVENT.NEW)
+
+    tester.assert_state("state_category")
+    assert [r.path for r in servicefinder_mock.tstate.requests] == ["/api/categories"]
+    assert rapidpro_mock.tstate.requests == []
+
+
 @pytest.mark.asyncio
 async def test_state_location(
     tester: AppTester, servicefinder_mock, google_api_mock, rapidpro_mock
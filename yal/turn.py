@@ -3,6 +3,7 @@ from urllib.parse import ParseResult, urlunparse
 
 import aiohttp
 
+from vaccine import clients, resilience
 from vaccine.utils import HTTP_EXCEPTIONS
 from yal import config
 
@@ -10,12 +11,8 @@ logger = logging.getLogger(__name__)
 
 
 def get_turn_api():
-    # TODO: Cache the session globally. Things that don't work:
-    # - Declaring the session at the top of the file
-    #   You get a `Timeout context manager should be used inside a task` error
-    # - Declaring it here but caching it in a global variable for reuse
-    #   You get a `Event loop is closed` error
-    return aiohttp.ClientSession(
+    return clients.get_session(
+        "turn",
         timeout=aiohttp.ClientTimeout(total=5),
         headers={
             "Content-Type": "application/json",
@@ -41,18 +38,15 @@ def get_turn_url(path: str) -> str:
 
 async def label_message(message_id, label):
     async with get_turn_api() as session:
-        for i in range(3):
-            try:
-                response = await session.post(
-                    url=get_turn_url(f"v1/messages/{message_id}/labels"),
-                    json={"labels": [label]},
-                )
-                response.raise_for_status()
-                break
-            except HTTP_EXCEPTIONS as e:
-                if i == 2:
-                    logger.exception(e)
-                    return True
-                else:
-                    continue
+        try:
+            async for attempt in resilience.retrying("turn"):
+                with attempt:
+                    response = await session.post(
+                        url=get_turn_url(f"v1/messages/{message_id}/labels"),
+                        json={"labels": [label]},
+                    )
+                    response.raise_for_status()
+        except HTTP_EXCEPTIONS as e:
+            logger.exception(e)
+            return True
     return False
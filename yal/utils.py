@@ -2,21 +2,19 @@ import random
 import re
 from csv import reader
 from datetime import datetime, timedelta, timezone
+from functools import cache
+from importlib import resources
 from typing import Any, Optional
 
 import phonenumbers
-import pkg_resources
-import pycountry
 from emoji import emoji_list
 from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
 
+from vaccine.utils import import_pycountry
 from yal import config, rapidpro
 
 TZ_SAST = timezone(timedelta(hours=2), "SAST")
-PROVINCES = sorted(
-    (s.code.split("-")[1], s.name.split(" (")[0])
-    for s in pycountry.subdivisions.get(country_code="ZA")
-)
 GENERIC_ERRORS = (
     "Oh oh 👀, I don't understand your reply. But don't worry, we can try again. This "
     "time, please reply with the number that matches your choice.👍🏽",
@@ -48,6 +46,9 @@ BACK_TO_MAIN = "0. 🏠 Back to Main *MENU*"
 GET_HELP = "#. 🆘Get *HELP*"
 PERSONA_FIELDS = ["persona_emoji", "persona_name"]
 PERSONA_DEFAULTS = {"persona_emoji": "🤖", "persona_name": "B-wise"}
+PERSONA_PATTERN = re.compile(
+    r"\[(" + "|".join(re.escape(key) for key in PERSONA_FIELDS) + r")\]"
+)
 
 
 def get_generic_error():
@@ -64,8 +65,11 @@ def get_current_datetime():
     return datetime.now(tz=TZ_SAST)
 
 
+CLEAN_INBOUND_PATTERN = re.compile(r"[^\w#]+")
+
+
 def clean_inbound(content):
-    return re.sub(r"[^\w#]+", " ", content or "").strip().lower()
+    return CLEAN_INBOUND_PATTERN.sub(" ", content or "").strip().lower()
 
 
 def get_bot_age():
@@ -96,24 +100,49 @@ def extract_first_emoji(persona_emoji):
     return ""
 
 
+def get_persona_field(key, metadata):
+    value = metadata.get(key)
+    if value and value.lower() not in ["skip", ""]:
+        if key == "persona_emoji":
+            value = extract_first_emoji(value)
+        return re.sub(r"\s+", " ", value)
+    return PERSONA_DEFAULTS[key]
+
+
 def replace_persona_fields(text, metadata=None):
+    # Most messages don't have any persona fields, so check before doing any work
+    if "[persona_" not in text:
+        return text
     if metadata is None:
         metadata = {}
-    for key in PERSONA_FIELDS:
-        value = metadata.get(key)
-        if value and value.lower() not in ["skip", ""]:
-            if key == "persona_emoji":
-                value = extract_first_emoji(value)
-            text = text.replace(f"[{key}]", re.sub(r"\s+", " ", value))
-        else:
-            text = text.replace(f"[{key}]", PERSONA_DEFAULTS[key])
-    return text
+    values = {}
+
+    def get_value(match):
+        key = match[1]
+        if key not in values:
+            values[key] = get_persona_field(key, metadata)
+        return values[key]
+
+    return PERSONA_PATTERN.sub(get_value, text)
+
+
+@cache
+def get_provinces() -> list[tuple[str, str]]:
+    """
+    Returns the (code, name) for each South African province, loading them the first
+    time they're needed
+    """
+    pycountry = import_pycountry()
+    return sorted(
+        (s.code.split("-")[1], s.name.split(" (")[0])
+        for s in pycountry.subdivisions.get(country_code="ZA")
+    )
 
 
+@cache
 def get_keywords(name):
     keywords = []
-    filename = pkg_resources.resource_filename("yal", f"keywords/{name}.csv")
-    with open(filename) as keyword_file:
+    with resources.files("yal").joinpath(f"keywords/{name}.csv").open() as keyword_file:
         csvreader = reader(keyword_file)
         next(csvreader)
         for row in csvreader:
@@ -127,6 +156,7 @@ def check_keyword(keyword, keyword_list):
             keyword,
             keyword_list,
             scorer=fuzz.ratio,
+            processor=default_process,
             score_cutoff=76,
         )
     )